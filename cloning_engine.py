@@ -16,6 +16,9 @@ from message_engine import MessageEngine
 from data_manager import get_user_config, data_manager
 from config import DEFAULT_USER_CONFIG
 from task_state_manager import get_global_task_state_manager, TaskStatus
+from latency_histogram import LatencyRecorder
+from task_resource_tracker import get_global_resource_tracker
+from memory_optimizer import get_global_memory_optimizer, estimate_container_bytes, evict_mapping, CACHE_PRIORITY_CHEAP
 
 # 配置日志 - 使用优化的日志配置
 from log_config import get_logger
@@ -245,10 +248,28 @@ class CloningEngine:
         self.last_cache_cleanup = 0  # 上次缓存清理时间
         self.cache_cleanup_interval = 300  # 缓存清理间隔（秒）
         self.max_memory_messages = 1000  # 最大内存消息数
+        get_global_memory_optimizer(bot_id).register_cache(
+            f"cloning_engine.message_cache:{bot_id}", self._estimate_message_cache_bytes,
+            self._evict_message_cache, priority=CACHE_PRIORITY_CHEAP
+        )
+        
+        # 发送延迟直方图（发送耗时、源频道发帖->目标频道发出）
+        self.latency = LatencyRecorder()
+        
+        # 按任务统计缓冲消息和API调用（供并发任务管理器做准入估计）
+        self.resource_tracker = get_global_resource_tracker(bot_id)
         
         # 进度回调
         self.progress_callback: Optional[Callable] = None
     
+    def _estimate_message_cache_bytes(self) -> int:
+        """估算消息缓存占用（供内存优化器使用）"""
+        return estimate_container_bytes(self.message_cache)
+    
+    def _evict_message_cache(self, fraction: float):
+        """淘汰最旧的一部分消息缓存（供内存优化器使用）"""
+        evict_mapping(self.message_cache, fraction)
+    
     async def _cleanup_message_cache(self):
         """清理消息缓存，释放内存"""
         try:
@@ -1111,6 +1132,7 @@ class CloningEngine:
     
     async def _execute_cloning_background(self, task: CloneTask):
         """后台执行搬运任务"""
+        self.resource_tracker.begin_task(task.task_id, 'clone')
         try:
             logger.info(f"🔧 [DEBUG] 进入后台执行方法: {task.task_id}")
             logger.info(f"🚀 开始后台执行搬运任务: {task.task_id}")
@@ -1182,6 +1204,9 @@ class CloningEngine:
             # 清理后台任务引用
             if task.task_id in self.background_tasks:
                 del self.background_tasks[task.task_id]
+        finally:
+            # 结束资源统计（暂停的任务在恢复时重新开始统计）
+            self.resource_tracker.end_task(task.task_id)
     
     async def _execute_cloning(self, task: CloneTask) -> bool:
         """执行搬运逻辑（改为流式处理，支持断点续传）"""
@@ -1225,6 +1250,8 @@ class CloningEngine:
             if not first_batch:
                 logger.info("没有找到需要搬运的消息")
                 return True
+            self.resource_tracker.record_api_call(task.task_id)
+            self.resource_tracker.set_buffered(task.task_id, first_batch)
             
             # 计算总消息数 - 修复版本
             if actual_start_id and task.end_id:
@@ -1322,6 +1349,7 @@ class CloningEngine:
                     batch_end = min(current_id + batch_size - 1, end_id)
                     
                     # 如果有预取任务，等待其完成
+                    self.resource_tracker.record_api_call(task.task_id)
                     if next_batch_task:
                         try:
                             batch_messages = await next_batch_task
@@ -1356,6 +1384,7 @@ class CloningEngine:
                                 sub_message_ids = list(range(sub_current, sub_end + 1))
                                 
                                 try:
+                                    self.resource_tracker.record_api_call(task.task_id)
                                     sub_messages = await self.client.get_messages(
                                         task.source_chat_id,
                                         message_ids=sub_message_ids
@@ -1446,6 +1475,12 @@ class CloningEngine:
                     
                     logger.info(f"🚀 并发处理批次 {processed_batches + 1}（同时预取下一批次，批次大小: {len(valid_messages)}）")
                     
+                    # 当前批次 + 预取中的下一批次都计入任务的缓冲占用
+                    self.resource_tracker.set_buffered(
+                        task.task_id, valid_messages,
+                        pending_count=next_batch_end - next_current_id + 1 if next_batch_task else 0
+                    )
+                    
                     # 记录批次开始时间
                     batch_start_time = time.time()
                     
@@ -1866,7 +1901,9 @@ class CloningEngine:
             logger.info(f"📤 发送 {message_type} {message_id}")
             
             # 重试机制
+            send_start = time.time()
             for attempt in range(self.retry_attempts):
+                self.resource_tracker.record_api_call(task.task_id)
                 try:
                     if original_message.media:
                         # 媒体消息
@@ -1877,6 +1914,11 @@ class CloningEngine:
                     
                     if success:
                         logger.info(f"✅ {message_type} {message_id} 发送成功")
+                        send_end = time.time()
+                        self.latency.record('send_duration', send_end - send_start, task.task_id, task.target_chat_id)
+                        if getattr(original_message, 'date', None):
+                            self.latency.record('source_to_target', send_end - original_message.date.timestamp(),
+                                                task.task_id, task.target_chat_id)
                         # 标记消息为已处理（成功发送后）
                         task.mark_message_processed(message_id)
                         return True
@@ -2090,6 +2132,7 @@ class CloningEngine:
                     # 添加超时保护（30秒超时）
                     logger.debug(f"⏰ 开始发送媒体组，设置30秒超时...")
                     start_send_time = time.time()
+                    self.resource_tracker.record_api_call(task.task_id)
                     
                     result = await asyncio.wait_for(
                         self.client.send_media_group(
@@ -2557,6 +2600,7 @@ class CloningEngine:
         
         # 从活动任务中移除
         del self.active_tasks[task_id]
+        self.resource_tracker.end_task(task_id)
         
         logger.info(f"✅ 任务已成功取消: {task_id}")
         return True
@@ -2618,6 +2662,8 @@ class CloningEngine:
             'batch_size': self.batch_size,
             'user_task_stats': user_task_stats,
             'channel_stats': channel_stats,
+            'latency': self.latency.get_snapshot(),
+            'resources': self.resource_tracker.get_snapshot(self.active_tasks.keys()),
             'system_load': {
                 'active_channels': len(set([t.source_chat_id for t in self.active_tasks.values()])),
                 'total_channels': len(set([t.source_chat_id for t in self.active_tasks.values()] + [t.target_chat_id for t in self.active_tasks.values()]))
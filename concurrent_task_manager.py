@@ -12,11 +12,12 @@ from typing import Dict, List, Any, Optional, Set, Callable
 from dataclasses import dataclass
 from enum import Enum
 import threading
-from collections import defaultdict, deque
+from collections import defaultdict, deque, OrderedDict
 import psutil
 import gc
 
-from task_state_manager import get_global_task_state_manager, TaskStatus, TaskProgress
+from task_state_manager import get_global_task_state_manager, TaskStatus, TaskProgress, FINISHED_STATUSES
+from task_resource_tracker import get_global_resource_tracker, detect_memory_limit_mb
 
 logger = logging.getLogger(__name__)
 
@@ -29,9 +30,10 @@ class TaskPriority(Enum):
 
 @dataclass
 class TaskResource:
-    """任务资源需求"""
-    memory_mb: int = 100  # 内存需求（MB）
+    """任务资源需求（入队时未指定则按任务类型的实测滚动估计填充）"""
+    memory_mb: float = 100  # 内存需求（MB）
     cpu_percent: float = 10.0  # CPU需求（百分比）
+    api_rate: float = 1.0  # API调用速率需求（次/秒）
     network_bandwidth: int = 1  # 网络带宽需求（相对值）
     max_concurrent: int = 1  # 最大并发数
 
@@ -44,6 +46,8 @@ class TaskSlot:
     created_at: float
     started_at: Optional[float] = None
     estimated_duration: float = 0.0  # 预计持续时间（秒）
+    user_id: Optional[str] = None  # 所属用户
+    task_type: str = "clone"  # 任务类型（clone/monitoring），用于按类型估计资源
 
 class ConcurrentTaskManager:
     """并发任务管理器"""
@@ -53,32 +57,57 @@ class ConcurrentTaskManager:
         self.bot_id = bot_id
         self.task_state_manager = get_global_task_state_manager(bot_id)
         
-        # 任务队列（按优先级排序）
-        self.task_queues = {
-            TaskPriority.URGENT: deque(),
-            TaskPriority.HIGH: deque(),
-            TaskPriority.NORMAL: deque(),
-            TaskPriority.LOW: deque()
+        # 任务队列（按优先级排序，每个优先级内按用户分子队列，用差额轮询(DRR)公平出队）
+        # priority -> OrderedDict(user_id -> deque[TaskSlot])，OrderedDict的顺序即轮询顺序
+        self.task_queues: Dict[TaskPriority, "OrderedDict[str, deque]"] = {
+            TaskPriority.URGENT: OrderedDict(),
+            TaskPriority.HIGH: OrderedDict(),
+            TaskPriority.NORMAL: OrderedDict(),
+            TaskPriority.LOW: OrderedDict()
         }
+        # priority -> user_id -> 差额计数
+        self._drr_deficits: Dict[TaskPriority, Dict[str, float]] = {priority: {} for priority in TaskPriority}
+        self.user_weights: Dict[str, float] = {}  # 用户权重（默认1.0），权重越大每轮可启动的任务越多
+        self.user_task_limits: Dict[str, int] = {}  # 单个用户的并发上限（覆盖max_user_tasks）
+        self._task_users: Dict[str, str] = {}  # task_id -> user_id
         
         # 运行中的任务
         self.running_tasks: Dict[str, TaskSlot] = {}
         self.running_tasks_lock = threading.RLock()
         
-        # 资源限制
-        self.max_memory_mb = psutil.virtual_memory().total // (1024 * 1024) * 0.8  # 80%系统内存
+        # 资源限制（内存按容器上限计算，Render等平台上整机内存远大于实例可用内存）
+        memory_limit_mb = detect_memory_limit_mb() or psutil.virtual_memory().total // (1024 * 1024)
+        self.max_memory_mb = memory_limit_mb * 0.8  # 80%可用内存
         self.max_cpu_percent = 80.0  # 80%CPU使用率
+        self.max_api_rate = 10.0  # 所有运行中任务合计的API调用速率上限（次/秒）
+        
+        # 按任务实测资源（搬运引擎和监听引擎上报），准入时按任务类型的滚动估计预留
+        self.resource_tracker = get_global_resource_tracker(bot_id)
+        self._process = psutil.Process()
+        self._admission_deferred = False  # 是否有任务因资源预估不足而等待
         self.max_concurrent_tasks = 10  # 最大并发任务数
-        self.max_user_tasks = 5  # 每用户最大并发任务数
+        self.max_user_tasks = 5  # 每用户最大并发任务数（只在其他用户有任务排队时生效）
         
         # 用户任务计数
         self.user_task_counts: Dict[str, int] = defaultdict(int)
         self.user_task_counts_lock = threading.RLock()
         
-        # 任务调度器
+        # 任务调度器（事件驱动：入队、完成、失败、资源释放时唤醒）
         self.scheduler_task = None
         self.scheduler_running = False
-        self.scheduler_interval = 5.0  # 调度间隔（秒）
+        self.scheduler_interval = 60.0  # 兜底调度间隔（秒），正常情况下由事件唤醒
+        self._schedule_event = asyncio.Event()
+        
+        # 资源采样（在线程池中执行，不阻塞事件循环）
+        self.resource_sampler_task = None
+        self.resource_sample_interval = 2.0  # 资源采样间隔（秒）
+        self._resources_exhausted = False
+        
+        # 已结束但尚未从运行列表移除的任务: task_id -> 结束状态
+        self._finished_tasks: Dict[str, TaskStatus] = {}
+        # 已入队但尚未登记为运行中时就收到的结束事件: task_id -> 结束状态（登记槽位时补上）
+        self._early_finished: Dict[str, TaskStatus] = {}
+        self.task_state_manager.add_status_listener(self._on_task_status_changed)
         
         # 统计信息
         self.stats = {
@@ -104,7 +133,9 @@ class ConcurrentTaskManager:
             return
         
         self.scheduler_running = True
+        self.resource_sampler_task = asyncio.create_task(self._resource_sampler_loop())
         self.scheduler_task = asyncio.create_task(self._scheduler_loop())
+        self._wake_scheduler()
         logger.info("✅ 任务调度器已启动")
     
     async def stop_scheduler(self):
@@ -113,46 +144,120 @@ class ConcurrentTaskManager:
             return
         
         self.scheduler_running = False
-        if self.scheduler_task:
-            self.scheduler_task.cancel()
-            try:
-                await self.scheduler_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self.scheduler_task, self.resource_sampler_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         logger.info("✅ 任务调度器已停止")
     
+    def _wake_scheduler(self):
+        """唤醒调度器"""
+        self._schedule_event.set()
+    
+    def _on_task_status_changed(self, task_id: str, status: TaskStatus):
+        """任务状态变化：运行中任务结束时记录并唤醒调度器"""
+        if status not in FINISHED_STATUSES:
+            return
+        if task_id in self.running_tasks:
+            self._finished_tasks[task_id] = status
+            self._wake_scheduler()
+        elif task_id in self._task_users:
+            # 启动回调中或登记槽位前任务就已结束，登记时再处理
+            self._early_finished[task_id] = status
+    
+    def notify_task_finished(self, task_id: str, status: TaskStatus = TaskStatus.COMPLETED):
+        """外部通知任务结束（未经过任务状态管理器的任务）"""
+        self._on_task_status_changed(task_id, status)
+    
     async def _scheduler_loop(self):
-        """任务调度循环"""
+        """任务调度循环 - 等待事件唤醒，兜底间隔防止遗漏"""
         while self.scheduler_running:
             try:
+                try:
+                    await asyncio.wait_for(self._schedule_event.wait(), timeout=self.scheduler_interval)
+                except asyncio.TimeoutError:
+                    # 兜底调度：核对运行中任务的实际状态，补上遗漏的结束事件
+                    await self._reconcile_running_tasks()
+                self._schedule_event.clear()
                 await self._schedule_tasks()
-                await asyncio.sleep(self.scheduler_interval)
             except asyncio.CancelledError:
                 break
             except Exception as e:
                 logger.error(f"任务调度器异常: {e}")
                 await asyncio.sleep(1.0)
     
+    async def _reconcile_running_tasks(self):
+        """与任务状态管理器核对运行中任务，已结束的登记为待移除"""
+        with self.running_tasks_lock:
+            task_ids = [task_id for task_id in self.running_tasks if task_id not in self._finished_tasks]
+        
+        for task_id in task_ids:
+            try:
+                progress = await self.task_state_manager.get_task(task_id)
+            except Exception as e:
+                logger.warning(f"核对任务状态失败 {task_id}: {e}")
+                continue
+            if progress and progress.status in FINISHED_STATUSES and task_id in self.running_tasks:
+                logger.info(f"兜底核对发现已结束的任务: {task_id} ({progress.status.value})")
+                self._finished_tasks[task_id] = progress.status
+    
+    async def _resource_sampler_loop(self):
+        """资源采样循环 - 在线程池中读取系统资源，资源恢复时唤醒调度器"""
+        loop = asyncio.get_running_loop()
+        while self.scheduler_running:
+            try:
+                await loop.run_in_executor(None, self._sample_system_resources)
+                
+                exhausted = (self.stats['current_memory_usage'] > self.max_memory_mb or
+                             self.stats['current_cpu_usage'] > self.max_cpu_percent)
+                # 资源恢复，或有任务因预估不足等待时（实测占用可能已下降），唤醒调度器
+                if not exhausted and (self._resources_exhausted or self._admission_deferred):
+                    self._wake_scheduler()
+                self._resources_exhausted = exhausted
+                
+                await asyncio.sleep(self.resource_sample_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"资源采样失败: {e}")
+                await asyncio.sleep(self.resource_sample_interval)
+    
+    def _sample_system_resources(self):
+        """读取本进程的资源使用情况（在线程池中执行）"""
+        self.stats['current_memory_usage'] = self._process.memory_info().rss // (1024 * 1024)
+        # interval=None 返回距上次调用的平均值，不阻塞
+        self.stats['current_cpu_usage'] = psutil.cpu_percent(interval=None)
+    
     async def _schedule_tasks(self):
         """调度任务"""
         try:
-            # 更新系统资源使用情况
+            # 先移除已结束的任务，释放槽位
+            await self._cleanup_completed_tasks()
+            
+            # 更新队列统计
             self._update_system_stats()
             
             # 检查是否有可用的资源来启动新任务
+            self._admission_deferred = False
             while self._can_start_new_task():
                 # 从队列中获取下一个任务
                 task_slot = self._get_next_task()
                 if not task_slot:
                     break
                 
+                # 按任务类型的实测估计检查剩余资源，不足时放回队首等待
+                if not self._fits_resource_budget(task_slot):
+                    self._requeue_front(task_slot)
+                    self._admission_deferred = True
+                    break
+                
                 # 启动任务
                 await self._start_task(task_slot)
             
-            # 清理已完成的任务
-            await self._cleanup_completed_tasks()
-            
         except Exception as e:
             logger.error(f"调度任务失败: {e}")
     
@@ -171,24 +276,118 @@ class ConcurrentTaskManager:
         
         return True
     
+    def _fits_resource_budget(self, task_slot: TaskSlot) -> bool:
+        """按实测占用和预估检查能否再启动一个任务
+        
+        预计内存 = 进程当前RSS + 运行中任务尚未用到的预留（预估 - 实测） + 新任务预估；
+        预计API速率 = 运行中任务的 max(实测, 预估) 之和 + 新任务预估。
+        没有运行中任务时总是允许启动，避免预估偏大导致饿死。
+        """
+        with self.running_tasks_lock:
+            running = list(self.running_tasks.values())
+        if not running:
+            return True
+        
+        tracker = self.resource_tracker
+        reserved_memory = sum(max(0.0, slot.resource.memory_mb - tracker.get_task_memory_mb(slot.task_id))
+                              for slot in running)
+        projected_memory = self.stats['current_memory_usage'] + reserved_memory + task_slot.resource.memory_mb
+        if projected_memory > self.max_memory_mb:
+            logger.debug(f"预计内存不足，暂缓启动 {task_slot.task_id}: {projected_memory:.0f}/{self.max_memory_mb:.0f}MB")
+            return False
+        
+        projected_api_rate = sum(max(slot.resource.api_rate, tracker.get_task_api_rate(slot.task_id))
+                                 for slot in running) + task_slot.resource.api_rate
+        if projected_api_rate > self.max_api_rate:
+            logger.debug(f"预计API速率超限，暂缓启动 {task_slot.task_id}: {projected_api_rate:.1f}/{self.max_api_rate}次/秒")
+            return False
+        
+        return True
+    
+    def _requeue_front(self, task_slot: TaskSlot):
+        """把已出队但未启动的任务放回其用户子队列的队首，并退还差额"""
+        user_queues = self.task_queues[task_slot.priority]
+        user_id = task_slot.user_id or ''
+        if user_id not in user_queues:
+            user_queues[user_id] = deque()
+            user_queues.move_to_end(user_id, last=False)
+        user_queues[user_id].appendleft(task_slot)
+        deficits = self._drr_deficits[task_slot.priority]
+        deficits[user_id] = deficits.get(user_id, 0.0) + 1
+    
     def _get_next_task(self) -> Optional[TaskSlot]:
-        """获取下一个要执行的任务"""
-        # 按优先级顺序检查队列
+        """获取下一个要执行的任务 - 优先级之间严格优先，同一优先级内按用户差额轮询"""
         for priority in [TaskPriority.URGENT, TaskPriority.HIGH, TaskPriority.NORMAL, TaskPriority.LOW]:
-            if self.task_queues[priority]:
-                task_slot = self.task_queues[priority].popleft()
-                
-                # 检查用户任务限制
-                user_id = self._get_task_user_id(task_slot.task_id)
-                if user_id and self.user_task_counts[user_id] >= self.max_user_tasks:
-                    # 放回队列末尾
-                    self.task_queues[priority].append(task_slot)
-                    continue
-                
+            task_slot = self._drr_dequeue(priority)
+            if task_slot:
+                return task_slot
+        
+        return None
+    
+    def _drr_dequeue(self, priority: TaskPriority) -> Optional[TaskSlot]:
+        """差额轮询：每个用户每轮获得与权重相等的额度，每启动一个任务消耗1"""
+        user_queues = self.task_queues[priority]
+        deficits = self._drr_deficits[priority]
+        if not user_queues:
+            return None
+        
+        eligible = [user_id for user_id in user_queues if not self._user_at_limit(user_id)]
+        if not eligible:
+            return None
+        
+        # 每个合格用户至少在 ceil(1/最小权重) 轮内积累到1的额度
+        min_weight = min(self._get_user_weight(user_id) for user_id in eligible)
+        max_visits = len(user_queues) * (int(1 / min_weight) + 2)
+        
+        for _ in range(max_visits):
+            user_id = next(iter(user_queues))
+            if self._user_at_limit(user_id):
+                user_queues.move_to_end(user_id)
+                continue
+            
+            if deficits.get(user_id, 0.0) < 1:
+                deficits[user_id] = deficits.get(user_id, 0.0) + self._get_user_weight(user_id)
+            
+            if deficits[user_id] >= 1:
+                queue = user_queues[user_id]
+                task_slot = queue.popleft()
+                deficits[user_id] -= 1
+                if not queue:
+                    # 队列清空的用户退出轮询，额度清零
+                    del user_queues[user_id]
+                    deficits.pop(user_id, None)
+                elif deficits[user_id] < 1:
+                    user_queues.move_to_end(user_id)
                 return task_slot
+            
+            user_queues.move_to_end(user_id)
         
         return None
     
+    def _get_user_weight(self, user_id: str) -> float:
+        """获取用户权重"""
+        return max(self.user_weights.get(user_id, 1.0), 0.01)
+    
+    def _user_over_limit(self, user_id: str) -> bool:
+        """用户运行中的任务是否已达到并发上限"""
+        limit = self.user_task_limits.get(user_id, self.max_user_tasks)
+        return self.user_task_counts.get(user_id, 0) >= limit
+    
+    def _user_at_limit(self, user_id: str) -> bool:
+        """用户是否应被限流：超过上限且有未超限的其他用户在排队（空闲容量可被超限用户用满）"""
+        if not self._user_over_limit(user_id):
+            return False
+        return any(other != user_id and not self._user_over_limit(other)
+                   for user_queues in self.task_queues.values() for other in user_queues)
+    
+    def set_user_weight(self, user_id: str, weight: float):
+        """设置用户调度权重"""
+        self.user_weights[str(user_id)] = weight
+    
+    def set_user_task_limit(self, user_id: str, limit: int):
+        """设置单个用户的并发上限"""
+        self.user_task_limits[str(user_id)] = limit
+    
     async def _start_task(self, task_slot: TaskSlot):
         """启动任务"""
         try:
@@ -196,6 +395,12 @@ class ConcurrentTaskManager:
             
             with self.running_tasks_lock:
                 self.running_tasks[task_slot.task_id] = task_slot
+                
+                # 登记前已收到结束事件的任务，直接标记为待移除
+                early_status = self._early_finished.pop(task_slot.task_id, None)
+                if early_status is not None:
+                    self._finished_tasks[task_slot.task_id] = early_status
+                    self._wake_scheduler()
             
             # 更新用户任务计数
             user_id = self._get_task_user_id(task_slot.task_id)
@@ -219,30 +424,17 @@ class ConcurrentTaskManager:
             logger.error(f"启动任务失败 {task_slot.task_id}: {e}")
     
     async def _cleanup_completed_tasks(self):
-        """清理已完成的任务"""
+        """清理已完成的任务（由状态变化事件登记，无需逐个查询任务状态）"""
         try:
-            completed_tasks = []
-            
-            with self.running_tasks_lock:
-                for task_id, task_slot in list(self.running_tasks.items()):
-                    # 检查任务状态
-                    task_progress = await self.task_state_manager.get_task(task_id)
-                    if not task_progress:
-                        # 任务不存在，清理
-                        completed_tasks.append(task_id)
-                        continue
-                    
-                    if task_progress.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
-                        completed_tasks.append(task_id)
+            finished_tasks, self._finished_tasks = self._finished_tasks, {}
             
-            # 清理已完成的任务
-            for task_id in completed_tasks:
-                await self._remove_task(task_id)
+            for task_id, status in finished_tasks.items():
+                await self._remove_task(task_id, status)
             
         except Exception as e:
             logger.error(f"清理完成任务失败: {e}")
     
-    async def _remove_task(self, task_id: str):
+    async def _remove_task(self, task_id: str, status: Optional[TaskStatus] = None):
         """移除任务"""
         try:
             with self.running_tasks_lock:
@@ -251,18 +443,19 @@ class ConcurrentTaskManager:
                     del self.running_tasks[task_id]
                     
                     # 更新用户任务计数
-                    user_id = self._get_task_user_id(task_id)
+                    user_id = self._task_users.pop(task_id, None)
                     if user_id:
                         with self.user_task_counts_lock:
                             self.user_task_counts[user_id] = max(0, self.user_task_counts[user_id] - 1)
                     
                     # 更新统计信息
-                    task_progress = await self.task_state_manager.get_task(task_id)
-                    if task_progress:
-                        if task_progress.status == TaskStatus.COMPLETED:
-                            self.stats['total_completed'] += 1
-                        elif task_progress.status == TaskStatus.FAILED:
-                            self.stats['total_failed'] += 1
+                    if status == TaskStatus.COMPLETED:
+                        self.stats['total_completed'] += 1
+                    elif status == TaskStatus.FAILED:
+                        self.stats['total_failed'] += 1
+                    
+                    # 槽位释放，唤醒调度器启动排队任务
+                    self._wake_scheduler()
                     
                     logger.debug(f"任务已移除: {task_id}")
             
@@ -270,46 +463,60 @@ class ConcurrentTaskManager:
             logger.error(f"移除任务失败 {task_id}: {e}")
     
     def _get_task_user_id(self, task_id: str) -> Optional[str]:
-        """获取任务所属用户ID"""
-        # 这里需要从任务状态管理器中获取用户ID
-        # 简化实现，实际应该从数据库查询
-        return None
+        """获取任务所属用户ID（入队时记录）"""
+        return self._task_users.get(task_id)
+    
+    def _queue_length(self, priority: TaskPriority) -> int:
+        """获取优先级队列中排队的任务数"""
+        return sum(len(queue) for queue in self.task_queues[priority].values())
+    
+    def _user_queue_lengths(self) -> Dict[str, int]:
+        """获取每个用户排队的任务数"""
+        lengths: Dict[str, int] = defaultdict(int)
+        for user_queues in self.task_queues.values():
+            for user_id, queue in user_queues.items():
+                lengths[user_id] += len(queue)
+        return dict(lengths)
     
     def _update_system_stats(self):
-        """更新系统统计信息"""
+        """更新队列统计信息（系统资源由采样循环在线程池中更新）"""
         try:
-            # 更新内存使用情况
-            memory_info = psutil.virtual_memory()
-            self.stats['current_memory_usage'] = memory_info.used // (1024 * 1024)
-            
-            # 更新CPU使用情况
-            self.stats['current_cpu_usage'] = psutil.cpu_percent(interval=0.1)
-            
             # 更新队列长度
             for priority in TaskPriority:
-                self.stats['queue_lengths'][priority.value] = len(self.task_queues[priority])
+                self.stats['queue_lengths'][priority.value] = self._queue_length(priority)
             
         except Exception as e:
             logger.error(f"更新系统统计信息失败: {e}")
     
     async def queue_task(self, task_id: str, user_id: str, priority: TaskPriority = TaskPriority.NORMAL,
-                        resource: TaskResource = None, estimated_duration: float = 0.0) -> bool:
-        """将任务加入队列"""
+                        resource: TaskResource = None, estimated_duration: float = 0.0,
+                        task_type: str = "clone") -> bool:
+        """将任务加入队列（未指定资源需求时使用该任务类型的实测滚动估计）"""
         try:
             if resource is None:
-                resource = TaskResource()
+                estimate = self.resource_tracker.get_type_estimate(task_type)
+                resource = TaskResource(memory_mb=estimate['memory_mb'], api_rate=estimate['api_rate'])
             
+            user_id = str(user_id) if user_id is not None else ''
             task_slot = TaskSlot(
                 task_id=task_id,
                 priority=priority,
                 resource=resource,
                 created_at=time.time(),
-                estimated_duration=estimated_duration
+                estimated_duration=estimated_duration,
+                user_id=user_id,
+                task_type=task_type
             )
             
-            # 添加到对应优先级的队列
-            self.task_queues[priority].append(task_slot)
+            # 添加到对应优先级下该用户的子队列（丢弃该任务ID上一次运行遗留的结束事件）
+            self._task_users[task_id] = user_id
+            self._early_finished.pop(task_id, None)
+            user_queues = self.task_queues[priority]
+            if user_id not in user_queues:
+                user_queues[user_id] = deque()
+            user_queues[user_id].append(task_slot)
             self.stats['total_queued'] += 1
+            self._wake_scheduler()
             
             logger.info(f"任务已加入队列: {task_id} (优先级: {priority.name})")
             return True
@@ -322,11 +529,20 @@ class ConcurrentTaskManager:
         """取消任务"""
         try:
             # 从队列中移除
+            user_id = self._get_task_user_id(task_id)
             for priority in TaskPriority:
-                queue = self.task_queues[priority]
+                user_queues = self.task_queues[priority]
+                queue = user_queues.get(user_id)
+                if not queue:
+                    continue
                 for i, task_slot in enumerate(queue):
                     if task_slot.task_id == task_id:
                         del queue[i]
+                        if not queue:
+                            del user_queues[user_id]
+                            self._drr_deficits[priority].pop(user_id, None)
+                        self._task_users.pop(task_id, None)
+                        self._early_finished.pop(task_id, None)
                         logger.info(f"任务已从队列中移除: {task_id}")
                         return True
             
@@ -380,16 +596,19 @@ class ConcurrentTaskManager:
         with self.running_tasks_lock:
             return {
                 'queue_lengths': {
-                    priority.name: len(queue) 
-                    for priority, queue in self.task_queues.items()
+                    priority.name: self._queue_length(priority)
+                    for priority in self.task_queues
                 },
+                'user_queue_lengths': self._user_queue_lengths(),
                 'running_tasks': len(self.running_tasks),
                 'user_task_counts': dict(self.user_task_counts),
                 'system_stats': self.stats.copy(),
                 'max_concurrent_tasks': self.max_concurrent_tasks,
                 'max_user_tasks': self.max_user_tasks,
                 'max_memory_mb': self.max_memory_mb,
-                'max_cpu_percent': self.max_cpu_percent
+                'max_cpu_percent': self.max_cpu_percent,
+                'max_api_rate': self.max_api_rate,
+                'resources': self.resource_tracker.get_snapshot(self.running_tasks.keys())
             }
     
     def set_callbacks(self, start_callback: Callable = None, complete_callback: Callable = None, 
@@ -420,8 +639,9 @@ class ConcurrentTaskManager:
     async def get_task_priority(self, task_id: str) -> Optional[TaskPriority]:
         """获取任务优先级"""
         # 从队列中查找
+        user_id = self._get_task_user_id(task_id)
         for priority in TaskPriority:
-            for task_slot in self.task_queues[priority]:
+            for task_slot in self.task_queues[priority].get(user_id, ()):
                 if task_slot.task_id == task_id:
                     return priority
         
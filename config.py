@@ -132,10 +132,70 @@ DEFAULT_USER_CONFIG = {
     "batch_size": 5,  # 分批处理大小（减少到5个频道）
     "check_interval": 5,  # 检查间隔（增加到5秒）
     
+    # 自适应轮询调度（按频道发帖频率调整检查间隔）
+    "poll_min_interval": 5,  # 活跃频道最短检查间隔（秒）
+    "poll_max_interval": 300,  # 冷门频道最长检查间隔（秒）
+    "poll_initial_interval": 30,  # 新频道初始检查间隔（秒）
+    "poll_ewma_alpha": 0.3,  # 发帖间隔EWMA平滑系数
+    "poll_backoff_factor": 1.5,  # 无新消息时的间隔退避倍数
+    "poll_jitter_ratio": 0.1,  # 检查时间随机抖动比例
+    
+    # 监听水位线与重启补齐
+    "monitoring_watermark_flush_interval": 10,  # 水位线落盘间隔（秒）
+    "monitoring_catchup_max_messages": 5000,  # 重启补齐的最大消息数（每个源频道）
+    "monitoring_catchup_retry_delay": 30,  # 补齐搬运失败后首次重试的等待时间（秒），之后指数退避
+    "monitoring_catchup_retry_max_delay": 600,  # 补齐搬运重试的最长等待时间（秒）
+    "delayed_dispatch_batch_size": 100,  # 延迟模式每次投递的最大消息数
+    "monitoring_stats_flush_interval": 30,  # 监听任务统计增量落盘间隔（秒）
+    "monitoring_stats_compact_lines": 1000,  # 统计增量日志压缩阈值（行）
+    "send_queue_max_size": 1000,  # 每个目标频道发送队列的最大长度
+    "send_overflow_max_size": 1000,  # 发送队列满后溢出缓冲的最大长度，再满时新消息只保留ID，稍后重新拉取
+    "poll_probe_limit": 200,  # 每次轮询拉取的最近消息数
+    "gap_recovery_grace_seconds": 3,  # 发现ID缺口后等待乱序消息到达的时间（秒）
+    "monitoring_history_enabled": True,  # 监听客户端能否读取频道历史（机器人会话不能），关闭时不轮询、不补齐缺口
+    
+    # 分片监听（多进程，按源频道一致性哈希分配；为空时使用单进程模式）
+    "monitoring_shard_sessions": [],  # 每个分片的会话配置: {"session_string": ...} 或 {"bot_token": ...}
+    "monitoring_shard_status_interval": 10,  # 分片统计收集间隔（秒）
+    
     # Firebase批量存储设置
     "firebase_batch_enabled": True,  # 是否启用Firebase批量存储
     "firebase_batch_interval": 300,  # 批量存储间隔（秒），默认5分钟
     "firebase_max_batch_size": 100,  # 最大批量大小
+    "firebase_spool_enabled": True,  # 待提交操作是否写入本地预写日志（重启后回放）
+    "firebase_spool_fsync": False,  # 每次写入日志后是否fsync
+    "firebase_spool_compact_lines": 10000,  # 日志超过该行数时按当前队列压缩
+    "firebase_retry_base_delay": 5,  # 提交失败后首次重试等待（秒），之后指数退避
+    "firebase_retry_max_delay": 300,  # 提交失败重试的最大等待（秒）
+    "firebase_retry_max_attempts": 10,  # 同一操作提交失败的最大次数，超过后记录到死信文件
+    
+    # Firebase写入调度（按优先级分配每日/每分钟写入配额）
+    "firebase_write_scheduler_enabled": True,  # 是否启用写入调度（关闭时配额用尽直接拒绝）
+    "firebase_write_critical_reserve": 0.1,  # 每日配额中只留给关键写入的比例
+    "firebase_write_minute_reserve": 0.2,  # 每分钟配额中只留给关键写入的比例
+    "firebase_quota_burn_window": 900,  # 计算配额使用速率的时间窗口（秒）
+    "firebase_write_critical_rules": ["user_sessions", "session_metadata", "channel_pairs"],  # 集合/文档/字段名命中时为关键写入
+    "firebase_write_low_rules": ["task_states", "task_archive", "monitoring_tasks", "stats", "last_stats_update", "progress"],  # 集合或文档命中、或所有字段都命中时为低优先级写入
+    
+    # Firebase读取缓存
+    "firebase_cache_ttl": 300,  # 文档缓存时间（秒）
+    "firebase_cache_max_bytes": 32 * 1024 * 1024,  # 缓存估算字节数上限
+    "firebase_cache_negative_ttl": 30,  # “文档不存在”的缓存时间（秒）
+    "firebase_cache_stale_ttl": 600,  # 用户配置过期后仍可返回旧值并后台刷新的时间（秒）
+    "firebase_cache_listen_collections": ["users"],  # 开启变更监听时订阅的集合
+    "firebase_cache_listener_ttl": 3600,  # 变更监听期间这些集合的缓存时间（秒）
+    
+    # Firestore调用（同步SDK在线程池中执行，不阻塞事件循环）
+    "firestore_max_workers": 8,  # Firestore调用线程池大小
+    "firestore_call_timeout": 10.0,  # 单次Firestore调用超时（秒）
+    
+    # 任务状态存储（独立集合/表，不写入用户配置）
+    "task_cleanup_interval": 3600,  # 归档已结束任务的检查间隔（秒）
+    "task_completed_max_age_hours": 24,  # 已结束任务保留在活动集合中的时间（小时）
+    "task_archive_retention_days": 30,  # 归档任务保留天数
+    
+    # 监听任务存储（bots/{bot_id}/monitoring_tasks 独立集合）
+    "monitoring_task_page_size": 200,  # 分页查询活跃监听任务时每页的任务数
 }
 
 # ==================== 环境变量配置 ====================
@@ -167,8 +227,22 @@ def get_config() -> Dict[str, Any]:
             print(f"⚠️ Firebase凭据JSON格式错误: {e}")
             print("使用默认配置，请检查FIREBASE_CREDENTIALS环境变量格式")
     
+    # 分片监听会话（JSON数组，敏感信息只从环境变量读取）
+    monitoring_shard_sessions = []
+    shard_sessions_env = os.getenv("MONITORING_SHARD_SESSIONS")
+    if shard_sessions_env:
+        try:
+            import json
+            monitoring_shard_sessions = json.loads(shard_sessions_env)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ MONITORING_SHARD_SESSIONS JSON格式错误: {e}，使用单进程监听")
+    
     # 检查是否使用本地开发模式（默认使用本地存储）
     use_local_storage = os.getenv("USE_LOCAL_STORAGE", "true").lower() == "true"
+    # 本地存储引擎：json（每用户一个JSON文件）或 sqlite（WAL模式数据库）
+    local_storage_engine = os.getenv("LOCAL_STORAGE_ENGINE", "json").lower()
+    # 订阅Firebase集合变更来更新缓存（多个实例共用同一Firebase项目时开启）
+    firebase_cache_listener = os.getenv("FIREBASE_CACHE_LISTENER", "false").lower() == "true"
     
     # 获取配置值，优先使用环境变量
     bot_id = os.getenv("BOT_ID", BOT_ID)
@@ -210,6 +284,11 @@ def get_config() -> Dict[str, Any]:
         
         # 存储配置
         "use_local_storage": use_local_storage,
+        "local_storage_engine": local_storage_engine,
+        "firebase_cache_listener": firebase_cache_listener,
+        
+        # 分片监听配置
+        "monitoring_shard_sessions": monitoring_shard_sessions,
         
         # 环境信息
         "is_render": is_render,
@@ -13,6 +13,9 @@ import firebase_admin
 from firebase_admin import credentials, firestore, auth
 from config import FIREBASE_CREDENTIALS, FIREBASE_PROJECT_ID, DEFAULT_USER_CONFIG
 from optimized_firebase_manager import get_global_optimized_manager, get_doc, set_doc, update_doc, delete_doc
+from firestore_executor import run_firestore
+from field_patch import build_merge_patch, quote_field_path, DELETE_FIELD
+from google.api_core.exceptions import NotFound
 
 # 配置日志 - 显示详细状态信息
 logging.basicConfig(level=logging.INFO)
@@ -27,6 +30,8 @@ class DataManager:
         self.db = None
         self.initialized = False
         self.optimized_manager = None
+        self._monitoring_tasks_migrated = False
+        self._monitoring_migration_lock = asyncio.Lock()
         self._init_firebase()
     
     def _init_firebase(self):
@@ -139,7 +144,9 @@ class DataManager:
         try:
             # 优先使用优化的Firebase管理器
             if self.optimized_manager:
-                user_data = await self.optimized_manager.get_document('users', str(user_id))
+                # 配置读取允许短暂返回旧值（后台刷新），避免过期时阻塞在Firebase读取上
+                user_data = await self.optimized_manager.get_document(
+                    'users', str(user_id), stale_while_revalidate=True)
                 if user_data:
                     config = user_data.get('config', {})
                     # 合并默认配置和用户配置
@@ -151,13 +158,9 @@ class DataManager:
                     await self.create_user_config(user_id)
                     return DEFAULT_USER_CONFIG.copy()
             else:
-                # 回退到标准Firebase操作
-                import asyncio
+                # 回退到标准Firebase操作（在Firestore线程池中执行同步调用）
                 doc_ref = self.db.collection('users').document(str(user_id))
-                
-                # 在线程池中执行同步操作
-                loop = asyncio.get_event_loop()
-                doc = await loop.run_in_executor(None, doc_ref.get)
+                doc = await run_firestore('users.get', doc_ref.get)
                 
                 if doc.exists:
                     user_data = doc.to_dict()
@@ -206,25 +209,23 @@ class DataManager:
                     return False
             else:
                 # 回退到标准Firebase操作
-                import asyncio
                 doc_ref = self.db.collection('users').document(str(user_id))
                 
                 # 获取现有配置
-                loop = asyncio.get_event_loop()
-                existing_doc = await loop.run_in_executor(None, doc_ref.get)
+                existing_doc = await run_firestore('users.get', doc_ref.get)
                 if existing_doc.exists:
                     existing_data = existing_doc.to_dict()
                     # 完全替换config字段，而不是合并
                     existing_data['config'] = config
                     existing_data['updated_at'] = datetime.now().isoformat()
-                    await loop.run_in_executor(None, doc_ref.set, existing_data)
+                    await run_firestore('users.set', doc_ref.set, existing_data)
                 else:
                     # 新用户，直接设置
                     user_data = {
                         'config': config,
                         'updated_at': datetime.now().isoformat()
                     }
-                    await loop.run_in_executor(None, doc_ref.set, user_data)
+                    await run_firestore('users.set', doc_ref.set, user_data)
                 
                 logger.info(f"用户配置保存成功: {user_id}")
                 return True
@@ -237,6 +238,29 @@ class DataManager:
         """创建新用户配置"""
         return await self.save_user_config(user_id, DEFAULT_USER_CONFIG.copy())
     
+    async def update_user_fields(self, user_id: str, updates: Dict[str, Any]) -> bool:
+        """按字段路径更新用户文档，不读取现有文档（updates格式见 field_patch）"""
+        if not self.initialized:
+            return False
+        if not updates:
+            return True
+        
+        updates = dict(updates)
+        updates['updated_at'] = datetime.now().isoformat()
+        
+        try:
+            if self.optimized_manager:
+                return await self.optimized_manager.patch_document('users', str(user_id), updates)
+            
+            data, merge_paths = build_merge_patch(updates, firestore.DELETE_FIELD)
+            doc_ref = self.db.collection('users').document(str(user_id))
+            await run_firestore('users.patch', doc_ref.set, data, merge=merge_paths)
+            return True
+        
+        except Exception as e:
+            logger.error(f"更新用户字段失败 {user_id}: {e}")
+            return False
+    
     async def get_all_user_ids(self) -> List[str]:
         """获取所有用户ID列表"""
         if not self.initialized:
@@ -251,10 +275,8 @@ class DataManager:
                 return user_ids
             else:
                 # 回退到标准Firebase操作
-                import asyncio
                 # 获取所有用户文档
-                loop = asyncio.get_event_loop()
-                docs = await loop.run_in_executor(None, lambda: list(self.db.collection('users').stream()))
+                docs = await run_firestore('users.stream', lambda: list(self.db.collection('users').stream()))
                 
                 user_ids = []
                 for doc in docs:
@@ -273,10 +295,8 @@ class DataManager:
             return []
         
         try:
-            import asyncio
             doc_ref = self.db.collection('users').document(str(user_id))
-            loop = asyncio.get_event_loop()
-            doc = await loop.run_in_executor(None, doc_ref.get)
+            doc = await run_firestore('users.get', doc_ref.get)
             
             if doc.exists:
                 user_data = doc.to_dict()
@@ -294,14 +314,12 @@ class DataManager:
             return False
         
         try:
-            import asyncio
             doc_ref = self.db.collection('users').document(str(user_id))
             data = {
                 'channel_pairs': channel_pairs,
                 'updated_at': datetime.now().isoformat()
             }
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, lambda: doc_ref.set(data, merge=True))
+            await run_firestore('users.set', doc_ref.set, data, merge=True)
             logger.info(f"频道组列表保存成功: {user_id}")
             return True
             
@@ -421,7 +439,7 @@ class DataManager:
         
         try:
             doc_ref = self.db.collection('users').document(str(user_id))
-            doc = doc_ref.get()
+            doc = await run_firestore('users.get', doc_ref.get)
             
             if doc.exists:
                 user_data = doc.to_dict()
@@ -453,7 +471,7 @@ class DataManager:
             
             # 保存到数据库
             doc_ref = self.db.collection('users').document(str(user_id))
-            doc_ref.set({
+            await run_firestore('users.set', doc_ref.set, {
                 'task_history': history,
                 'updated_at': datetime.now().isoformat()
             }, merge=True)
@@ -528,6 +546,63 @@ class DataManager:
             return False
     
     # ==================== 监听任务数据管理 ====================
+    # 监听任务按task_id存储在 bots/{bot_id}/monitoring_tasks/{task_id}（带 user_id、status 字段），
+    # 活跃任务通过一次按 status 的索引查询分页获取，不再遍历所有用户的配置。
+    # 有优化管理器时，任务写入经由它批量提交、更新缓存并计入配额和写入调度。
+    
+    def _monitoring_tasks_path(self) -> str:
+        """监听任务集合路径（供优化管理器按路径读写）"""
+        return f"bots/{self.bot_id}/monitoring_tasks"
+    
+    def _monitoring_tasks_ref(self):
+        """获取监听任务集合引用（Firebase不可用时为None）"""
+        db = self.db or (self.optimized_manager.db if self.optimized_manager else None)
+        if db is None:
+            return None
+        return db.collection('bots').document(self.bot_id).collection('monitoring_tasks')
+    
+    async def _ensure_monitoring_tasks_migrated(self):
+        """把旧版本保存在用户配置 monitoring_tasks 中的任务迁移到监听任务集合（只执行一次）"""
+        if self._monitoring_tasks_migrated:
+            return
+        async with self._monitoring_migration_lock:
+            if self._monitoring_tasks_migrated:
+                return
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                return
+            
+            marker_ref = tasks_ref.parent.collection('meta').document('monitoring_tasks')
+            marker = await run_firestore('monitoring_tasks.marker', marker_ref.get)
+            if not (marker.exists and marker.to_dict().get('legacy_migrated')):
+                # 直接遍历用户文档（出错时抛出异常），不使用出错时返回空列表的 get_all_user_ids，
+                # 避免在没有读到用户的情况下写入迁移标记
+                users_ref = (self.db or self.optimized_manager.db).collection('users')
+                user_docs = await run_firestore('users.stream', lambda: list(users_ref.stream()))
+                
+                migrated = 0
+                complete = True
+                for user_doc in user_docs:
+                    user_id = user_doc.id
+                    legacy_tasks = ((user_doc.to_dict() or {}).get('config') or {}).get('monitoring_tasks') or {}
+                    if not legacy_tasks:
+                        continue
+                    for task_id, task_data in legacy_tasks.items():
+                        await run_firestore('monitoring_tasks.set', tasks_ref.document(task_id).set,
+                                            {**task_data, 'task_id': task_id, 'user_id': str(user_id)})
+                    if not await self.update_user_fields(user_id, {('config', 'monitoring_tasks'): DELETE_FIELD}):
+                        complete = False
+                    migrated += len(legacy_tasks)
+                
+                if not complete:
+                    # 任务已复制（重复迁移是幂等的），旧字段未能全部清理，下次启动重试
+                    logger.warning(f"⚠️ 已迁移 {migrated} 个监听任务，部分用户的旧任务字段未能清理，下次重试")
+                    return
+                await run_firestore('monitoring_tasks.marker', marker_ref.set,
+                                    {'legacy_migrated': True, 'migrated_at': datetime.now().isoformat()})
+                logger.info(f"✅ 已迁移 {migrated} 个监听任务到监听任务集合")
+            
+            self._monitoring_tasks_migrated = True
     
     async def create_monitoring_task(self, user_id: str, task_data: Dict[str, Any]) -> str:
         """创建监听任务"""
@@ -537,20 +612,19 @@ class DataManager:
                 task_id = f"monitor_{user_id}_{int(datetime.now().timestamp())}"
                 task_data['task_id'] = task_id
             
-            # 获取用户配置
-            user_config = await self.get_user_config(user_id)
-            
-            # 初始化监听任务存储
-            if 'monitoring_tasks' not in user_config:
-                user_config['monitoring_tasks'] = {}
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                raise RuntimeError("Firebase未初始化")
             
             # 添加任务数据
+            task_data['user_id'] = str(user_id)
             task_data['created_at'] = datetime.now().isoformat()
             task_data['status'] = 'pending'
-            user_config['monitoring_tasks'][task_id] = task_data
-            
-            # 保存配置
-            await self.save_user_config(user_id, user_config)
+            if self.optimized_manager:
+                if not await self.optimized_manager.set_document(self._monitoring_tasks_path(), task_id, task_data):
+                    raise RuntimeError(f"写入监听任务失败: {task_id}")
+            else:
+                await run_firestore('monitoring_tasks.set', tasks_ref.document(task_id).set, task_data)
             
             logger.info(f"✅ 创建监听任务: {task_id}")
             return task_id
@@ -559,11 +633,35 @@ class DataManager:
             logger.error(f"创建监听任务失败: {e}")
             raise
     
+    async def save_monitoring_task(self, user_id: str, task_data: Dict[str, Any]) -> bool:
+        """保存（整体替换）监听任务"""
+        try:
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                return False
+            
+            task_data = {**task_data, 'user_id': str(user_id), 'updated_at': datetime.now().isoformat()}
+            if self.optimized_manager:
+                return await self.optimized_manager.set_document(
+                    self._monitoring_tasks_path(), task_data['task_id'], task_data)
+            await run_firestore('monitoring_tasks.set', tasks_ref.document(task_data['task_id']).set, task_data)
+            return True
+        
+        except Exception as e:
+            logger.error(f"保存监听任务失败: {e}")
+            return False
+    
     async def get_monitoring_tasks(self, user_id: str) -> Dict[str, Dict[str, Any]]:
         """获取用户的监听任务列表"""
         try:
-            user_config = await self.get_user_config(user_id)
-            return user_config.get('monitoring_tasks', {})
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                return {}
+            
+            await self._ensure_monitoring_tasks_migrated()
+            query = tasks_ref.where('user_id', '==', str(user_id))
+            docs = await run_firestore('monitoring_tasks.query', lambda: list(query.stream()))
+            return {doc.id: doc.to_dict() for doc in docs}
         except Exception as e:
             logger.error(f"获取监听任务失败: {e}")
             return {}
@@ -571,31 +669,46 @@ class DataManager:
     async def get_monitoring_task(self, user_id: str, task_id: str) -> Optional[Dict[str, Any]]:
         """获取指定的监听任务"""
         try:
-            tasks = await self.get_monitoring_tasks(user_id)
-            return tasks.get(task_id)
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                return None
+            
+            await self._ensure_monitoring_tasks_migrated()
+            if self.optimized_manager:
+                # 经由优化管理器读取：带缓存，并能读到尚在批量队列中的写入
+                task_data = await self.optimized_manager.get_document(self._monitoring_tasks_path(), task_id)
+            else:
+                doc = await run_firestore('monitoring_tasks.get', tasks_ref.document(task_id).get)
+                task_data = doc.to_dict() if doc.exists else None
+            if not task_data:
+                return None
+            return task_data if task_data.get('user_id') == str(user_id) else None
         except Exception as e:
             logger.error(f"获取监听任务失败: {e}")
             return None
     
     async def update_monitoring_task(self, user_id: str, task_id: str, updates: Dict[str, Any]) -> bool:
-        """更新监听任务"""
+        """更新监听任务（只写入变化的顶层字段）"""
         try:
-            user_config = await self.get_user_config(user_id)
-            
-            if 'monitoring_tasks' not in user_config:
-                user_config['monitoring_tasks'] = {}
-            
-            if task_id not in user_config['monitoring_tasks']:
-                logger.error(f"监听任务不存在: {task_id}")
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
                 return False
             
-            # 更新任务数据
-            task_data = user_config['monitoring_tasks'][task_id]
-            task_data.update(updates)
-            task_data['updated_at'] = datetime.now().isoformat()
+            await self._ensure_monitoring_tasks_migrated()
             
-            # 保存配置
-            await self.save_user_config(user_id, user_config)
+            # 更新任务数据
+            field_updates = {quote_field_path((key,)): value for key, value in updates.items()}
+            field_updates['updated_at'] = datetime.now().isoformat()
+            if self.optimized_manager:
+                # 批量提交时任务已不存在的更新由批量存储记入死信
+                if not await self.optimized_manager.update_document(self._monitoring_tasks_path(), task_id, field_updates):
+                    return False
+            else:
+                try:
+                    await run_firestore('monitoring_tasks.update', tasks_ref.document(task_id).update, field_updates)
+                except NotFound:
+                    logger.error(f"监听任务不存在: {task_id}")
+                    return False
             
             logger.info(f"✅ 更新监听任务: {task_id}")
             return True
@@ -604,42 +717,73 @@ class DataManager:
             logger.error(f"更新监听任务失败: {e}")
             return False
     
-    async def delete_monitoring_task(self, user_id: str, task_id: str) -> bool:
-        """删除监听任务"""
+    async def delete_monitoring_task(self, user_id: Optional[str], task_id: str) -> bool:
+        """删除监听任务（任务按task_id存储，user_id 仅为兼容保留）"""
         try:
-            user_config = await self.get_user_config(user_id)
-            
-            if 'monitoring_tasks' not in user_config:
-                return True
-            
-            if task_id in user_config['monitoring_tasks']:
-                del user_config['monitoring_tasks'][task_id]
-                await self.save_user_config(user_id, user_config)
-                logger.info(f"✅ 删除监听任务: {task_id}")
+            tasks_ref = self._monitoring_tasks_ref()
+            if tasks_ref is None:
+                return False
             
+            await self._ensure_monitoring_tasks_migrated()
+            if self.optimized_manager:
+                if not await self.optimized_manager.delete_document(self._monitoring_tasks_path(), task_id):
+                    return False
+            else:
+                await run_firestore('monitoring_tasks.delete', tasks_ref.document(task_id).delete)
+            logger.info(f"✅ 删除监听任务: {task_id}")
             return True
             
         except Exception as e:
             logger.error(f"删除监听任务失败: {e}")
             return False
     
+    async def get_active_monitoring_tasks_page(self, page_size: Optional[int] = None,
+                                               start_after: Optional[str] = None):
+        """分页获取活跃的监听任务
+        
+        Args:
+            page_size: 每页任务数，默认使用 monitoring_task_page_size
+            start_after: 上一页返回的游标（最后一个task_id），None表示第一页
+        
+        Returns:
+            (任务列表, 下一页游标)，没有更多任务时游标为None
+        """
+        tasks_ref = self._monitoring_tasks_ref()
+        if tasks_ref is None:
+            return [], None
+        
+        await self._ensure_monitoring_tasks_migrated()
+        page_size = page_size or DEFAULT_USER_CONFIG.get('monitoring_task_page_size', 200)
+        
+        # status 等值查询 + 按文档ID排序只需要单字段索引
+        query = tasks_ref.where('status', '==', 'active').order_by('__name__').limit(page_size)
+        if start_after:
+            query = query.start_after({'__name__': tasks_ref.document(start_after)})
+        docs = await run_firestore('monitoring_tasks.active', lambda: list(query.stream()))
+        
+        tasks = []
+        for doc in docs:
+            task_data = doc.to_dict()
+            task_data['task_id'] = doc.id
+            tasks.append(task_data)
+        
+        next_cursor = docs[-1].id if len(docs) == page_size else None
+        return tasks, next_cursor
+    
+    async def iter_active_monitoring_tasks(self, page_size: Optional[int] = None):
+        """逐页遍历所有活跃的监听任务（异步生成器）"""
+        cursor = None
+        while True:
+            tasks, cursor = await self.get_active_monitoring_tasks_page(page_size, cursor)
+            for task_data in tasks:
+                yield task_data
+            if cursor is None:
+                return
+    
     async def get_active_monitoring_tasks(self) -> List[Dict[str, Any]]:
         """获取所有活跃的监听任务"""
         try:
-            active_tasks = []
-            
-            # 获取所有用户
-            all_users = await self.get_all_user_ids()
-            
-            for user_id in all_users:
-                tasks = await self.get_monitoring_tasks(user_id)
-                for task_id, task_data in tasks.items():
-                    if task_data.get('status') == 'active':
-                        task_data['user_id'] = user_id
-                        task_data['task_id'] = task_id
-                        active_tasks.append(task_data)
-            
-            return active_tasks
+            return [task_data async for task_data in self.iter_active_monitoring_tasks()]
             
         except Exception as e:
             logger.error(f"获取活跃监听任务失败: {e}")
@@ -668,7 +812,7 @@ class DataManager:
                 }
             
             # 测试数据库连接
-            self.db.collection('health').document('test').get()
+            await run_firestore('health.get', self.db.collection('health').document('test').get)
             
             return {
                 'status': 'healthy',
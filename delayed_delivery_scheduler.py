@@ -0,0 +1,313 @@
+# ==================== 延迟投递调度器 ====================
+"""
+延迟投递调度器
+延迟监听模式下，用单个最小堆保存待投递消息的紧凑条目
+(到期时间, 任务ID, 频道ID, 消息ID)，到期后按批次分发；
+待投递条目持久化到本地文件，重启后不会丢失；
+分发失败的条目稍后重试，消息实际发送完成后才从文件中移除
+"""
+
+import asyncio
+import functools
+import heapq
+import json
+import os
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# 分发回调: (task_id, chat_id, message_ids) -> None 或 Future
+# 返回 Future 时，Future 完成后（结果为未投递的消息ID列表）条目才移出分发中列表
+DispatchCallback = Callable[[str, int, List[int]], Awaitable[Optional[asyncio.Future]]]
+
+# 堆条目: (到期时间, 任务ID, 频道ID, 消息ID)
+Entry = Tuple[float, str, int, int]
+
+class DeliveryDeferred(Exception):
+    """任务暂时不能投递（如已暂停），条目稍后重新投递，不计入失败次数"""
+
+
+class DelayedDeliveryScheduler:
+    """延迟投递调度器类"""
+    
+    def __init__(self, dispatch: DispatchCallback, bot_id: str = "default_bot",
+                 max_batch_size: int = 100, flush_interval: float = 5.0,
+                 retry_delay: float = 30.0, max_attempts: int = 5):
+        """初始化调度器
+        
+        Args:
+            dispatch: 到期条目的分发回调，同一任务同一频道的消息合并为一次调用
+            bot_id: 机器人ID，用于数据分离
+            max_batch_size: 每次分发的最大条目数
+            flush_interval: 待投递条目落盘间隔（秒）
+            retry_delay: 分发失败后重新投递的等待时间（秒）
+            max_attempts: 同一条目最多分发次数，超过后丢弃
+        """
+        self.dispatch = dispatch
+        self.file_path = f"data/{bot_id}/monitoring_delayed_queue.json"
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        
+        # 最小堆: (到期时间, 任务ID, 频道ID, 消息ID)
+        self._heap: List[Entry] = []
+        # 已弹出、正在分发的条目（分发完成前仍然写入文件）
+        self._in_flight: List[Entry] = []
+        # (任务ID, 频道ID, 消息ID) -> 已失败的分发次数
+        self._attempts: Dict[Tuple[str, int, int], int] = {}
+        # 新条目落盘后才执行的回调（如推进水位线）
+        self._persisted_callbacks: List[Callable[[], None]] = []
+        self._dirty = False
+        self._wakeup = asyncio.Event()
+        self._run_task: Optional[asyncio.Task] = None
+        self._last_flush = 0.0
+        
+        self.stats = {
+            'scheduled': 0,
+            'dispatched': 0,
+            'retried': 0,
+            'dropped': 0
+        }
+        
+        self._load()
+    
+    def _load(self):
+        """从文件恢复待投递条目"""
+        try:
+            if not os.path.exists(self.file_path):
+                return
+            
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            
+            self._heap = [(float(due), str(task_id), int(chat_id), int(message_id))
+                          for due, task_id, chat_id, message_id in entries]
+            heapq.heapify(self._heap)
+            
+            if self._heap:
+                logger.info(f"✅ 恢复延迟投递队列: {len(self._heap)} 条待投递")
+        
+        except Exception as e:
+            logger.error(f"❌ 加载延迟投递队列失败: {e}")
+    
+    def schedule(self, task_id: str, chat_id: int, message_id: int, due_time: float,
+                 on_persisted: Optional[Callable[[], None]] = None):
+        """加入一条待投递消息
+        
+        Args:
+            on_persisted: 条目写入文件后执行的回调，调用方用它在条目落盘后再推进水位线
+        """
+        heapq.heappush(self._heap, (due_time, task_id, chat_id, message_id))
+        self._dirty = True
+        if on_persisted is not None:
+            self._persisted_callbacks.append(on_persisted)
+        self.stats['scheduled'] += 1
+        
+        # 新条目比当前最早条目更早时，唤醒调度循环重新计算等待时间
+        if self._heap[0][3] == message_id and self._heap[0][1] == task_id:
+            self._wakeup.set()
+    
+    def remove_task(self, task_id: str) -> int:
+        """移除任务的所有待投递条目"""
+        before = len(self._heap)
+        self._heap = [entry for entry in self._heap if entry[1] != task_id]
+        removed = before - len(self._heap)
+        if removed:
+            heapq.heapify(self._heap)
+            self._dirty = True
+            self.stats['dropped'] += removed
+        self._attempts = {key: count for key, count in self._attempts.items() if key[0] != task_id}
+        return removed
+    
+    def pending_count(self, task_id: Optional[str] = None) -> int:
+        """获取待投递条目数量"""
+        if task_id is None:
+            return len(self._heap)
+        return sum(1 for entry in self._heap if entry[1] == task_id)
+    
+    def start(self):
+        """启动调度循环"""
+        if self._run_task is None or self._run_task.done():
+            self._run_task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """停止调度循环并落盘待投递条目"""
+        if self._run_task and not self._run_task.done():
+            self._run_task.cancel()
+            try:
+                await self._run_task
+            except asyncio.CancelledError:
+                pass
+        self._run_task = None
+        
+        # 被取消时未完成分发的条目放回堆中，下次启动重新投递
+        if self._in_flight:
+            for entry in self._in_flight:
+                heapq.heappush(self._heap, entry)
+            self._in_flight = []
+            self._dirty = True
+        self.flush()
+    
+    def flush(self) -> bool:
+        """待投递条目落盘（临时文件 + 原子替换）"""
+        if not self._dirty:
+            return True
+        
+        callbacks = self._persisted_callbacks
+        self._persisted_callbacks = []
+        
+        try:
+            directory = os.path.dirname(self.file_path)
+            os.makedirs(directory, exist_ok=True)
+            
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._heap + self._in_flight, f, separators=(',', ':'))
+                os.replace(temp_path, self.file_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            
+            self._dirty = False
+            self._last_flush = time.time()
+        
+        except Exception as e:
+            logger.error(f"❌ 保存延迟投递队列失败: {e}")
+            self._persisted_callbacks = callbacks + self._persisted_callbacks
+            return False
+        
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"⚠️ 延迟投递落盘回调失败: {e}")
+        return True
+    
+    def _pop_due(self, now: float) -> Dict[Tuple[str, int], List[Entry]]:
+        """弹出到期条目放入分发中列表，按(任务, 频道)分组"""
+        groups: Dict[Tuple[str, int], List[Entry]] = {}
+        count = 0
+        while self._heap and self._heap[0][0] <= now and count < self.max_batch_size:
+            entry = heapq.heappop(self._heap)
+            self._in_flight.append(entry)
+            groups.setdefault((entry[1], entry[2]), []).append(entry)
+            count += 1
+        return groups
+    
+    def _take_in_flight(self, entries: List[Entry]) -> List[Entry]:
+        """从分发中列表取出条目；已被 stop() 放回堆中的条目不再处理"""
+        done = set(entries)
+        taken = [entry for entry in self._in_flight if entry in done]
+        self._in_flight = [entry for entry in self._in_flight if entry not in done]
+        return taken
+    
+    def _complete(self, entries: List[Entry]):
+        """投递完成，从分发中列表移除"""
+        entries = self._take_in_flight(entries)
+        if not entries:
+            return
+        for _, task_id, chat_id, message_id in entries:
+            self._attempts.pop((task_id, chat_id, message_id), None)
+        self._dirty = True
+        self.stats['dispatched'] += len(entries)
+    
+    def _requeue(self, entries: List[Entry], count_attempt: bool = True):
+        """分发失败，稍后重新投递；失败次数达到上限的条目丢弃
+        
+        Args:
+            count_attempt: 是否计入失败次数（任务暂停等情况不计入）
+        """
+        entries = self._take_in_flight(entries)
+        if not entries:
+            return
+        retry_at = time.time() + self.retry_delay
+        for _, task_id, chat_id, message_id in entries:
+            key = (task_id, chat_id, message_id)
+            if not count_attempt:
+                heapq.heappush(self._heap, (retry_at, task_id, chat_id, message_id))
+                continue
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(key, None)
+                self.stats['dropped'] += 1
+                logger.warning(f"⚠️ 延迟投递多次失败，丢弃消息 {task_id}/{chat_id}/{message_id}")
+                continue
+            self._attempts[key] = attempts
+            heapq.heappush(self._heap, (retry_at, task_id, chat_id, message_id))
+            self.stats['retried'] += 1
+        self._dirty = True
+    
+    def _on_delivered(self, task_id: str, chat_id: int, entries: List[Entry], delivered: asyncio.Future):
+        """发送任务结束：已投递的条目移除，未投递的条目重新排队"""
+        if delivered.cancelled():
+            self._requeue(entries, count_attempt=False)
+            return
+        
+        error = delivered.exception()
+        if isinstance(error, DeliveryDeferred):
+            self._requeue(entries, count_attempt=False)
+        elif error is not None:
+            logger.error(f"❌ 延迟投递发送失败 {task_id}/{chat_id}，{self.retry_delay:.0f}秒后重试: {error}")
+            self._requeue(entries)
+        else:
+            undelivered = set(delivered.result() or ())
+            self._complete([entry for entry in entries if entry[3] not in undelivered])
+            remaining = [entry for entry in entries if entry[3] in undelivered]
+            if remaining:
+                self._requeue(remaining, count_attempt=False)
+    
+    async def _run(self):
+        """调度循环：等待最早条目到期，批量分发"""
+        while True:
+            try:
+                now = time.time()
+                groups = self._pop_due(now)
+                
+                for (task_id, chat_id), entries in groups.items():
+                    try:
+                        delivered = await self.dispatch(task_id, chat_id, sorted(entry[3] for entry in entries))
+                    except DeliveryDeferred as e:
+                        logger.debug(f"⏸️ 延迟投递暂缓 {task_id}/{chat_id}: {e}")
+                        self._requeue(entries, count_attempt=False)
+                    except Exception as e:
+                        logger.error(f"❌ 延迟投递分发失败 {task_id}/{chat_id}，{self.retry_delay:.0f}秒后重试: {e}")
+                        self._requeue(entries)
+                    else:
+                        if delivered is None:
+                            self._complete(entries)
+                        else:
+                            # 发送任务在目标频道队列中排队，完成前条目保留在分发中列表（仍写入文件）
+                            delivered.add_done_callback(functools.partial(self._on_delivered, task_id, chat_id, entries))
+                
+                if self._dirty and time.time() - self._last_flush >= self.flush_interval:
+                    self.flush()
+                
+                if groups:
+                    continue
+                
+                timeout = self._heap[0][0] - time.time() if self._heap else self.flush_interval
+                timeout = min(max(timeout, 0.05), self.flush_interval)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._wakeup.clear()
+            
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 延迟投递调度循环异常: {e}")
+                await asyncio.sleep(1)
+    
+    def get_stats(self) -> Dict[str, int]:
+        """获取调度统计"""
+        stats = self.stats.copy()
+        stats['pending'] = len(self._heap) + len(self._in_flight)
+        return stats
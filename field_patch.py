@@ -0,0 +1,111 @@
+# ==================== 字段级补丁 ====================
+"""
+字段级补丁
+update_user_fields 使用的补丁格式：{字段路径: 新值}，路径相对于用户文档，
+如 "config.tail_text"、"config.active_tasks.<task_id>"；值为 DELETE_FIELD 时删除该字段。
+路径段本身包含 '.' 时可以传入元组，如 ("config", "channel_filters", "a.b")。
+"""
+
+import copy
+import re
+from typing import Any, Dict, List, Tuple, Union
+
+FieldPath = Union[str, Tuple[str, ...]]
+
+class _DeleteField:
+    """删除字段标记"""
+    
+    def __repr__(self):
+        return "DELETE_FIELD"
+
+DELETE_FIELD = _DeleteField()
+
+# Firestore字段路径中无需反引号的路径段
+_SIMPLE_SEGMENT = re.compile(r'^[A-Za-z_][A-Za-z_0-9]*$')
+
+def split_field_path(path: FieldPath) -> Tuple[str, ...]:
+    """把字段路径拆分为路径段"""
+    parts = tuple(str(part) for part in path) if isinstance(path, tuple) else tuple(str(path).split('.'))
+    if not parts or any(part == '' for part in parts):
+        raise ValueError(f"无效的字段路径: {path!r}")
+    return parts
+
+def normalize_updates(updates: Dict[FieldPath, Any]) -> List[Tuple[Tuple[str, ...], Any]]:
+    """把补丁规范化为 [(路径段, 值)]"""
+    return [(split_field_path(path), value) for path, value in updates.items()]
+
+def apply_field_updates(document: Dict[str, Any], updates: Dict[FieldPath, Any]) -> Dict[str, Any]:
+    """把补丁应用到内存中的文档（原地修改，缺失的中间层自动创建）"""
+    for parts, value in normalize_updates(updates):
+        node = document
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        if value is DELETE_FIELD:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+    return document
+
+def quote_field_path(parts: Tuple[str, ...]) -> str:
+    """按Firestore字段路径语法拼接路径段（非简单标识符的段用反引号包裹）"""
+    quoted = []
+    for part in parts:
+        if _SIMPLE_SEGMENT.match(part):
+            quoted.append(part)
+        else:
+            quoted.append('`' + part.replace('\\', '\\\\').replace('`', '\\`') + '`')
+    return '.'.join(quoted)
+
+def parse_field_path(path: str) -> Tuple[str, ...]:
+    """解析Firestore字段路径字符串（quote_field_path 的逆操作，支持反引号包裹的路径段）"""
+    parts, current, quoted, escaped = [], [], False, False
+    for char in path:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif quoted:
+            if char == '\\':
+                escaped = True
+            elif char == '`':
+                quoted = False
+            else:
+                current.append(char)
+        elif char == '`':
+            quoted = True
+        elif char == '.':
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    if quoted or escaped or any(part == '' for part in parts):
+        raise ValueError(f"无效的字段路径: {path!r}")
+    return tuple(parts)
+
+def build_merge_patch(updates: Dict[FieldPath, Any], delete_value: Any = DELETE_FIELD) -> Tuple[Dict[str, Any], List[str]]:
+    """把补丁转换为 set(data, merge=paths) 的参数：嵌套数据 + 需要写入的字段路径列表
+    
+    只有列出的字段会被整体替换，文档中的其他字段保持不变，文档不存在时也能写入。
+    """
+    data: Dict[str, Any] = {}
+    merge_paths: List[str] = []
+    for parts, value in normalize_updates(updates):
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = delete_value if value is DELETE_FIELD else value
+        merge_paths.append(quote_field_path(parts))
+    return data, merge_paths
+
+__all__ = [
+    "DELETE_FIELD",
+    "split_field_path",
+    "normalize_updates",
+    "apply_field_updates",
+    "quote_field_path",
+    "parse_field_path",
+    "build_merge_patch"
+]
@@ -3,21 +3,39 @@
 """
 Firebase批量存储管理器
 解决Firebase API配额超限问题，通过定时批量存储减少API调用
+待处理操作按 (集合, 文档) 合并：后来的set替换之前的写入，set(merge)/update按字段合并，
+delete取消之前的写入；每次提交的写入数等于涉及的文档数，而不是修改次数。
+操作同时追加到本地预写日志（firebase_write_spool），重启后回放；
+提交失败的操作按指数退避重试，确认提交后才从队列和日志中移除；
+Firestore无法接受的操作（数据无法编码、参数无效、文档不存在等）不重试，
+从队列中移除并记录到死信文件，批量提交被拒绝时二分查找出问题操作，其余操作照常提交。
+每轮提交由写入调度（firebase_write_scheduler）按优先级分配配额，配额不足时低优先级写入留在队列中继续合并。
 """
 
 import asyncio
+import copy
 import logging
 import json
 import time
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Callable
-from collections import defaultdict, deque
+from collections import OrderedDict
 from threading import Lock
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import FailedPrecondition, InvalidArgument, NotFound
+from firestore_executor import run_firestore
+from field_patch import DELETE_FIELD, parse_field_path, quote_field_path
+from firebase_write_spool import FirebaseWriteSpool
+from config import DEFAULT_USER_CONFIG
+from firestore_emulator import get_emulator_client
+from firebase_write_scheduler import get_global_write_scheduler
 
 logger = logging.getLogger(__name__)
 
+# 重试也不会成功的提交错误
+NON_RETRYABLE_ERRORS = (InvalidArgument, NotFound, FailedPrecondition, TypeError, ValueError)
+
 class FirebaseBatchStorage:
     """Firebase批量存储管理器"""
     
@@ -33,15 +51,44 @@ class FirebaseBatchStorage:
         self.batch_interval = batch_interval
         self.max_batch_size = max_batch_size
         
-        # 存储队列
-        self.pending_operations = deque()
+        # 存储队列：(集合, 文档) -> 合并后的操作
+        self.pending_operations: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
         self.operation_lock = Lock()
         
+        # 同一时间只有一次刷新在进行
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # 正在提交（尚未确认）的操作
+        self._in_flight: List[Dict[str, Any]] = []
+        
+        # 失败重试（指数退避）
+        self.retry_base_delay = DEFAULT_USER_CONFIG.get('firebase_retry_base_delay', 5)
+        self.retry_max_delay = DEFAULT_USER_CONFIG.get('firebase_retry_max_delay', 300)
+        self.retry_max_attempts = DEFAULT_USER_CONFIG.get('firebase_retry_max_attempts', 10)
+        self._retry_attempts = 0
+        self._retry_task: Optional[asyncio.Task] = None
+        
+        # 本地预写日志
+        self.spool: Optional[FirebaseWriteSpool] = None
+        if DEFAULT_USER_CONFIG.get('firebase_spool_enabled', True):
+            self.spool = FirebaseWriteSpool(bot_id, fsync=DEFAULT_USER_CONFIG.get('firebase_spool_fsync', False))
+        self.spool_compact_lines = DEFAULT_USER_CONFIG.get('firebase_spool_compact_lines', 10000)
+        
+        # 写入调度：按优先级分配配额，未选中的操作留在队列中
+        self.write_scheduler = get_global_write_scheduler(bot_id)
+        self._deferred_count = 0
+        
         # 统计信息
         self.stats = {
             'total_operations': 0,
+            'coalesced_operations': 0,
+            'committed_writes': 0,
             'batch_operations': 0,
             'failed_operations': 0,
+            'retried_operations': 0,
+            'replayed_operations': 0,
+            'deferred_operations': 0,
+            'dead_lettered_operations': 0,
             'last_batch_time': None,
             'pending_count': 0
         }
@@ -57,6 +104,10 @@ class FirebaseBatchStorage:
         # 初始化Firebase
         self._init_firebase()
         
+        # 回放上次未确认提交的操作
+        if self.initialized and self.spool:
+            self._replay_spool()
+        
         logger.info(f"✅ Firebase批量存储管理器初始化完成 (Bot: {bot_id}, 间隔: {batch_interval}秒)")
     
     def _init_firebase(self):
@@ -64,6 +115,13 @@ class FirebaseBatchStorage:
         try:
             from config import get_config
             config = get_config()
+            
+            emulator_client = get_emulator_client(config.get('firebase_project_id'))
+            if emulator_client is not None:
+                self.db = emulator_client
+                self.initialized = True
+                return
+            
             firebase_credentials = config.get('firebase_credentials')
             
             if not self._validate_firebase_credentials(firebase_credentials):
@@ -123,12 +181,13 @@ class FirebaseBatchStorage:
             return
         
         self.running = False
-        if self.batch_task:
-            self.batch_task.cancel()
-            try:
-                await self.batch_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self.batch_task, self._retry_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # 处理剩余的待处理操作，设置超时避免卡住
         try:
@@ -138,6 +197,11 @@ class FirebaseBatchStorage:
         except Exception as e:
             logger.warning(f"⚠️ 停止时处理待处理操作出错: {e}")
         
+        if self.spool:
+            self.spool.close()
+            if self.pending_operations:
+                logger.warning(f"⚠️ {len(self.pending_operations)} 个文档写入未提交，已保留在本地日志中，下次启动时重试")
+        
         logger.info("✅ 批量处理器已停止")
     
     async def _batch_processor(self):
@@ -155,127 +219,303 @@ class FirebaseBatchStorage:
                 logger.error(f"批量处理器错误: {e}")
                 await asyncio.sleep(10)  # 错误后等待10秒再继续
     
-    async def _process_pending_operations(self):
-        """处理待处理的操作"""
-        if not self.pending_operations:
+    def _replay_spool(self):
+        """回放本地日志中未确认提交的操作"""
+        try:
+            entries = self.spool.load()
+        except Exception as e:
+            logger.error(f"❌ 读取Firebase写入日志失败: {e}")
+            return
+        if not entries:
             return
         
         with self.operation_lock:
-            operations = list(self.pending_operations)
-            self.pending_operations.clear()
-        
-        if not operations:
+            for entry in entries:
+                key = (entry['collection'], entry['document'])
+                self.pending_operations[key] = self._compose(self.pending_operations.get(key), entry)
+            self.stats['replayed_operations'] += len(entries)
+            self._rewrite_spool()
+        logger.info(f"♻️ 从本地日志恢复 {len(entries)} 个操作（{len(self.pending_operations)} 个文档）")
+    
+    def _rewrite_spool(self):
+        """用未确认的操作（提交中 + 待处理）重写日志，调用时需持有 operation_lock"""
+        if not self.spool:
             return
-        
-        logger.info(f"🔄 开始批量处理 {len(operations)} 个操作")
-        
-        # 按操作类型分组
-        operations_by_type = defaultdict(list)
-        for op in operations:
-            operations_by_type[op['type']].append(op)
-        
-        # 批量处理每种类型的操作
-        for op_type, ops in operations_by_type.items():
-            try:
-                if op_type == 'set':
-                    await self._batch_set_operations(ops)
-                elif op_type == 'update':
-                    await self._batch_update_operations(ops)
-                elif op_type == 'delete':
-                    await self._batch_delete_operations(ops)
-                else:
-                    logger.warning(f"未知操作类型: {op_type}")
+        try:
+            self.spool.rewrite(self._in_flight + list(self.pending_operations.values()))
+        except Exception as e:
+            logger.error(f"❌ 重写Firebase写入日志失败: {e}")
+    
+    def _requeue(self, entries: List[Dict[str, Any]]):
+        """把未确认提交的操作放回队列前面，之后的新操作合并在其上，调用时需持有 operation_lock"""
+        requeued: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        for entry in entries:
+            key = (entry['collection'], entry['document'])
+            newer = self.pending_operations.pop(key, None)
+            requeued[key] = self._compose(entry, newer) if newer else entry
+        requeued.update(self.pending_operations)
+        self.pending_operations = requeued
+    
+    async def _process_pending_operations(self):
+        """处理待处理的操作（串行执行，刷新期间新增的操作留到下一轮）"""
+        async with self._flush_lock:
+            while True:
+                with self.operation_lock:
+                    operations = list(self.pending_operations.values())
+                    deferred: List[Dict[str, Any]] = []
+                    if operations and self.write_scheduler:
+                        operations, deferred = self.write_scheduler.select(operations)
                     
-            except Exception as e:
-                logger.error(f"批量处理 {op_type} 操作失败: {e}")
-                self.stats['failed_operations'] += len(ops)
+                    # 延后的操作留在队列中，继续与之后的修改合并
+                    self.pending_operations.clear()
+                    for entry in deferred:
+                        self.pending_operations[(entry['collection'], entry['document'])] = entry
+                    self._deferred_count = len(deferred)
+                    self.stats['deferred_operations'] = len(deferred)
+                    self._in_flight = operations
+                
+                if not operations:
+                    return
+                
+                try:
+                    failed = await self._commit_operations(operations)
+                except BaseException:
+                    # 被取消（如停止超时）时放回队列，日志中仍保留这些操作
+                    with self.operation_lock:
+                        self._in_flight = []
+                        self._requeue(operations)
+                    raise
+                
+                with self.operation_lock:
+                    self._in_flight = []
+                    if failed:
+                        self._requeue(failed)
+                    self._rewrite_spool()
+                
+                if failed:
+                    self._schedule_retry()
+                    return
+                self._retry_attempts = 0
+                
+                # 刷新期间队列又超过上限时继续处理（不计延后的操作）
+                with self.operation_lock:
+                    if len(self.pending_operations) - self._deferred_count < self.max_batch_size:
+                        return
+    
+    def _schedule_retry(self):
+        """按指数退避安排失败操作的重试"""
+        if self._retry_task is not None and not self._retry_task.done():
+            return
+        delay = min(self.retry_base_delay * (2 ** self._retry_attempts), self.retry_max_delay)
+        self._retry_attempts += 1
+        logger.warning(f"⚠️ 批量提交失败，{delay}秒后重试（第{self._retry_attempts}次）")
+        self._retry_task = asyncio.create_task(self._retry_after(delay))
+    
+    async def _retry_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self.stats['retried_operations'] += len(self.pending_operations)
+        await self._process_pending_operations()
+    
+    async def _commit_operations(self, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """提交合并后的操作（每个文档一个写入，按500个分批），返回需要重试的操作"""
+        logger.info(f"🔄 开始批量处理 {len(operations)} 个文档写入")
+        
+        committed = 0
+        failed: List[Dict[str, Any]] = []
+        for start in range(0, len(operations), 500):
+            # Firestore批量操作限制为500个
+            chunk_committed, chunk_failed = await self._commit_chunk(operations[start:start + 500])
+            committed += chunk_committed
+            failed.extend(chunk_failed)
+        
+        # 超过重试次数的操作不再重试
+        retryable = []
+        for op in failed:
+            op['attempts'] = op.get('attempts', 0) + 1
+            if op['attempts'] >= self.retry_max_attempts:
+                self._dead_letter(op, f"重试 {op['attempts']} 次后仍提交失败")
+            else:
+                retryable.append(op)
         
+        self.stats['committed_writes'] += committed
         self.stats['batch_operations'] += 1
         self.stats['last_batch_time'] = datetime.now().isoformat()
-        logger.info(f"✅ 批量处理完成，处理了 {len(operations)} 个操作")
+        logger.info(f"✅ 批量处理完成，提交了 {committed}/{len(operations)} 个文档写入")
+        return retryable
     
-    async def _batch_set_operations(self, operations: List[Dict[str, Any]]):
-        """批量设置操作"""
-        batch = self.db.batch()
-        batch_count = 0
-        
-        for op in operations:
-            try:
-                doc_ref = self.db.collection(op['collection']).document(op['document'])
-                batch.set(doc_ref, op['data'])
-                batch_count += 1
-                
-                # Firestore批量操作限制为500个
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = self.db.batch()
-                    batch_count = 0
-                    
-            except Exception as e:
-                logger.error(f"批量设置操作失败: {e}")
+    async def _commit_chunk(self, chunk: List[Dict[str, Any]]):
+        """把一组操作作为一次原子批量写入提交，返回 (提交数, 需要重试的操作)
         
-        if batch_count > 0:
-            batch.commit()
-    
-    async def _batch_update_operations(self, operations: List[Dict[str, Any]]):
-        """批量更新操作"""
+        无法加入批量写入的操作直接移入死信；提交因操作本身无效被拒绝时二分查找出问题操作。
+        """
         batch = self.db.batch()
-        batch_count = 0
-        
-        for op in operations:
+        writable = []
+        for op in chunk:
             try:
-                doc_ref = self.db.collection(op['collection']).document(op['document'])
-                batch.update(doc_ref, op['data'])
-                batch_count += 1
-                
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = self.db.batch()
-                    batch_count = 0
-                    
-            except Exception as e:
-                logger.error(f"批量更新操作失败: {e}")
+                self._add_to_batch(batch, op)
+                writable.append(op)
+            except (KeyError, TypeError, ValueError) as e:
+                self._dead_letter(op, e)
+        if not writable:
+            return 0, []
         
-        if batch_count > 0:
-            batch.commit()
-    
-    async def _batch_delete_operations(self, operations: List[Dict[str, Any]]):
-        """批量删除操作"""
-        batch = self.db.batch()
-        batch_count = 0
+        try:
+            await run_firestore('batch.commit', batch.commit, timeout=30.0)
+        except NON_RETRYABLE_ERRORS as e:
+            if len(writable) == 1:
+                self._dead_letter(writable[0], e)
+                return 0, []
+            middle = len(writable) // 2
+            first_committed, first_failed = await self._commit_chunk(writable[:middle])
+            second_committed, second_failed = await self._commit_chunk(writable[middle:])
+            return first_committed + second_committed, first_failed + second_failed
+        except Exception as e:
+            logger.error(f"批量提交失败 ({len(writable)} 个文档): {e}")
+            self.stats['failed_operations'] += len(writable)
+            return 0, writable
         
-        for op in operations:
+        if self.write_scheduler:
+            self.write_scheduler.record_commit(writable)
+        return len(writable), []
+    
+    def _add_to_batch(self, batch, op: Dict[str, Any]):
+        """把一个队列操作加入批量写入（数据无法编码或路径无效时抛出异常）"""
+        doc_ref = self.db.collection(op['collection']).document(op['document'])
+        if op['type'] == 'delete':
+            batch.delete(doc_ref)
+        elif op['type'] == 'update':
+            batch.update(doc_ref, {quote_field_path(parts): self._get_path(op['data'], parts)
+                                   for parts in op['paths']})
+        elif op['paths'] is not None:
+            batch.set(doc_ref, op['data'], merge=[quote_field_path(parts) for parts in op['paths']])
+        else:
+            batch.set(doc_ref, op['data'])
+    
+    def _dead_letter(self, op: Dict[str, Any], error: Any):
+        """放弃无法提交的操作：不再放回队列（下次重写日志时移除），记录到死信文件"""
+        logger.error(f"❌ 放弃无法提交的写入 {op['collection']}/{op['document']} ({op['type']}): {error}")
+        self.stats['failed_operations'] += 1
+        self.stats['dead_lettered_operations'] += 1
+        if self.spool:
             try:
-                doc_ref = self.db.collection(op['collection']).document(op['document'])
-                batch.delete(doc_ref)
-                batch_count += 1
-                
-                if batch_count >= 500:
-                    batch.commit()
-                    batch = self.db.batch()
-                    batch_count = 0
-                    
-            except Exception as e:
-                logger.error(f"批量删除操作失败: {e}")
+                self.spool.dead_letter(op, str(error))
+            except OSError as e:
+                logger.error(f"❌ 写入死信文件失败: {e}")
+    
+    @staticmethod
+    def _get_path(data: Dict[str, Any], parts: tuple) -> Any:
+        """读取嵌套数据中字段路径的值"""
+        node = data
+        for part in parts:
+            node = node[part]
+        return node
+    
+    @staticmethod
+    def _is_delete_value(value: Any) -> bool:
+        return value is DELETE_FIELD or value is firestore.DELETE_FIELD
+    
+    def _apply_field_write(self, pending: Dict[str, Any], parts: tuple, value: Any):
+        """把一个字段写入合并到待处理操作
         
-        if batch_count > 0:
-            batch.commit()
+        整体set时直接修改文档数据；set(merge)/update时同时维护字段路径集合，
+        路径被已有的父路径覆盖时不再单独列出，新路径覆盖的子路径被移除。
+        """
+        node = pending['data']
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        
+        paths = pending['paths']
+        covered = paths is None or any(parts[:i] in paths for i in range(1, len(parts)))
+        
+        if not self._is_delete_value(value):
+            node[parts[-1]] = copy.deepcopy(value)
+        elif covered:
+            # 整体set或父路径已整体写入：直接移除字段（Firestore不接受嵌套在写入值中的删除标记）
+            node.pop(parts[-1], None)
+        else:
+            # 删除标记按标识比较，不能复制
+            node[parts[-1]] = value
+        
+        if covered:
+            return
+        for path in [path for path in paths if path[:len(parts)] == parts and len(path) > len(parts)]:
+            paths.discard(path)
+        paths.add(parts)
+    
+    def _to_entry(self, operation: Dict[str, Any]) -> Dict[str, Any]:
+        """把原始操作转换为队列操作（整体写入时 paths 为 None，字段级写入时为字段路径集合）"""
+        op_type = operation['type']
+        data = operation['data']
+        entry = {key: value for key, value in operation.items() if key != 'merge'}
+        
+        if op_type == 'delete' or (op_type == 'set' and not operation.get('merge')):
+            return {**entry, 'data': copy.deepcopy(data), 'paths': None}
+        
+        # 字段级写入：set(merge) 的字段路径列表，或 update 的字段路径键
+        if op_type == 'set':
+            writes = [(parts, self._get_path(data, parts))
+                      for parts in (parse_field_path(path) for path in operation['merge'])]
+        else:
+            writes = [(parse_field_path(path), value) for path, value in data.items()]
+        
+        entry = {**entry, 'data': {}, 'paths': set()}
+        for parts, value in writes:
+            self._apply_field_write(entry, parts, value)
+        return entry
+    
+    def _compose(self, pending: Optional[Dict[str, Any]], entry: Dict[str, Any]) -> Dict[str, Any]:
+        """把较新的队列操作合并到同一文档较早的操作上，返回合并结果"""
+        if pending is None:
+            return entry
+        
+        priority = max(pending['priority'], entry['priority'])
+        if entry['type'] == 'delete' or entry['paths'] is None:
+            # delete 和整体set替换之前的所有写入
+            return {**entry, 'priority': priority}
+        
+        writes = [(parts, self._get_path(entry['data'], parts)) for parts in entry['paths']]
+        
+        if pending['type'] == 'delete':
+            if entry['type'] == 'update':
+                # 文档已删除，update在Firestore中同样会失败
+                logger.warning(f"⚠️ 文档已在队列中删除，忽略update: {entry['collection']}/{entry['document']}")
+                self.stats['failed_operations'] += 1
+                return pending
+            # 删除后set(merge)等价于只包含这些字段的整体set
+            combined = {**entry, 'type': 'set', 'data': {}, 'paths': None, 'priority': priority}
+        else:
+            combined = {**pending, 'priority': priority, 'timestamp': entry['timestamp']}
+            if pending['type'] == 'update' and entry['type'] == 'set':
+                # update之后的set(merge)：文档此时已存在，按set(merge)提交
+                combined['type'] = 'set'
+        
+        for parts, value in writes:
+            self._apply_field_write(combined, parts, value)
+        return combined
     
     def add_operation(self, operation_type: str, collection: str, document: str, 
-                     data: Dict[str, Any] = None, priority: int = 0):
-        """添加操作到队列
+                     data: Dict[str, Any] = None, priority: Optional[int] = None, merge: List[str] = None):
+        """添加操作到队列（与同一文档的待处理操作合并）
         
         Args:
             operation_type: 操作类型 (set, update, delete)
             collection: 集合名称
             document: 文档ID
             data: 数据（对于delete操作可为None）
-            priority: 优先级（0=普通，1=高优先级）
+            priority: 优先级（-1=低，0=普通，1=关键/高优先级），None时由写入调度按集合和字段判断
+            merge: set操作只写入的字段路径列表（字段级补丁），None时整体替换文档
         """
         if not self.initialized:
             logger.warning("Firebase未初始化，操作已忽略")
             return False
         
+        if operation_type not in ('set', 'update', 'delete'):
+            logger.warning(f"未知操作类型: {operation_type}")
+            return False
+        
         operation = {
             'type': operation_type,
             'collection': collection,
@@ -284,27 +524,107 @@ class FirebaseBatchStorage:
             'priority': priority,
             'timestamp': time.time()
         }
+        if merge:
+            operation['merge'] = list(merge)
         
+        key = (collection, document)
         with self.operation_lock:
-            if priority > 0:
-                # 高优先级操作插入到队列前面
-                self.pending_operations.appendleft(operation)
-            else:
-                self.pending_operations.append(operation)
+            pending = self.pending_operations.get(key)
+            try:
+                entry = self._to_entry(operation)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"无效的批量操作 {collection}/{document}: {e}")
+                return False
+            if entry['priority'] is None:
+                entry['priority'] = (self.write_scheduler.classify(collection, document, entry['paths'], entry['data'])
+                                     if self.write_scheduler else 0)
+            
+            # 先写入本地日志，再合并进内存队列（合并会修改队列中的数据）
+            if self.spool:
+                try:
+                    self.spool.append(entry)
+                except OSError as e:
+                    logger.error(f"❌ 写入Firebase写入日志失败: {e}")
+            coalesced = self._compose(pending, entry)
             
+            self.pending_operations[key] = coalesced
+            if coalesced['priority'] > 0:
+                # 高优先级操作移到队列前面
+                self.pending_operations.move_to_end(key, last=False)
+            
+            if pending is not None:
+                self.stats['coalesced_operations'] += 1
             self.stats['pending_count'] = len(self.pending_operations)
             self.stats['total_operations'] += 1
+            queue_full = len(self.pending_operations) - self._deferred_count >= self.max_batch_size
+            
+            # 日志行数过多时按当前队列压缩
+            if self.spool and self.spool.lines >= self.spool_compact_lines:
+                self._rewrite_spool()
         
         # 如果队列过大，立即处理
-        if len(self.pending_operations) >= self.max_batch_size:
-            asyncio.create_task(self._process_pending_operations())
+        if queue_full:
+            self._schedule_flush()
         
         return True
     
+    def has_pending(self, collection: str, document: str) -> bool:
+        """文档是否有尚未确认提交的写入（排队中或提交中）"""
+        key = (collection, document)
+        with self.operation_lock:
+            return key in self.pending_operations or any(
+                (op['collection'], op['document']) == key for op in self._in_flight)
+    
+    def pending_writes(self, collection: str, document: str) -> List[Dict[str, Any]]:
+        """文档尚未确认提交的写入（提交中的在前，排队中的在后）
+        
+        读取前获取，读取后用 apply_pending_writes 叠加到读取结果上：
+        读取期间提交完成的写入再应用一次结果不变。
+        """
+        key = (collection, document)
+        with self.operation_lock:
+            entries = [op for op in self._in_flight if (op['collection'], op['document']) == key]
+            if key in self.pending_operations:
+                entries.append(self.pending_operations[key])
+            return [{**entry, 'paths': set(entry['paths']) if entry['paths'] is not None else None}
+                    for entry in entries]
+    
+    @classmethod
+    def apply_pending_writes(cls, document: Optional[Dict[str, Any]],
+                             entries: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """把尚未确认提交的写入应用到读取结果上（读到自己的写入），文档被删除时返回None"""
+        for entry in entries:
+            if entry['type'] == 'delete':
+                document = None
+                continue
+            if entry['paths'] is None:
+                document = copy.deepcopy(entry['data'])
+                continue
+            
+            document = document if document is not None else {}
+            for parts in entry['paths']:
+                value = cls._get_path(entry['data'], parts)
+                node = document
+                for part in parts[:-1]:
+                    child = node.get(part)
+                    if not isinstance(child, dict):
+                        child = node[part] = {}
+                    node = child
+                if cls._is_delete_value(value):
+                    node.pop(parts[-1], None)
+                else:
+                    node[parts[-1]] = copy.deepcopy(value)
+        return document
+    
+    def _schedule_flush(self):
+        """安排一次刷新（已有刷新在进行或排队时不重复创建）"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._process_pending_operations())
+    
     def force_flush(self):
         """强制刷新所有待处理操作"""
         if self.pending_operations:
-            asyncio.create_task(self._process_pending_operations())
+            self._schedule_flush()
     
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
@@ -316,6 +636,9 @@ class FirebaseBatchStorage:
             'pending_count': pending_count,
             'batch_interval': self.batch_interval,
             'max_batch_size': self.max_batch_size,
+            'in_flight': len(self._in_flight),
+            'retry_attempts': self._retry_attempts,
+            'spool_lines': self.spool.lines if self.spool else None,
             'running': self.running,
             'initialized': self.initialized
         }
@@ -351,16 +674,16 @@ def set_global_batch_storage(storage: FirebaseBatchStorage):
 # ==================== 便捷函数 ====================
 
 async def batch_set(collection: str, document: str, data: Dict[str, Any], 
-                   bot_id: str = None, priority: int = 0) -> bool:
-    """批量设置文档"""
+                   bot_id: str = None, priority: Optional[int] = None, merge: List[str] = None) -> bool:
+    """批量设置文档（merge为字段路径列表时只写入这些字段）"""
     storage = get_global_batch_storage(bot_id)
     if not storage:
         return False
     
-    return storage.add_operation('set', collection, document, data, priority)
+    return storage.add_operation('set', collection, document, data, priority, merge)
 
 async def batch_update(collection: str, document: str, data: Dict[str, Any], 
-                      bot_id: str = None, priority: int = 0) -> bool:
+                      bot_id: str = None, priority: Optional[int] = None) -> bool:
     """批量更新文档"""
     storage = get_global_batch_storage(bot_id)
     if not storage:
@@ -369,7 +692,7 @@ async def batch_update(collection: str, document: str, data: Dict[str, Any],
     return storage.add_operation('update', collection, document, data, priority)
 
 async def batch_delete(collection: str, document: str, 
-                      bot_id: str = None, priority: int = 0) -> bool:
+                      bot_id: str = None, priority: Optional[int] = None) -> bool:
     """批量删除文档"""
     storage = get_global_batch_storage(bot_id)
     if not storage:
@@ -0,0 +1,156 @@
+# ==================== Firebase缓存监听 ====================
+"""
+Firebase缓存监听
+订阅集合的实时变更（on_snapshot），收到变更时直接更新或失效缓存条目，
+多个实例（如本地 + Render）共用同一Firebase项目时，一个实例的修改几秒内对其他实例可见；
+监听期间这些集合的缓存可以使用较长的TTL，不必靠缩短TTL（增加读取）换取新鲜度。
+- 首次订阅会收到集合中的全部文档（计入读取配额），用于预热缓存
+- 有尚未提交的批量写入的文档不用服务端数据覆盖，避免缓存退回到写入前的状态
+- 监听断开或停止时恢复默认TTL并使该集合缓存失效，断开时重新订阅
+"""
+
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+class FirebaseCacheListener:
+    """Firebase缓存监听类"""
+    
+    def __init__(self, db, cache_manager, collections: List[str], listener_ttl: int = 3600,
+                 has_pending_write: Optional[Callable[[str, str], bool]] = None,
+                 check_interval: float = 30.0):
+        """初始化缓存监听
+        
+        Args:
+            db: Firestore客户端
+            cache_manager: FirebaseCacheManager
+            collections: 监听的集合名
+            listener_ttl: 监听期间这些集合的缓存TTL（秒）
+            has_pending_write: 判断文档是否有尚未提交的写入 (collection, document) -> bool
+            check_interval: 检查监听是否仍在运行的间隔（秒）
+        """
+        self.db = db
+        self.cache_manager = cache_manager
+        self.collections = list(collections)
+        self.listener_ttl = listener_ttl
+        self.has_pending_write = has_pending_write
+        self.check_interval = check_interval
+        
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._watches: Dict[str, Any] = {}
+        self._supervisor_task: Optional[asyncio.Task] = None
+        self.running = False
+        
+        self.stats = {
+            'changes_applied': 0,
+            'changes_skipped': 0,
+            'documents_removed': 0,
+            'resubscribes': 0,
+            'last_change_time': None
+        }
+    
+    async def start(self):
+        """订阅所有集合"""
+        if self.running:
+            return
+        self.running = True
+        self._loop = asyncio.get_running_loop()
+        for collection in self.collections:
+            self._subscribe(collection)
+        self._supervisor_task = asyncio.create_task(self._supervise_loop())
+        logger.info(f"✅ 缓存监听已启动: {', '.join(self.collections)} (TTL: {self.listener_ttl}秒)")
+    
+    async def stop(self):
+        """取消所有订阅，恢复默认TTL"""
+        if not self.running:
+            return
+        self.running = False
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            try:
+                await self._supervisor_task
+            except asyncio.CancelledError:
+                pass
+        for collection in list(self._watches):
+            self._unsubscribe(collection)
+        logger.info("✅ 缓存监听已停止")
+    
+    def _subscribe(self, collection: str):
+        # 先设置TTL：首次快照的文档按监听期间的TTL缓存
+        self.cache_manager.collection_ttls[collection] = self.listener_ttl
+        try:
+            self._watches[collection] = self.db.collection(collection).on_snapshot(
+                lambda docs, changes, read_time: self._on_snapshot(collection, changes))
+        except Exception as e:
+            self.cache_manager.collection_ttls.pop(collection, None)
+            logger.error(f"❌ 订阅集合变更失败 {collection}: {e}")
+    
+    def _unsubscribe(self, collection: str):
+        """取消订阅；该集合的缓存条目带有监听期间的长TTL，一并失效"""
+        watch = self._watches.pop(collection, None)
+        self.cache_manager.collection_ttls.pop(collection, None)
+        self.cache_manager.invalidate(collection)
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.debug(f"取消订阅失败 {collection}: {e}")
+    
+    def _on_snapshot(self, collection: str, changes):
+        """监听线程中的回调：提取变更后交给事件循环处理"""
+        extracted: List[Tuple[str, str, Optional[Dict[str, Any]]]] = []
+        for change in changes:
+            change_type = change.type.name
+            document = change.document
+            extracted.append((change_type, document.id,
+                              None if change_type == 'REMOVED' else document.to_dict()))
+        if extracted and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._apply_changes, collection, extracted)
+    
+    def _apply_changes(self, collection: str, changes: List[Tuple[str, str, Optional[Dict[str, Any]]]]):
+        """在事件循环中把变更应用到缓存"""
+        for change_type, document, data in changes:
+            if self.has_pending_write and self.has_pending_write(collection, document):
+                self.stats['changes_skipped'] += 1
+                continue
+            if change_type == 'REMOVED':
+                self.cache_manager.set_missing(collection, document)
+                self.stats['documents_removed'] += 1
+            else:
+                self.cache_manager.set(collection, document, data)
+            self.stats['changes_applied'] += 1
+        self.stats['last_change_time'] = time.time()
+    
+    async def _supervise_loop(self):
+        """监听意外结束时重新订阅"""
+        while self.running:
+            try:
+                await asyncio.sleep(self.check_interval)
+                for collection, watch in list(self._watches.items()):
+                    if getattr(watch, 'is_active', True):
+                        continue
+                    logger.warning(f"⚠️ 集合变更监听已断开，重新订阅: {collection}")
+                    # 断开期间的变更可能已丢失，取消订阅时缓存一并失效
+                    self._unsubscribe(collection)
+                    self._subscribe(collection)
+                    self.stats['resubscribes'] += 1
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"缓存监听检查失败: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取监听统计"""
+        return {
+            **self.stats,
+            'collections': list(self._watches),
+            'listener_ttl': self.listener_ttl,
+            'running': self.running
+        }
+
+__all__ = [
+    "FirebaseCacheListener"
+]
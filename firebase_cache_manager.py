@@ -3,42 +3,83 @@
 """
 Firebase缓存管理器
 减少Firebase API调用次数，优化免费版配额使用
+- 读穿透：get_or_load 把同一文档的并发未命中合并为一次读取（single-flight）
+- 负缓存：不存在的文档以较短TTL缓存
+- 过期后仍可在 stale_ttl 内返回旧值并在后台刷新（stale-while-revalidate）
+- 按估算字节数限制缓存大小，超出时淘汰最近最少使用的条目
 """
 
 import asyncio
 import logging
 import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable, Awaitable
 from collections import OrderedDict
 import threading
 import json
 
+from memory_optimizer import get_global_memory_optimizer, estimate_object_bytes, CACHE_PRIORITY_COSTLY
+from config import DEFAULT_USER_CONFIG
+
 logger = logging.getLogger(__name__)
 
+class CacheEntry:
+    """缓存条目（data 为 None 表示文档不存在）"""
+    
+    __slots__ = ('data', 'stored_at', 'ttl', 'size_bytes')
+    
+    def __init__(self, data: Optional[Dict[str, Any]], ttl: float, size_bytes: int):
+        self.data = data
+        self.stored_at = time.time()
+        self.ttl = ttl
+        self.size_bytes = size_bytes
+    
+    @property
+    def exists(self) -> bool:
+        return self.data is not None
+    
+    def age(self, now: float) -> float:
+        return now - self.stored_at
+
 class FirebaseCacheManager:
     """Firebase缓存管理器 - 减少API调用次数"""
     
-    def __init__(self, bot_id: str, cache_ttl: int = 300, max_cache_size: int = 1000):
+    def __init__(self, bot_id: str, cache_ttl: int = 300, max_cache_bytes: int = 32 * 1024 * 1024,
+                 negative_ttl: int = 30, stale_ttl: int = 600):
         """初始化缓存管理器
         
         Args:
             bot_id: 机器人ID
             cache_ttl: 缓存生存时间（秒），默认5分钟
-            max_cache_size: 最大缓存条目数
+            max_cache_bytes: 缓存估算字节数上限
+            negative_ttl: “文档不存在”的缓存时间（秒）
+            stale_ttl: 过期后仍可返回旧值（同时后台刷新）的时间（秒）
         """
         self.bot_id = bot_id
         self.cache_ttl = cache_ttl
-        self.max_cache_size = max_cache_size
+        self.max_cache_bytes = max_cache_bytes
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
         
         # 缓存存储：OrderedDict保持访问顺序
-        self.cache = OrderedDict()
+        self.cache: "OrderedDict[str, CacheEntry]" = OrderedDict()
         self.cache_lock = threading.RLock()
+        self.cache_bytes = 0
+        
+        # 按集合覆盖的TTL（如有变更监听的集合可以缓存更久）
+        self.collection_ttls: Dict[str, int] = {}
+        
+        # 正在进行的读取：缓存键 -> 读取任务
+        self._inflight: Dict[str, asyncio.Task] = {}
         
         # 统计信息
         self.stats = {
             'cache_hits': 0,
             'cache_misses': 0,
+            'negative_hits': 0,
+            'stale_hits': 0,
+            'loads': 0,
+            'coalesced_loads': 0,
             'cache_evictions': 0,
             'total_requests': 0,
             'api_calls_saved': 0
@@ -48,6 +89,12 @@ class FirebaseCacheManager:
         self.cleanup_task = None
         self.running = False
         
+        # 登记到内存优化器（重建需要重新读取Firebase，淘汰优先级较低）
+        get_global_memory_optimizer(bot_id).register_cache(
+            f"firebase_cache:{bot_id}", self.estimate_size_bytes, self.evict_fraction,
+            priority=CACHE_PRIORITY_COSTLY
+        )
+        
         logger.info(f"✅ Firebase缓存管理器初始化完成 (Bot: {bot_id}, TTL: {cache_ttl}秒)")
     
     async def start_cleanup_task(self):
@@ -85,104 +132,192 @@ class FirebaseCacheManager:
             except Exception as e:
                 logger.error(f"缓存清理错误: {e}")
     
+    def _max_age(self, entry: CacheEntry) -> float:
+        """条目可保留的最长时间（存在的文档保留到旧值可用期结束）"""
+        return entry.ttl + self.stale_ttl if entry.exists else entry.ttl
+    
     def _cleanup_expired(self):
         """清理过期缓存"""
         current_time = time.time()
-        expired_keys = []
         
         with self.cache_lock:
-            for key, (data, timestamp) in self.cache.items():
-                if current_time - timestamp > self.cache_ttl:
-                    expired_keys.append(key)
-            
+            expired_keys = [key for key, entry in self.cache.items()
+                            if entry.age(current_time) > self._max_age(entry)]
             for key in expired_keys:
-                del self.cache[key]
+                self._remove(key)
                 self.stats['cache_evictions'] += 1
         
         if expired_keys:
             logger.debug(f"清理了 {len(expired_keys)} 个过期缓存条目")
     
-    def _evict_oldest(self):
-        """淘汰最旧的缓存条目"""
+    def _remove(self, key: str) -> Optional[CacheEntry]:
+        """移除条目并更新字节数，调用时需持有 cache_lock"""
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.cache_bytes -= entry.size_bytes
+        return entry
+    
+    def _store(self, key: str, data: Optional[Dict[str, Any]], ttl: float):
+        """写入条目，超出字节上限时淘汰最近最少使用的条目"""
+        entry = CacheEntry(data, ttl, estimate_object_bytes(key) + estimate_object_bytes(data, depth=8))
         with self.cache_lock:
-            if len(self.cache) >= self.max_cache_size:
-                # 移除最旧的条目
+            self._remove(key)
+            self.cache[key] = entry
+            self.cache_bytes += entry.size_bytes
+            while self.cache_bytes > self.max_cache_bytes and len(self.cache) > 1:
                 oldest_key = next(iter(self.cache))
-                del self.cache[oldest_key]
+                self._remove(oldest_key)
                 self.stats['cache_evictions'] += 1
                 logger.debug(f"淘汰缓存条目: {oldest_key}")
     
-    def get_cache_key(self, collection: str, document: str, operation: str = "get") -> str:
+    def estimate_size_bytes(self) -> int:
+        """估算缓存占用的字节数"""
+        with self.cache_lock:
+            return self.cache_bytes
+    
+    def evict_fraction(self, fraction: float) -> int:
+        """按最近最少使用顺序淘汰一部分缓存，返回淘汰条目数"""
+        with self.cache_lock:
+            count = min(len(self.cache), int(len(self.cache) * fraction + 0.999999))
+            for key in list(self.cache.keys())[:count]:
+                self._remove(key)
+        self.stats['cache_evictions'] += count
+        return count
+    
+    def get_cache_key(self, collection: str, document: str) -> str:
         """生成缓存键"""
-        return f"{self.bot_id}:{collection}:{document}:{operation}"
+        return f"{self.bot_id}:{collection}:{document}"
     
-    def get(self, collection: str, document: str) -> Optional[Dict[str, Any]]:
-        """从缓存获取数据"""
-        cache_key = self.get_cache_key(collection, document, "get")
+    def _lookup(self, cache_key: str, allow_stale: bool):
+        """查找条目，返回 (状态, 条目)，状态为 fresh / stale / miss"""
         current_time = time.time()
-        
         with self.cache_lock:
             self.stats['total_requests'] += 1
-            
-            if cache_key in self.cache:
-                data, timestamp = self.cache[cache_key]
-                
-                # 检查是否过期
-                if current_time - timestamp <= self.cache_ttl:
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                age = entry.age(current_time)
+                if age <= entry.ttl:
                     # 更新访问时间（移到末尾）
-                    del self.cache[cache_key]
-                    self.cache[cache_key] = (data, timestamp)
-                    
+                    self.cache.move_to_end(cache_key)
                     self.stats['cache_hits'] += 1
                     self.stats['api_calls_saved'] += 1
+                    if not entry.exists:
+                        self.stats['negative_hits'] += 1
                     logger.debug(f"缓存命中: {cache_key}")
-                    return data
-                else:
+                    return 'fresh', entry
+                if allow_stale and entry.exists and age <= entry.ttl + self.stale_ttl:
+                    self.cache.move_to_end(cache_key)
+                    self.stats['stale_hits'] += 1
+                    self.stats['api_calls_saved'] += 1
+                    return 'stale', entry
+                if age > self._max_age(entry):
                     # 过期，删除
-                    del self.cache[cache_key]
+                    self._remove(cache_key)
                     self.stats['cache_evictions'] += 1
             
             self.stats['cache_misses'] += 1
-            return None
+            return 'miss', None
+    
+    def get(self, collection: str, document: str) -> Optional[Dict[str, Any]]:
+        """从缓存获取数据（未命中、已过期或文档不存在时返回None）"""
+        state, entry = self._lookup(self.get_cache_key(collection, document), allow_stale=False)
+        return entry.data if state == 'fresh' else None
     
     def set(self, collection: str, document: str, data: Dict[str, Any], operation: str = "set"):
-        """设置缓存数据"""
-        cache_key = self.get_cache_key(collection, document, operation)
-        current_time = time.time()
+        """设置缓存数据（operation 仅为兼容保留，读写共用同一缓存条目）"""
+        cache_key = self.get_cache_key(collection, document)
+        # 写入的新值覆盖正在进行的读取结果
+        self._inflight.pop(cache_key, None)
+        self._store(cache_key, data, self.collection_ttls.get(collection, self.cache_ttl))
+        logger.debug(f"缓存设置: {cache_key}")
+    
+    def set_missing(self, collection: str, document: str):
+        """缓存“文档不存在”"""
+        cache_key = self.get_cache_key(collection, document)
+        self._inflight.pop(cache_key, None)
+        self._store(cache_key, None, self.negative_ttl)
+    
+    async def get_or_load(self, collection: str, document: str,
+                          loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+                          stale_while_revalidate: bool = False) -> Optional[Dict[str, Any]]:
+        """读穿透获取文档
         
-        with self.cache_lock:
-            # 如果缓存已满，淘汰最旧的条目
-            if len(self.cache) >= self.max_cache_size and cache_key not in self.cache:
-                self._evict_oldest()
-            
-            # 设置缓存
-            self.cache[cache_key] = (data, current_time)
-            logger.debug(f"缓存设置: {cache_key}")
+        Args:
+            loader: 从Firebase读取文档的协程函数，文档不存在时返回None
+            stale_while_revalidate: 过期后仍在 stale_ttl 内时直接返回旧值，并在后台刷新
+        
+        同一文档的并发未命中只执行一次 loader；loader 的异常会传给所有等待者，且不会被缓存。
+        """
+        cache_key = self.get_cache_key(collection, document)
+        state, entry = self._lookup(cache_key, allow_stale=stale_while_revalidate)
+        if state == 'fresh':
+            return entry.data
+        
+        if state == 'stale':
+            if cache_key not in self._inflight:
+                task = self._start_load(cache_key, collection, document, loader)
+                task.add_done_callback(self._log_refresh_error)
+            return entry.data
+        
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = self._start_load(cache_key, collection, document, loader)
+        else:
+            self.stats['coalesced_loads'] += 1
+        # shield：某个等待者被取消时不影响其他等待者共享的读取
+        return await asyncio.shield(task)
+    
+    def _start_load(self, cache_key: str, collection: str, document: str,
+                    loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> asyncio.Task:
+        task = asyncio.create_task(self._run_load(cache_key, collection, document, loader))
+        self._inflight[cache_key] = task
+        self.stats['loads'] += 1
+        return task
+    
+    async def _run_load(self, cache_key: str, collection: str, document: str,
+                        loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        current = asyncio.current_task()
+        try:
+            data = await loader()
+        except BaseException:
+            if self._inflight.get(cache_key) is current:
+                del self._inflight[cache_key]
+            raise
+        
+        # 读取期间该文档被写入或失效时，不用读取结果覆盖缓存
+        if self._inflight.get(cache_key) is current:
+            del self._inflight[cache_key]
+            if data is None:
+                self._store(cache_key, None, self.negative_ttl)
+            else:
+                self._store(cache_key, data, self.collection_ttls.get(collection, self.cache_ttl))
+        return data
+    
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"后台刷新缓存失败: {task.exception()}")
     
     def invalidate(self, collection: str, document: str = None):
         """使缓存失效"""
         with self.cache_lock:
             if document:
-                # 使特定文档的所有操作缓存失效
-                keys_to_remove = []
-                for key in self.cache.keys():
-                    if key.startswith(f"{self.bot_id}:{collection}:{document}:"):
-                        keys_to_remove.append(key)
+                # 使特定文档的缓存失效
+                cache_key = self.get_cache_key(collection, document)
+                self._inflight.pop(cache_key, None)
+                removed = 1 if self._remove(cache_key) is not None else 0
+                self.stats['cache_evictions'] += removed
                 
-                for key in keys_to_remove:
-                    del self.cache[key]
-                    self.stats['cache_evictions'] += 1
-                
-                logger.debug(f"使缓存失效: {collection}/{document} ({len(keys_to_remove)} 个条目)")
+                logger.debug(f"使缓存失效: {collection}/{document} ({removed} 个条目)")
             else:
                 # 使整个集合的缓存失效
-                keys_to_remove = []
-                for key in self.cache.keys():
-                    if key.startswith(f"{self.bot_id}:{collection}:"):
-                        keys_to_remove.append(key)
+                prefix = f"{self.bot_id}:{collection}:"
+                for key in [key for key in self._inflight if key.startswith(prefix)]:
+                    del self._inflight[key]
+                keys_to_remove = [key for key in self.cache.keys() if key.startswith(prefix)]
                 
                 for key in keys_to_remove:
-                    del self.cache[key]
+                    self._remove(key)
                     self.stats['cache_evictions'] += 1
                 
                 logger.debug(f"使集合缓存失效: {collection} ({len(keys_to_remove)} 个条目)")
@@ -192,6 +327,8 @@ class FirebaseCacheManager:
         with self.cache_lock:
             cache_size = len(self.cache)
             self.cache.clear()
+            self.cache_bytes = 0
+            self._inflight.clear()
             self.stats['cache_evictions'] += cache_size
             logger.info(f"清空缓存: {cache_size} 个条目")
     
@@ -200,14 +337,19 @@ class FirebaseCacheManager:
         with self.cache_lock:
             hit_rate = 0
             if self.stats['total_requests'] > 0:
-                hit_rate = self.stats['cache_hits'] / self.stats['total_requests']
+                hit_rate = (self.stats['cache_hits'] + self.stats['stale_hits']) / self.stats['total_requests']
             
             return {
                 **self.stats,
                 'cache_size': len(self.cache),
+                'cache_bytes': self.cache_bytes,
+                'max_cache_bytes': self.max_cache_bytes,
+                'inflight_loads': len(self._inflight),
                 'hit_rate': round(hit_rate, 3),
                 'cache_ttl': self.cache_ttl,
-                'max_cache_size': self.max_cache_size,
+                'collection_ttls': dict(self.collection_ttls),
+                'negative_ttl': self.negative_ttl,
+                'stale_ttl': self.stale_ttl,
                 'running': self.running
             }
     
@@ -216,10 +358,20 @@ class FirebaseCacheManager:
         self.cache_ttl = ttl
         logger.info(f"缓存TTL已设置为 {ttl} 秒")
     
-    def set_max_cache_size(self, size: int):
-        """设置最大缓存大小"""
-        self.max_cache_size = size
-        logger.info(f"最大缓存大小已设置为 {size}")
+    def set_max_cache_bytes(self, max_bytes: int):
+        """设置缓存字节数上限"""
+        self.max_cache_bytes = max_bytes
+        logger.info(f"缓存字节数上限已设置为 {max_bytes}")
+
+def create_cache_manager(bot_id: str) -> FirebaseCacheManager:
+    """按配置创建缓存管理器"""
+    return FirebaseCacheManager(
+        bot_id,
+        cache_ttl=DEFAULT_USER_CONFIG.get('firebase_cache_ttl', 300),
+        max_cache_bytes=DEFAULT_USER_CONFIG.get('firebase_cache_max_bytes', 32 * 1024 * 1024),
+        negative_ttl=DEFAULT_USER_CONFIG.get('firebase_cache_negative_ttl', 30),
+        stale_ttl=DEFAULT_USER_CONFIG.get('firebase_cache_stale_ttl', 600)
+    )
 
 # ==================== 全局缓存管理器 ====================
 
@@ -230,7 +382,7 @@ def get_global_cache_manager(bot_id: str = None) -> Optional[FirebaseCacheManage
     global _global_cache_manager
     
     if _global_cache_manager is None and bot_id:
-        _global_cache_manager = FirebaseCacheManager(bot_id)
+        _global_cache_manager = create_cache_manager(bot_id)
     
     return _global_cache_manager
 
@@ -290,6 +442,8 @@ def get_cache_stats(bot_id: str = None) -> Dict[str, Any]:
 
 __all__ = [
     "FirebaseCacheManager",
+    "CacheEntry",
+    "create_cache_manager",
     "get_global_cache_manager",
     "set_global_cache_manager",
     "cache_get",
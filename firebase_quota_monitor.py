@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 Firebase配额监控器
-监控API使用情况，防止超出免费版配额
+监控API使用情况，防止超出免费版配额；
+按最近一段时间的使用速率预测当日用量和配额耗尽时间（供写入调度使用）
 """
 
 import asyncio
@@ -12,19 +13,22 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 import threading
 from collections import deque
+from config import DEFAULT_USER_CONFIG
 
 logger = logging.getLogger(__name__)
 
 class FirebaseQuotaMonitor:
     """Firebase配额监控器"""
     
-    def __init__(self, bot_id: str):
+    def __init__(self, bot_id: str, burn_window: Optional[int] = None):
         """初始化配额监控器
         
         Args:
             bot_id: 机器人ID
+            burn_window: 计算使用速率的时间窗口（秒）
         """
         self.bot_id = bot_id
+        self.burn_window = burn_window or DEFAULT_USER_CONFIG.get('firebase_quota_burn_window', 900)
         
         # 免费版Firebase配额限制
         self.quota_limits = {
@@ -49,6 +53,11 @@ class FirebaseQuotaMonitor:
         # 历史记录（用于趋势分析）
         self.usage_history = deque(maxlen=1440)  # 保留24小时的数据（每分钟一条）
         
+        # 最近的操作 (时间戳, 数量)，用于计算使用速率
+        self.recent_operations = {'read': deque(), 'write': deque(), 'delete': deque()}
+        self.started_at = time.time()
+        self.current_minute = int(self.started_at // 60)
+        
         # 监控状态
         self.monitoring = False
         self.monitor_task = None
@@ -182,10 +191,22 @@ class FirebaseQuotaMonitor:
                 self.last_reset_date = current_date
                 logger.info("🔄 每日配额计数已重置")
     
+    def _reset_minute_if_needed(self):
+        """进入新的一分钟时重置每分钟计数"""
+        current_minute = int(time.time() // 60)
+        if current_minute != self.current_minute:
+            with self.lock:
+                self.current_minute = current_minute
+                self.reset_minute_counters()
+    
     def record_operation(self, operation_type: str, count: int = 1):
         """记录操作使用量"""
         with self.lock:
+            self._reset_daily_if_needed()
+            self._reset_minute_if_needed()
             self.stats['total_operations'] += count
+            if operation_type in self.recent_operations:
+                self.recent_operations[operation_type].append((time.time(), count))
             
             if operation_type == 'read':
                 self.current_usage['reads_today'] += count
@@ -200,6 +221,8 @@ class FirebaseQuotaMonitor:
     def can_perform_operation(self, operation_type: str, count: int = 1) -> bool:
         """检查是否可以执行操作"""
         with self.lock:
+            self._reset_daily_if_needed()
+            self._reset_minute_if_needed()
             if operation_type == 'read':
                 daily_limit = self.quota_limits['reads_per_day']
                 minute_limit = self.quota_limits['reads_per_minute']
@@ -231,9 +254,64 @@ class FirebaseQuotaMonitor:
             
             return True
     
+    def get_burn_rate(self, operation_type: str) -> float:
+        """最近时间窗口内的使用速率（次/秒）"""
+        with self.lock:
+            now = time.time()
+            operations = self.recent_operations[operation_type]
+            while operations and operations[0][0] < now - self.burn_window:
+                operations.popleft()
+            # 刚启动时按已运行时间计算（至少一分钟），避免少量操作被放大
+            window = max(min(self.burn_window, now - self.started_at), 60)
+            return sum(count for _, count in operations) / window
+    
+    def get_quota_status(self, operation_type: str) -> Dict[str, Any]:
+        """获取某类操作（read/write/delete）的配额使用和按当前速率的预测
+        
+        projected_exhaustion 为按当前速率耗尽当日配额的时间，当日不会耗尽时为None。
+        """
+        with self.lock:
+            self._reset_daily_if_needed()
+            self._reset_minute_if_needed()
+            name = f"{operation_type}s"
+            daily_limit = self.quota_limits[f'{name}_per_day']
+            used_today = self.current_usage[f'{name}_today']
+            
+            now = datetime.now()
+            seconds_left = (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+            burn_rate = self.get_burn_rate(operation_type)
+            remaining = max(daily_limit - used_today, 0)
+            
+            projected_exhaustion = None
+            if burn_rate > 0 and remaining / burn_rate < seconds_left:
+                projected_exhaustion = now + timedelta(seconds=remaining / burn_rate)
+            
+            return {
+                'daily_limit': daily_limit,
+                'used_today': used_today,
+                'minute_limit': self.quota_limits[f'{name}_per_minute'],
+                'used_this_minute': self.current_usage[f'{name}_this_minute'],
+                'burn_rate_per_minute': round(burn_rate * 60, 2),
+                'projected_daily_usage': int(used_today + burn_rate * seconds_left),
+                'projected_exhaustion': projected_exhaustion
+            }
+    
+    def get_projected_exhaustion(self, operation_type: str = 'write') -> Optional[datetime]:
+        """按当前速率耗尽当日配额的时间（当日不会耗尽时为None）"""
+        return self.get_quota_status(operation_type)['projected_exhaustion']
+    
     def get_usage_stats(self) -> Dict[str, Any]:
         """获取使用统计"""
         with self.lock:
+            projections = {}
+            for operation_type in ('read', 'write', 'delete'):
+                status = self.get_quota_status(operation_type)
+                exhaustion = status['projected_exhaustion']
+                projections[operation_type] = {
+                    'burn_rate_per_minute': status['burn_rate_per_minute'],
+                    'projected_daily_usage': status['projected_daily_usage'],
+                    'projected_exhaustion': exhaustion.isoformat() if exhaustion else None
+                }
             return {
                 'current_usage': self.current_usage.copy(),
                 'quota_limits': self.quota_limits.copy(),
@@ -245,6 +323,7 @@ class FirebaseQuotaMonitor:
                     'writes_minute': round(self.current_usage['writes_this_minute'] / self.quota_limits['writes_per_minute'] * 100, 2),
                     'deletes_minute': round(self.current_usage['deletes_this_minute'] / self.quota_limits['deletes_per_minute'] * 100, 2),
                 },
+                'projections': projections,
                 'stats': self.stats.copy(),
                 'monitoring': self.monitoring,
                 'last_reset_date': self.last_reset_date.isoformat(),
@@ -0,0 +1,200 @@
+# ==================== Firebase写入调度 ====================
+"""
+Firebase写入调度
+在 FirebaseQuotaMonitor 之上按优先级分配剩余的每日/每分钟写入配额：
+- 关键写入（频道组、登录会话等）：可以使用全部配额，配额中预留的部分只给关键写入
+- 普通写入：不能使用预留部分
+- 低优先级写入（进度、统计等）：另外在按当前速率预测当日用量会超出非预留配额时延后
+批量队列中被延后的写入留在队列里，与同一文档之后的修改继续合并，配额恢复后再提交。
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import DEFAULT_USER_CONFIG
+from firebase_quota_monitor import FirebaseQuotaMonitor, get_global_quota_monitor
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# 写入优先级（与 FirebaseBatchStorage 的 priority 字段一致：0=普通，1=高优先级）
+PRIORITY_LOW = -1
+PRIORITY_NORMAL = 0
+PRIORITY_CRITICAL = 1
+
+# 每次写入都会附带、不影响分类的字段
+_IGNORED_FIELDS = {'updated_at'}
+
+class WriteDeferredError(Exception):
+    """写入配额不足，写入被延后（调用方保留数据，稍后重试）"""
+
+def priority_level(priority: int) -> str:
+    """优先级名称"""
+    if priority >= PRIORITY_CRITICAL:
+        return 'critical'
+    if priority <= PRIORITY_LOW:
+        return 'low'
+    return 'normal'
+
+class FirebaseWriteScheduler:
+    """Firebase写入调度类"""
+    
+    def __init__(self, quota_monitor: FirebaseQuotaMonitor, critical_reserve: float = 0.1,
+                 minute_reserve: float = 0.2, critical_rules: Iterable[str] = (),
+                 low_rules: Iterable[str] = ()):
+        """初始化写入调度
+        
+        Args:
+            quota_monitor: 配额监控器（提供当前用量和使用速率）
+            critical_reserve: 每日配额中只留给关键写入的比例
+            minute_reserve: 每分钟配额中只留给关键写入的比例
+            critical_rules: 集合/文档/字段名，命中任意一个时为关键写入
+            low_rules: 集合/文档/字段名，集合或文档命中、或所有字段都命中时为低优先级写入
+        """
+        self.quota_monitor = quota_monitor
+        self.critical_reserve = critical_reserve
+        self.minute_reserve = minute_reserve
+        self.critical_rules = set(critical_rules)
+        self.low_rules = set(low_rules)
+        
+        self.stats = {
+            'admitted': {'critical': 0, 'normal': 0, 'low': 0},
+            'deferred': {'critical': 0, 'normal': 0, 'low': 0},
+            'last_deferral_time': None
+        }
+    
+    def classify(self, collection: str, document: str, paths: Optional[Iterable[Tuple[str, ...]]] = None,
+                 data: Optional[Dict[str, Any]] = None) -> int:
+        """按集合、文档和写入的字段判断优先级
+        
+        Args:
+            paths: 字段级写入的字段路径（路径段元组），整体写入时为None（按数据的顶层字段判断）
+        """
+        segments = set(collection.split('/')) | {document}
+        if paths is not None:
+            fields = [set(parts) for parts in paths if parts[0] not in _IGNORED_FIELDS]
+        else:
+            fields = [{key} for key in (data or {}) if key not in _IGNORED_FIELDS]
+        
+        if segments & self.critical_rules or any(field & self.critical_rules for field in fields):
+            return PRIORITY_CRITICAL
+        if segments & self.low_rules or (fields and all(field & self.low_rules for field in fields)):
+            return PRIORITY_LOW
+        return PRIORITY_NORMAL
+    
+    def budget(self, priority: int, operation_type: str = 'write') -> int:
+        """该优先级当前可以使用的写入次数（operation_type: write/delete）"""
+        status = self.quota_monitor.get_quota_status(operation_type)
+        level = priority_level(priority)
+        daily_left = status['daily_limit'] - status['used_today']
+        minute_left = status['minute_limit'] - status['used_this_minute']
+        
+        if level != 'critical':
+            daily_left -= status['daily_limit'] * self.critical_reserve
+            minute_left -= status['minute_limit'] * self.minute_reserve
+        
+        # 按当前速率当日会用完非预留配额时，低优先级写入先延后
+        if level == 'low' and status['projected_daily_usage'] > status['daily_limit'] * (1 - self.critical_reserve):
+            return 0
+        
+        return max(int(min(daily_left, minute_left)), 0)
+    
+    def admit(self, priority: int, operation_type: str = 'write', count: int = 1) -> bool:
+        """直接写入前检查配额，不足时返回False（调用方可以改为加入批量队列）"""
+        level = priority_level(priority)
+        if self.budget(priority, operation_type) >= count:
+            self.stats['admitted'][level] += count
+            return True
+        self.stats['deferred'][level] += count
+        self.stats['last_deferral_time'] = datetime.now().isoformat()
+        return False
+    
+    def select(self, entries: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """从批量队列操作中选出本轮可以提交的操作
+        
+        按优先级从高到低分配配额，返回 (本轮提交的操作, 延后的操作)，两者都保持原有顺序。
+        """
+        budgets: Dict[Tuple[int, str], int] = {}
+        spent = {'write': 0, 'delete': 0}
+        admitted = set()
+        for index in sorted(range(len(entries)), key=lambda i: -entries[i]['priority']):
+            entry = entries[index]
+            operation_type = 'delete' if entry['type'] == 'delete' else 'write'
+            key = (entry['priority'], operation_type)
+            if key not in budgets:
+                budgets[key] = self.budget(*key)
+            if spent[operation_type] < budgets[key]:
+                spent[operation_type] += 1
+                admitted.add(index)
+        
+        selected, deferred = [], []
+        for index, entry in enumerate(entries):
+            level = priority_level(entry['priority'])
+            if index in admitted:
+                selected.append(entry)
+                self.stats['admitted'][level] += 1
+            else:
+                deferred.append(entry)
+                self.stats['deferred'][level] += 1
+        
+        if deferred:
+            self.stats['last_deferral_time'] = datetime.now().isoformat()
+            exhaustion = self.quota_monitor.get_projected_exhaustion('write')
+            logger.info(f"⏳ 写入配额不足，{len(deferred)} 个文档写入延后提交"
+                        + (f"（预计 {exhaustion:%H:%M} 用完当日写入配额）" if exhaustion else ""))
+        return selected, deferred
+    
+    def record_commit(self, entries: List[Dict[str, Any]]):
+        """记录已提交操作的配额使用"""
+        deletes = sum(1 for entry in entries if entry['type'] == 'delete')
+        if len(entries) > deletes:
+            self.quota_monitor.record_operation('write', len(entries) - deletes)
+        if deletes:
+            self.quota_monitor.record_operation('delete', deletes)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计（含按当前速率预测的配额耗尽时间）"""
+        status = self.quota_monitor.get_quota_status('write')
+        exhaustion = status['projected_exhaustion']
+        return {
+            'admitted': dict(self.stats['admitted']),
+            'deferred': dict(self.stats['deferred']),
+            'last_deferral_time': self.stats['last_deferral_time'],
+            'critical_reserve': self.critical_reserve,
+            'minute_reserve': self.minute_reserve,
+            'write_budget': {level: self.budget(priority) for level, priority in
+                             (('critical', PRIORITY_CRITICAL), ('normal', PRIORITY_NORMAL), ('low', PRIORITY_LOW))},
+            'burn_rate_per_minute': status['burn_rate_per_minute'],
+            'projected_daily_usage': status['projected_daily_usage'],
+            'projected_exhaustion': exhaustion.isoformat() if exhaustion else None
+        }
+
+# ==================== 全局写入调度 ====================
+
+_global_write_scheduler = None
+
+def get_global_write_scheduler(bot_id: str = None) -> Optional[FirebaseWriteScheduler]:
+    """获取全局写入调度（与全局配额监控器共用计数），未启用时返回None"""
+    global _global_write_scheduler
+    
+    if _global_write_scheduler is None and DEFAULT_USER_CONFIG.get('firebase_write_scheduler_enabled', True):
+        quota_monitor = get_global_quota_monitor(bot_id)
+        if quota_monitor is not None:
+            _global_write_scheduler = FirebaseWriteScheduler(
+                quota_monitor,
+                critical_reserve=DEFAULT_USER_CONFIG.get('firebase_write_critical_reserve', 0.1),
+                minute_reserve=DEFAULT_USER_CONFIG.get('firebase_write_minute_reserve', 0.2),
+                critical_rules=DEFAULT_USER_CONFIG.get('firebase_write_critical_rules', []),
+                low_rules=DEFAULT_USER_CONFIG.get('firebase_write_low_rules', [])
+            )
+    
+    return _global_write_scheduler
+
+__all__ = [
+    "PRIORITY_LOW",
+    "PRIORITY_NORMAL",
+    "PRIORITY_CRITICAL",
+    "priority_level",
+    "WriteDeferredError",
+    "FirebaseWriteScheduler",
+    "get_global_write_scheduler"
+]
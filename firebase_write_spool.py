@@ -0,0 +1,173 @@
+# ==================== Firebase写入预写日志 ====================
+"""
+Firebase写入预写日志
+FirebaseBatchStorage 的待处理操作在进入内存队列的同时追加到
+data/{bot_id}/firebase_spool.jsonl（每行一个操作），进程重启后回放；
+一轮提交结束后用仍未确认的操作原子重写日志，确认提交的操作才会被移除；
+无法提交而被放弃的操作追加到 data/{bot_id}/firebase_dead_letter.jsonl，便于人工检查和恢复。
+"""
+
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from firebase_admin import firestore
+from field_patch import DELETE_FIELD
+from log_config import get_logger
+logger = get_logger(__name__)
+
+def _encode_value(value: Any) -> Any:
+    """把Firestore删除标记和时间转换为可JSON序列化的形式"""
+    if value is firestore.DELETE_FIELD or value is DELETE_FIELD:
+        return {'__spool__': 'delete_field'}
+    if isinstance(value, datetime):
+        return {'__spool__': 'datetime', 'value': value.isoformat()}
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(item) for item in value]
+    return value
+
+def _decode_object(obj: Dict[str, Any]) -> Any:
+    marker = obj.get('__spool__')
+    if marker == 'delete_field':
+        return firestore.DELETE_FIELD
+    if marker == 'datetime':
+        return datetime.fromisoformat(obj['value'])
+    return obj
+
+def encode_entry(entry: Dict[str, Any]) -> str:
+    """把一个队列操作编码为日志行"""
+    record = {
+        'type': entry['type'],
+        'collection': entry['collection'],
+        'document': entry['document'],
+        'data': _encode_value(entry['data']),
+        'paths': sorted(list(parts) for parts in entry['paths']) if entry['paths'] is not None else None,
+        'priority': entry['priority'],
+        'timestamp': entry['timestamp']
+    }
+    return json.dumps(record, ensure_ascii=False, allow_nan=False)
+
+def decode_entry(line: str) -> Dict[str, Any]:
+    """把日志行解码为队列操作"""
+    entry = json.loads(line, object_hook=_decode_object)
+    entry['paths'] = {tuple(parts) for parts in entry['paths']} if entry['paths'] is not None else None
+    return entry
+
+class FirebaseWriteSpool:
+    """Firebase写入预写日志类"""
+    
+    def __init__(self, bot_id: str, fsync: bool = False):
+        """初始化预写日志
+        
+        Args:
+            bot_id: 机器人ID，用于数据分离
+            fsync: 每次追加后是否fsync（防止系统崩溃丢失，代价是每次写入一次磁盘同步）
+        """
+        self.file_path = f"data/{bot_id}/firebase_spool.jsonl"
+        self.dead_letter_path = f"data/{bot_id}/firebase_dead_letter.jsonl"
+        self.fsync = fsync
+        self.lines = 0
+        self._file = None
+    
+    def load(self) -> List[Dict[str, Any]]:
+        """读取日志中的全部操作（按写入顺序）"""
+        entries = []
+        if not os.path.exists(self.file_path):
+            return entries
+        with open(self.file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entries.append(decode_entry(line))
+                except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+                    # 崩溃时可能留下不完整的最后一行
+                    logger.warning("⚠️ 跳过损坏的Firebase写入日志行")
+        self.lines = len(entries)
+        return entries
+    
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+            self._file = open(self.file_path, 'a', encoding='utf-8')
+        return self._file
+    
+    def append(self, entry: Dict[str, Any]) -> bool:
+        """追加一个操作，无法序列化时返回False（操作仍留在内存队列中）"""
+        try:
+            line = encode_entry(entry)
+        except (TypeError, ValueError) as e:
+            logger.error(f"❌ 操作无法写入Firebase写入日志 {entry['collection']}/{entry['document']}: {e}")
+            return False
+        f = self._open()
+        f.write(line + '\n')
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+        self.lines += 1
+        return True
+    
+    def rewrite(self, entries: Iterable[Dict[str, Any]]):
+        """用仍未确认的操作原子重写日志（没有操作时删除日志）"""
+        self.close()
+        lines = []
+        for entry in entries:
+            try:
+                lines.append(encode_entry(entry))
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ 操作无法写入Firebase写入日志 {entry['collection']}/{entry['document']}: {e}")
+        
+        if not lines:
+            if os.path.exists(self.file_path):
+                os.unlink(self.file_path)
+            self.lines = 0
+            return
+        
+        directory = os.path.dirname(self.file_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        self.lines = len(lines)
+    
+    def dead_letter(self, entry: Dict[str, Any], error: str):
+        """记录被放弃的操作（无法序列化的数据按repr记录）"""
+        try:
+            record = json.loads(encode_entry(entry))
+        except (TypeError, ValueError):
+            record = {
+                'type': entry['type'],
+                'collection': entry['collection'],
+                'document': entry['document'],
+                'data': repr(entry['data'])
+            }
+        record['error'] = error
+        record['failed_at'] = datetime.now().isoformat()
+        
+        os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    
+    def close(self):
+        """关闭追加句柄"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+__all__ = [
+    "FirebaseWriteSpool",
+    "encode_entry",
+    "decode_entry"
+]
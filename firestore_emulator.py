@@ -0,0 +1,36 @@
+# ==================== Firestore模拟器 ====================
+"""
+Firestore模拟器
+设置 FIRESTORE_EMULATOR_HOST（如 localhost:8080）时连接本地Firestore模拟器，
+不需要服务账号凭据，便于在本地测试缓存监听等功能：
+    gcloud emulators firestore start --host-port=localhost:8080
+"""
+
+import os
+from typing import Optional
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+_emulator_client = None
+
+def get_emulator_host() -> Optional[str]:
+    """获取模拟器地址，未设置时返回None"""
+    return os.getenv("FIRESTORE_EMULATOR_HOST") or None
+
+def get_emulator_client(project_id: Optional[str] = None):
+    """获取连接模拟器的Firestore客户端（进程内共享），未设置模拟器时返回None"""
+    global _emulator_client
+    host = get_emulator_host()
+    if not host:
+        return None
+    if _emulator_client is None:
+        from google.cloud import firestore as cloud_firestore
+        _emulator_client = cloud_firestore.Client(project=project_id or "demo-project")
+        logger.info(f"🧪 使用Firestore模拟器: {host} (项目: {_emulator_client.project})")
+    return _emulator_client
+
+__all__ = [
+    "get_emulator_host",
+    "get_emulator_client"
+]
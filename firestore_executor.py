@@ -0,0 +1,140 @@
+# ==================== Firestore执行器 ====================
+"""
+Firestore执行器
+同步Firestore SDK的网络调用（get/set/update/delete/stream/batch.commit）
+统一在有界线程池中执行，事件循环不再阻塞在存储往返上；
+每次调用带超时，并按操作名统计延迟（次数、失败、超时、平均/最大/p95）。
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from config import DEFAULT_USER_CONFIG
+from log_config import get_logger
+logger = get_logger(__name__)
+
+class OperationLatency:
+    """单个操作名的延迟统计"""
+    
+    def __init__(self, window: int):
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms: deque = deque(maxlen=window)
+    
+    def record(self, elapsed_ms: float):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.recent_ms.append(elapsed_ms)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        recent = sorted(self.recent_ms)
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'avg_ms': round(self.total_ms / self.calls, 1) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 1),
+            'p95_ms': round(p95, 1)
+        }
+
+class FirestoreExecutor:
+    """Firestore执行器类"""
+    
+    def __init__(self, max_workers: int = 8, default_timeout: float = 10.0, latency_window: int = 200):
+        """初始化执行器
+        
+        Args:
+            max_workers: 线程池大小（同时进行的Firestore调用上限）
+            default_timeout: 默认单次调用超时（秒，包含排队等待时间）
+            latency_window: 计算p95所用的最近样本数
+        """
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self.latency_window = latency_window
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="firestore")
+        self.in_flight = 0
+        self.operations: Dict[str, OperationLatency] = {}
+    
+    async def run(self, operation: str, func: Callable[..., Any], *args,
+                  timeout: Optional[float] = None, **kwargs) -> Any:
+        """在线程池中执行一次同步Firestore调用
+        
+        Args:
+            operation: 操作名（用于统计，如 'users.get'）
+            func: 同步调用
+            timeout: 超时（秒），None时使用默认超时
+        
+        Raises:
+            asyncio.TimeoutError: 调用超时（线程中的调用会继续执行完，但结果被丢弃）
+        """
+        latency = self.operations.get(operation)
+        if latency is None:
+            latency = self.operations[operation] = OperationLatency(self.latency_window)
+        
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        self.in_flight += 1
+        try:
+            future = loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+            result = await asyncio.wait_for(future, timeout or self.default_timeout)
+            latency.record((time.perf_counter() - started) * 1000)
+            return result
+        except asyncio.TimeoutError:
+            latency.timeouts += 1
+            logger.warning(f"⏱️ Firestore调用超时: {operation} ({timeout or self.default_timeout}秒)")
+            raise
+        except Exception:
+            latency.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取线程池状态和按操作的延迟统计"""
+        return {
+            'max_workers': self.max_workers,
+            'default_timeout': self.default_timeout,
+            'in_flight': self.in_flight,
+            'operations': {name: latency.to_dict() for name, latency in self.operations.items()}
+        }
+    
+    def shutdown(self, wait: bool = False):
+        """关闭线程池"""
+        self._executor.shutdown(wait=wait)
+
+# 全局Firestore执行器（进程内共享，线程数上限对所有机器人生效）
+_global_firestore_executor: Optional[FirestoreExecutor] = None
+
+def get_global_firestore_executor() -> FirestoreExecutor:
+    """获取全局Firestore执行器"""
+    global _global_firestore_executor
+    if _global_firestore_executor is None:
+        _global_firestore_executor = FirestoreExecutor(
+            max_workers=DEFAULT_USER_CONFIG.get('firestore_max_workers', 8),
+            default_timeout=DEFAULT_USER_CONFIG.get('firestore_call_timeout', 10.0)
+        )
+    return _global_firestore_executor
+
+async def run_firestore(operation: str, func: Callable[..., Any], *args,
+                        timeout: Optional[float] = None, **kwargs) -> Any:
+    """在全局Firestore执行器中执行同步调用（便捷函数）"""
+    return await get_global_firestore_executor().run(operation, func, *args, timeout=timeout, **kwargs)
+
+def get_firestore_io_stats() -> Dict[str, Any]:
+    """获取Firestore调用的延迟统计（便捷函数）"""
+    return get_global_firestore_executor().get_stats()
+
+__all__ = [
+    "FirestoreExecutor",
+    "get_global_firestore_executor",
+    "run_firestore",
+    "get_firestore_io_stats"
+]
@@ -0,0 +1,119 @@
+# ==================== 延迟直方图 ====================
+"""
+延迟直方图
+HDR风格的对数分桶直方图：按固定相对精度分桶，记录为O(1)，
+内存只与出现过的桶数有关，可随时查询p50/p95/p99/max；
+LatencyRecorder按指标汇总全局、按任务和按目标频道的直方图
+"""
+
+import math
+from typing import Any, Dict, Optional, Tuple
+
+class LatencyHistogram:
+    """对数分桶延迟直方图（单位：秒）"""
+    
+    def __init__(self, min_value: float = 0.001, precision: float = 0.02):
+        """初始化直方图
+        
+        Args:
+            min_value: 最小可区分值，更小的值计入第一个桶
+            precision: 相对精度（桶宽与值的比例）
+        """
+        self.min_value = min_value
+        self._log_base = math.log1p(precision)
+        self._buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def _bucket_index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        return int(math.log(value / self.min_value) / self._log_base) + 1
+    
+    def _bucket_value(self, index: int) -> float:
+        if index == 0:
+            return self.min_value
+        return self.min_value * math.exp(index * self._log_base)
+    
+    def record(self, value: float):
+        """记录一个值"""
+        value = max(value, 0.0)
+        index = self._bucket_index(value)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+    
+    def percentile(self, percent: float) -> float:
+        """获取分位数（返回所在桶的上界，不超过最大值）"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percent / 100.0))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return min(self._bucket_value(index), self.max)
+        return self.max
+    
+    def summary(self) -> Dict[str, Any]:
+        """获取统计摘要"""
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 4) if self.count else 0.0,
+            'p50': round(self.percentile(50), 4),
+            'p95': round(self.percentile(95), 4),
+            'p99': round(self.percentile(99), 4),
+            'max': round(self.max, 4)
+        }
+
+class LatencyRecorder:
+    """按指标、任务和目标频道汇总延迟直方图"""
+    
+    def __init__(self):
+        """初始化记录器"""
+        # (范围, 键, 指标) -> 直方图；范围为 global/task/target
+        self._histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+    
+    def _get(self, scope: str, key: str, metric: str) -> LatencyHistogram:
+        histogram_key = (scope, key, metric)
+        histogram = self._histograms.get(histogram_key)
+        if histogram is None:
+            histogram = self._histograms[histogram_key] = LatencyHistogram()
+        return histogram
+    
+    def record(self, metric: str, value: float, task_id: Optional[str] = None,
+               target: Optional[str] = None):
+        """记录一个延迟样本（同时计入全局、任务和目标频道的直方图）"""
+        self._get('global', '', metric).record(value)
+        if task_id is not None:
+            self._get('task', str(task_id), metric).record(value)
+        if target is not None:
+            self._get('target', str(target), metric).record(value)
+    
+    def get_mean(self, metric: str) -> float:
+        """获取全局指标的平均值"""
+        histogram = self._histograms.get(('global', '', metric))
+        if not histogram or not histogram.count:
+            return 0.0
+        return histogram.total / histogram.count
+    
+    def remove(self, scope: str, key: str):
+        """删除某个任务或目标频道的直方图"""
+        for histogram_key in [k for k in self._histograms if k[0] == scope and k[1] == str(key)]:
+            del self._histograms[histogram_key]
+    
+    def get_snapshot(self, task_id: Optional[str] = None,
+                     target: Optional[str] = None) -> Dict[str, Any]:
+        """获取直方图摘要，可按任务或目标频道筛选"""
+        snapshot: Dict[str, Any] = {'global': {}, 'tasks': {}, 'targets': {}}
+        for (scope, key, metric), histogram in self._histograms.items():
+            if scope == 'global':
+                snapshot['global'][metric] = histogram.summary()
+            elif scope == 'task' and (task_id is None or key == str(task_id)):
+                snapshot['tasks'].setdefault(key, {})[metric] = histogram.summary()
+            elif scope == 'target' and (target is None or key == str(target)):
+                snapshot['targets'].setdefault(key, {})[metric] = histogram.summary()
+        return snapshot
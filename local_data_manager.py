@@ -2,15 +2,21 @@
 # -*- coding: utf-8 -*-
 """
 本地数据管理器
-使用JSON文件进行本地数据存储
+使用JSON文件进行本地数据存储；也可选择SQLite（WAL模式）存储引擎，
+按行保存用户配置、频道组、过滤配置、任务历史和已知频道，保存开销与变化的行数成正比
 """
 
+import asyncio
+import copy
 import json
 import os
 import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from config import DEFAULT_USER_CONFIG
+from field_patch import DELETE_FIELD, apply_field_updates, normalize_updates
 
 logger = logging.getLogger(__name__)
 
@@ -162,6 +168,24 @@ class LocalDataManager:
         """创建新用户配置"""
         return await self.save_user_config(user_id, DEFAULT_USER_CONFIG.copy())
     
+    async def update_user_fields(self, user_id: str, updates: Dict[str, Any]) -> bool:
+        """按字段路径更新用户数据（updates格式见 field_patch，如 {"config.tail_text": "..."}）"""
+        if not self.initialized:
+            return False
+        if not updates:
+            return True
+        
+        try:
+            user_data = self._load_user_data(user_id)
+            if 'config' not in user_data:
+                user_data['config'] = copy.deepcopy(DEFAULT_USER_CONFIG)
+            apply_field_updates(user_data, updates)
+            user_data['updated_at'] = datetime.now().isoformat()
+            return self._save_user_data(user_id, user_data)
+        except Exception as e:
+            logger.error(f"更新用户字段失败 {user_id}: {e}")
+            return False
+    
     async def get_channel_pairs(self, user_id: str) -> List[Dict[str, Any]]:
         """获取用户的频道组列表"""
         if not self.initialized:
@@ -407,13 +431,583 @@ class LocalDataManager:
                 'timestamp': datetime.now().isoformat()
             }
 
+# ==================== SQLite存储引擎 ====================
+
+# 从用户配置中拆分到独立表的键（user_config表中对应行的value为NULL）
+SPLIT_CONFIG_KEYS = ('channel_filters', 'known_channels')
+
+# 每个用户保留的任务历史条数
+TASK_HISTORY_LIMIT = 100
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_config (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (user_id, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS channel_pairs (
+    user_id TEXT NOT NULL,
+    pair_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, pair_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS channel_filters (
+    user_id TEXT NOT NULL,
+    pair_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, pair_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS known_channels (
+    user_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (user_id, channel)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS task_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_history_user ON task_history (user_id, id);
+"""
+
+def _dump(value: Any) -> str:
+    """序列化为稳定的JSON文本（用于比较是否变化）"""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+class SQLiteLocalDataManager(LocalDataManager):
+    """SQLite本地数据管理器类
+    
+    与LocalDataManager接口相同。所有数据库操作在单独的线程中执行，
+    同一轮事件循环内提交的多次写入合并为一个事务；
+    保存时与已有行比较，只写入变化的行。
+    """
+    
+    def __init__(self, bot_id: str = "default_bot"):
+        """初始化SQLite本地数据管理器
+        
+        Args:
+            bot_id: 机器人ID，用于数据分离
+        """
+        self.db_file = os.path.join(f"data/{bot_id}", "local_data.db")
+        self._conn: Optional[sqlite3.Connection] = None
+        # 单线程执行器：连接只在该线程中使用，操作按提交顺序执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"local-db-{bot_id}")
+        self._pending_writes: List[Tuple[Callable[[sqlite3.Connection], Any], asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {
+            'transactions': 0,
+            'writes': 0,
+            'rows_written': 0
+        }
+        super().__init__(bot_id)
+    
+    def _init_local_storage(self):
+        """初始化SQLite数据库（WAL模式），首次使用时导入已有的JSON数据"""
+        try:
+            os.makedirs(self.data_dir, exist_ok=True)
+            self._executor.submit(self._open_database).result()
+            self.initialized = True
+            logger.debug(f"✅ SQLite本地存储初始化成功 (Bot: {self.bot_id})")
+        except Exception as e:
+            logger.error(f"❌ SQLite本地存储初始化失败: {e}")
+            self.initialized = False
+    
+    def _open_database(self):
+        """打开数据库并建表（在数据库线程中执行）"""
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SQLITE_SCHEMA)
+        self._conn = conn
+        
+        has_users = conn.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+        if not has_users and os.path.isdir(self.users_dir):
+            self._import_json_files(conn)
+    
+    def _import_json_files(self, conn: sqlite3.Connection):
+        """把JSON存储引擎的用户文件导入数据库"""
+        imported = 0
+        conn.execute("BEGIN")
+        try:
+            for file_name in os.listdir(self.users_dir):
+                if not file_name.endswith('.json'):
+                    continue
+                user_id = file_name[:-len('.json')]
+                user_data = self._load_user_data(user_id)
+                if not user_data:
+                    continue
+                if 'config' in user_data:
+                    self._write_config(conn, user_id, self._serialize_config(user_data['config']))
+                self._write_channel_pairs(conn, user_id,
+                                          self._serialize_channel_pairs(user_data.get('channel_pairs', [])))
+                for task_data in user_data.get('task_history', [])[-TASK_HISTORY_LIMIT:]:
+                    conn.execute("INSERT INTO task_history (user_id, data) VALUES (?, ?)",
+                                 (user_id, _dump(task_data)))
+                self._touch_user(conn, user_id)
+                imported += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if imported:
+            logger.info(f"📥 已将 {imported} 个用户的JSON数据导入SQLite (Bot: {self.bot_id})")
+    
+    # ==================== 线程与事务 ====================
+    
+    async def _read(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """在数据库线程中执行读取（先等待已提交的写入完成）"""
+        if self._flush_task and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, operation, self._conn)
+    
+    async def _write(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """提交写入，与同一轮事件循环内的其他写入合并为一个事务"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_writes.append((operation, future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_writes())
+        return await future
+    
+    async def _flush_writes(self):
+        """把排队的写入按批提交（执行期间新到的写入进入下一批）"""
+        await asyncio.sleep(0)
+        loop = asyncio.get_running_loop()
+        while self._pending_writes:
+            batch, self._pending_writes = self._pending_writes, []
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._run_write_batch, [operation for operation, _ in batch])
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+            for (_, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+    
+    def _run_write_batch(self, operations: List[Callable[[sqlite3.Connection], Any]]) -> List[Tuple[bool, Any]]:
+        """在一个事务中执行一批写入（在数据库线程中执行），单个写入失败只回滚其自身"""
+        conn = self._conn
+        results: List[Tuple[bool, Any]] = []
+        changes_before = conn.total_changes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for operation in operations:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((True, operation(conn)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.stats['transactions'] += 1
+        self.stats['writes'] += len(operations)
+        self.stats['rows_written'] += conn.total_changes - changes_before
+        return results
+    
+    async def close(self):
+        """等待排队的写入完成并关闭数据库"""
+        if self._flush_task and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+        if self._conn is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+        self.initialized = False
+    
+    # ==================== 按行读写（在数据库线程中执行） ====================
+    
+    @staticmethod
+    def _touch_user(conn: sqlite3.Connection, user_id: str):
+        conn.execute(
+            "INSERT INTO users (user_id, updated_at) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (user_id, datetime.now().isoformat()))
+    
+    @staticmethod
+    def _read_config(conn: sqlite3.Connection, user_id: str) -> Optional[Dict[str, Any]]:
+        rows = conn.execute("SELECT key, value FROM user_config WHERE user_id = ?", (user_id,)).fetchall()
+        if not rows:
+            return None
+        config: Dict[str, Any] = {}
+        for key, value in rows:
+            if value is not None:
+                config[key] = json.loads(value)
+            elif key == 'channel_filters':
+                config[key] = {
+                    pair_id: json.loads(data) for pair_id, data in conn.execute(
+                        "SELECT pair_id, data FROM channel_filters WHERE user_id = ?", (user_id,))
+                }
+            elif key == 'known_channels':
+                config[key] = [
+                    json.loads(channel) for (channel,) in conn.execute(
+                        "SELECT channel FROM known_channels WHERE user_id = ? ORDER BY position", (user_id,))
+                ]
+        return config
+    
+    @staticmethod
+    def _serialize_config(config: Dict[str, Any]) -> Tuple[Dict[str, Optional[str]], Dict[str, str], Dict[str, int]]:
+        """在事件循环中把配置序列化为行（配置项、过滤配置、已知频道位置），避免线程中读取可变对象"""
+        values = {key: None if key in SPLIT_CONFIG_KEYS else _dump(value) for key, value in config.items()}
+        filters = {str(pair_id): _dump(filter_config)
+                   for pair_id, filter_config in (config.get('channel_filters') or {}).items()}
+        channels = {_dump(channel): position
+                    for position, channel in enumerate(config.get('known_channels') or [])}
+        return values, filters, channels
+    
+    @staticmethod
+    def _serialize_channel_pairs(channel_pairs: List[Dict[str, Any]]) -> Dict[str, Tuple[int, str]]:
+        """在事件循环中把频道组序列化为 pair_id -> (位置, 数据)"""
+        return {str(pair.get('id') or f"#{position}"): (position, _dump(pair))
+                for position, pair in enumerate(channel_pairs)}
+    
+    @classmethod
+    def _write_config(cls, conn: sqlite3.Connection, user_id: str,
+                      rows: Tuple[Dict[str, Optional[str]], Dict[str, str], Dict[str, int]]):
+        """只写入变化的配置项、过滤配置和已知频道"""
+        values, filters, channels = rows
+        
+        stored = dict(conn.execute("SELECT key, value FROM user_config WHERE user_id = ?", (user_id,)).fetchall())
+        for key, value in values.items():
+            if key not in stored or stored[key] != value:
+                conn.execute(
+                    "INSERT INTO user_config (user_id, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value",
+                    (user_id, key, value))
+        for key in stored.keys() - values.keys():
+            conn.execute("DELETE FROM user_config WHERE user_id = ? AND key = ?", (user_id, key))
+        
+        cls._write_channel_filters(conn, user_id, filters)
+        cls._write_known_channels(conn, user_id, channels)
+    
+    @staticmethod
+    def _write_channel_filters(conn: sqlite3.Connection, user_id: str, filters: Dict[str, str]):
+        """只写入变化的过滤配置"""
+        stored_filters = dict(conn.execute(
+            "SELECT pair_id, data FROM channel_filters WHERE user_id = ?", (user_id,)).fetchall())
+        for pair_id, data in filters.items():
+            if stored_filters.get(pair_id) != data:
+                conn.execute(
+                    "INSERT INTO channel_filters (user_id, pair_id, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id, pair_id) DO UPDATE SET data = excluded.data",
+                    (user_id, pair_id, data))
+        for pair_id in stored_filters.keys() - filters.keys():
+            conn.execute("DELETE FROM channel_filters WHERE user_id = ? AND pair_id = ?", (user_id, pair_id))
+    
+    @staticmethod
+    def _write_known_channels(conn: sqlite3.Connection, user_id: str, channels: Dict[str, int]):
+        """只写入新增或位置变化的已知频道"""
+        stored_channels = dict(conn.execute(
+            "SELECT channel, position FROM known_channels WHERE user_id = ?", (user_id,)).fetchall())
+        for channel, position in channels.items():
+            if stored_channels.get(channel) != position:
+                conn.execute(
+                    "INSERT INTO known_channels (user_id, channel, position) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id, channel) DO UPDATE SET position = excluded.position",
+                    (user_id, channel, position))
+        for channel in stored_channels.keys() - channels.keys():
+            conn.execute("DELETE FROM known_channels WHERE user_id = ? AND channel = ?", (user_id, channel))
+    
+    @staticmethod
+    def _write_channel_pairs(conn: sqlite3.Connection, user_id: str, rows: Dict[str, Tuple[int, str]]):
+        """只写入新增、修改或位置变化的频道组"""
+        stored = {pair_id: (position, data) for pair_id, position, data in conn.execute(
+            "SELECT pair_id, position, data FROM channel_pairs WHERE user_id = ?", (user_id,))}
+        for pair_id, row in rows.items():
+            if stored.get(pair_id) != row:
+                conn.execute(
+                    "INSERT INTO channel_pairs (user_id, pair_id, position, data) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(user_id, pair_id) DO UPDATE SET position = excluded.position, data = excluded.data",
+                    (user_id, pair_id, *row))
+        for pair_id in stored.keys() - rows.keys():
+            conn.execute("DELETE FROM channel_pairs WHERE user_id = ? AND pair_id = ?", (user_id, pair_id))
+    
+    @staticmethod
+    def _upsert_config_value(conn: sqlite3.Connection, user_id: str, key: str, value: Optional[str]):
+        conn.execute(
+            "INSERT INTO user_config (user_id, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value",
+            (user_id, key, value))
+    
+    @classmethod
+    def _patch_config(cls, conn: sqlite3.Connection, user_id: str, path: Tuple[str, ...], value: Optional[str]):
+        """按字段路径更新配置（value为序列化后的值，None表示删除），只读写受影响的行"""
+        key, rest = path[0], path[1:]
+        
+        if key in SPLIT_CONFIG_KEYS:
+            if not rest:
+                if value is None:
+                    conn.execute("DELETE FROM user_config WHERE user_id = ? AND key = ?", (user_id, key))
+                rows = cls._serialize_config({key: json.loads(value) if value is not None else None})
+                if key == 'channel_filters':
+                    cls._write_channel_filters(conn, user_id, rows[1])
+                else:
+                    cls._write_known_channels(conn, user_id, rows[2])
+                if value is not None:
+                    cls._upsert_config_value(conn, user_id, key, None)
+                return
+            if key == 'known_channels':
+                raise ValueError("已知频道只能整体更新")
+            
+            cls._upsert_config_value(conn, user_id, key, None)
+            pair_id = rest[0]
+            if len(rest) > 1:
+                row = conn.execute("SELECT data FROM channel_filters WHERE user_id = ? AND pair_id = ?",
+                                   (user_id, pair_id)).fetchone()
+                current = json.loads(row[0]) if row else {}
+                apply_field_updates(current, {rest[1:]: DELETE_FIELD if value is None else json.loads(value)})
+                value = _dump(current)
+            if value is None:
+                conn.execute("DELETE FROM channel_filters WHERE user_id = ? AND pair_id = ?", (user_id, pair_id))
+            else:
+                conn.execute(
+                    "INSERT INTO channel_filters (user_id, pair_id, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id, pair_id) DO UPDATE SET data = excluded.data",
+                    (user_id, pair_id, value))
+            return
+        
+        if rest:
+            row = conn.execute("SELECT value FROM user_config WHERE user_id = ? AND key = ?",
+                               (user_id, key)).fetchone()
+            current = json.loads(row[0]) if row and row[0] is not None else {}
+            if not isinstance(current, dict):
+                current = {}
+            apply_field_updates(current, {rest: DELETE_FIELD if value is None else json.loads(value)})
+            value = _dump(current)
+        if value is None:
+            conn.execute("DELETE FROM user_config WHERE user_id = ? AND key = ?", (user_id, key))
+        else:
+            cls._upsert_config_value(conn, user_id, key, value)
+    
+    # ==================== 数据接口 ====================
+    
+    async def get_user_config(self, user_id: str) -> Dict[str, Any]:
+        """获取用户配置"""
+        if not self.initialized:
+            return DEFAULT_USER_CONFIG.copy()
+        
+        try:
+            config = await self._read(lambda conn: self._read_config(conn, str(user_id)))
+            return config if config is not None else DEFAULT_USER_CONFIG.copy()
+        except Exception as e:
+            logger.error(f"获取用户配置失败 {user_id}: {e}")
+            return DEFAULT_USER_CONFIG.copy()
+    
+    async def save_user_config(self, user_id: str, config: Dict[str, Any]) -> bool:
+        """保存用户配置"""
+        if not self.initialized:
+            return False
+        
+        user_id = str(user_id)
+        rows = self._serialize_config(config)
+        
+        def operation(conn: sqlite3.Connection):
+            self._write_config(conn, user_id, rows)
+            self._touch_user(conn, user_id)
+        
+        try:
+            await self._write(operation)
+            return True
+        except Exception as e:
+            logger.error(f"保存用户配置失败 {user_id}: {e}")
+            return False
+    
+    async def update_user_fields(self, user_id: str, updates: Dict[str, Any]) -> bool:
+        """按字段路径更新（updates格式见 field_patch），只读写受影响的行
+        
+        支持 "config.<键>[.<子键>...]" 和 "channel_pairs"。
+        """
+        if not self.initialized:
+            return False
+        
+        user_id = str(user_id)
+        try:
+            patches = []
+            for parts, value in normalize_updates(updates):
+                if parts == ('updated_at',):
+                    continue
+                if parts == ('channel_pairs',):
+                    patches.append(('channel_pairs', parts, self._serialize_channel_pairs(value or [])))
+                elif parts[0] == 'config' and len(parts) >= 2:
+                    patches.append(('config', parts[1:], None if value is DELETE_FIELD else _dump(value)))
+                else:
+                    raise ValueError(f"SQLite存储不支持的字段路径: {'.'.join(parts)}")
+        except Exception as e:
+            logger.error(f"更新用户字段失败 {user_id}: {e}")
+            return False
+        
+        # 用户尚无配置时先写入默认配置，与JSON存储引擎的行为一致
+        default_rows = self._serialize_config(DEFAULT_USER_CONFIG) if any(
+            kind == 'config' for kind, _, _ in patches) else None
+        
+        def operation(conn: sqlite3.Connection):
+            if default_rows and not conn.execute(
+                    "SELECT 1 FROM user_config WHERE user_id = ? LIMIT 1", (user_id,)).fetchone():
+                self._write_config(conn, user_id, default_rows)
+            for kind, path, value in patches:
+                if kind == 'channel_pairs':
+                    self._write_channel_pairs(conn, user_id, value)
+                else:
+                    self._patch_config(conn, user_id, path, value)
+            self._touch_user(conn, user_id)
+        
+        try:
+            await self._write(operation)
+            return True
+        except Exception as e:
+            logger.error(f"更新用户字段失败 {user_id}: {e}")
+            return False
+    
+    async def get_channel_pairs(self, user_id: str) -> List[Dict[str, Any]]:
+        """获取用户的频道组列表"""
+        if not self.initialized:
+            return []
+        
+        def operation(conn: sqlite3.Connection):
+            return [json.loads(data) for (data,) in conn.execute(
+                "SELECT data FROM channel_pairs WHERE user_id = ? ORDER BY position", (str(user_id),))]
+        
+        try:
+            return await self._read(operation)
+        except Exception as e:
+            logger.error(f"获取频道组列表失败 {user_id}: {e}")
+            return []
+    
+    async def save_channel_pairs(self, user_id: str, channel_pairs: List[Dict[str, Any]]) -> bool:
+        """保存频道组列表"""
+        if not self.initialized:
+            return False
+        
+        user_id = str(user_id)
+        rows = self._serialize_channel_pairs(channel_pairs)
+        
+        def operation(conn: sqlite3.Connection):
+            self._write_channel_pairs(conn, user_id, rows)
+            self._touch_user(conn, user_id)
+        
+        try:
+            await self._write(operation)
+            return True
+        except Exception as e:
+            logger.error(f"保存频道组列表失败 {user_id}: {e}")
+            return False
+    
+    async def get_task_history(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """获取任务历史"""
+        if not self.initialized:
+            return []
+        
+        def operation(conn: sqlite3.Connection):
+            rows = conn.execute(
+                "SELECT data FROM task_history WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                (str(user_id), limit)).fetchall()
+            return [json.loads(data) for (data,) in reversed(rows)]
+        
+        try:
+            return await self._read(operation)
+        except Exception as e:
+            logger.error(f"获取任务历史失败 {user_id}: {e}")
+            return []
+    
+    async def save_task_history(self, user_id: str, task_data: Dict[str, Any]) -> bool:
+        """保存任务历史（追加一行，并删除超出保留条数的旧记录）"""
+        if not self.initialized:
+            return False
+        
+        user_id = str(user_id)
+        task_data['timestamp'] = datetime.now().isoformat()
+        data = _dump(task_data)
+        
+        def operation(conn: sqlite3.Connection):
+            conn.execute("INSERT INTO task_history (user_id, data) VALUES (?, ?)", (user_id, data))
+            conn.execute(
+                "DELETE FROM task_history WHERE user_id = ? AND id <= ("
+                "SELECT id FROM task_history WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_id, user_id, TASK_HISTORY_LIMIT))
+            self._touch_user(conn, user_id)
+        
+        try:
+            await self._write(operation)
+            return True
+        except Exception as e:
+            logger.error(f"保存任务历史失败 {user_id}: {e}")
+            return False
+    
+    async def get_all_users(self) -> List[str]:
+        """获取当前机器人的所有用户ID"""
+        if not self.initialized:
+            return []
+        
+        try:
+            return await self._read(
+                lambda conn: [user_id for (user_id,) in conn.execute("SELECT user_id FROM users")])
+        except Exception as e:
+            logger.error(f"获取用户列表失败: {e}")
+            return []
+    
+    async def health_check(self) -> Dict[str, Any]:
+        """健康检查"""
+        try:
+            if not self.initialized:
+                return {
+                    'status': 'error',
+                    'message': '本地存储未初始化',
+                    'bot_id': self.bot_id,
+                    'timestamp': datetime.now().isoformat()
+                }
+            
+            journal_mode = await self._read(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+            return {
+                'status': 'healthy',
+                'message': '本地存储连接正常',
+                'bot_id': self.bot_id,
+                'storage_engine': 'sqlite',
+                'db_file': self.db_file,
+                'journal_mode': journal_mode,
+                'stats': self.stats.copy(),
+                'timestamp': datetime.now().isoformat()
+            }
+        
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f'本地存储连接异常: {str(e)}',
+                'bot_id': self.bot_id,
+                'timestamp': datetime.now().isoformat()
+            }
+
 # ==================== 导出函数 ====================
 
-def create_local_data_manager(bot_id: str) -> LocalDataManager:
-    """创建本地数据管理器实例"""
+def create_local_data_manager(bot_id: str, storage_engine: str = "json") -> LocalDataManager:
+    """创建本地数据管理器实例
+    
+    Args:
+        bot_id: 机器人ID
+        storage_engine: 存储引擎，json（每用户一个JSON文件）或 sqlite（WAL模式数据库）
+    """
+    if (storage_engine or "json").lower() == "sqlite":
+        return SQLiteLocalDataManager(bot_id)
     return LocalDataManager(bot_id)
 
 __all__ = [
     "LocalDataManager",
+    "SQLiteLocalDataManager",
     "create_local_data_manager"
 ]
@@ -30,7 +30,7 @@ from pyrogram.errors import FloodWait, RPCError
 # 导入自定义模块
 from config import get_config, validate_config, DEFAULT_USER_CONFIG
 from multi_bot_data_manager import create_multi_bot_data_manager
-from local_data_manager import create_local_data_manager
+from local_data_manager import create_local_data_manager, SQLiteLocalDataManager
 from optimized_firebase_manager import get_global_optimized_manager, start_optimization_services
 from ui_layouts import (
     generate_button_layout, MAIN_MENU_BUTTONS_WITH_USER_API, 
@@ -42,6 +42,8 @@ from channel_data_manager import ChannelDataManager
 from message_engine import create_message_engine
 from cloning_engine import create_cloning_engine, CloneTask
 from task_state_manager import start_task_state_manager, stop_task_state_manager
+from memory_optimizer import (get_global_memory_optimizer, start_memory_optimizer, stop_memory_optimizer,
+                              estimate_container_bytes, evict_mapping, CACHE_PRIORITY_CHEAP)
 from web_server import create_web_server
 from user_api_manager import get_user_api_manager, UserAPIManager
 
@@ -77,7 +79,8 @@ class TelegramBot:
         # 根据配置选择存储方式
         if self.config.get('use_local_storage', False):
             logger.debug("🔧 使用本地存储模式")
-            self.data_manager = create_local_data_manager(self.bot_id)
+            self.data_manager = create_local_data_manager(
+                self.bot_id, self.config.get('local_storage_engine', 'json'))
         else:
             logger.info("🔧 使用Firebase存储模式")
             self.data_manager = create_multi_bot_data_manager(self.bot_id)
@@ -109,6 +112,16 @@ class TelegramBot:
         self._cache_expiry = 0  # 缓存过期时间
         self._cache_duration = 300  # 缓存持续时间（5分钟）
         
+        # 频道显示名称缓存（可随时通过API重新获取，内存紧张时最先淘汰）
+        self.channel_cache = {}  # 频道信息缓存
+        self.cache_expiry = {}   # 缓存过期时间
+        self.cache_duration = 3600  # 缓存1小时
+        get_global_memory_optimizer(self.bot_id).register_cache(
+            f"bot.channel_cache:{self.bot_id}",
+            lambda: estimate_container_bytes(self.channel_cache) + estimate_container_bytes(self.cache_expiry),
+            self._evict_channel_cache, priority=CACHE_PRIORITY_CHEAP
+        )
+        
         # 加载User API登录状态
         self._load_user_api_status()
     
@@ -435,6 +448,12 @@ class TelegramBot:
                 logger.warning(f"⚠️ 启动任务状态管理器失败: {e}")
                 logger.warning("💡 将使用内存模式，任务状态可能不会持久化")
             
+            # 启动内存优化器（内存紧张时按优先级淘汰已注册的缓存）
+            try:
+                await start_memory_optimizer(self.bot_id)
+            except Exception as e:
+                logger.warning(f"⚠️ 启动内存优化器失败: {e}")
+            
             # 初始化搬运引擎（优先使用 User API，如果未登录则使用 Bot API）
             if self.user_api_logged_in and self.user_api_manager and self.user_api_manager.client:
                 logger.info("🔧 使用 User API 初始化搬运引擎")
@@ -4543,11 +4562,12 @@ class TelegramBot:
             logger.warning(f"获取频道显示名称失败 {chat_id}: {e}")
             return str(chat_id)
     
-        # 频道信息缓存
-        self.channel_cache = {}  # 频道信息缓存
-        self.cache_expiry = {}   # 缓存过期时间
-        self.cache_duration = 3600  # 缓存1小时
-        
+    def _evict_channel_cache(self, fraction: float):
+        """淘汰最早加入的一部分频道名称缓存（供内存优化器使用）"""
+        evict_mapping(self.channel_cache, fraction)
+        for chat_id in [chat_id for chat_id in self.cache_expiry if chat_id not in self.channel_cache]:
+            del self.cache_expiry[chat_id]
+    
     async def _get_channel_display_name_safe(self, chat_id: str) -> str:
         """安全获取频道显示名称（带缓存）"""
         try:
@@ -5667,9 +5687,8 @@ class TelegramBot:
             channel_filters['independent_enabled'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['independent_enabled'] else "❌ 已禁用"
             await callback_query.answer(f"独立过滤 {status_text}")
@@ -5971,9 +5990,8 @@ class TelegramBot:
             channel_filters['content_removal'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['content_removal'] else "❌ 已禁用"
             await callback_query.answer(f"纯文本过滤 {status_text}")
@@ -6152,9 +6170,8 @@ class TelegramBot:
             channel_filters['remove_usernames'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['remove_usernames'] else "❌ 已禁用"
             await callback_query.answer(f"用户名移除 {status_text}")
@@ -6280,9 +6297,8 @@ class TelegramBot:
             channel_filters['filter_buttons'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['filter_buttons'] else "❌ 已禁用"
             await callback_query.answer(f"按钮过滤 {status_text}")
@@ -6354,9 +6370,8 @@ class TelegramBot:
             channel_filters['filter_buttons'] = True  # 启用功能
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             mode_names = {
                 'remove_buttons_only': '仅移除按钮',
@@ -6553,9 +6568,8 @@ class TelegramBot:
             channel_filters['keywords_enabled'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['keywords_enabled'] else "❌ 已禁用"
             await callback_query.answer(f"关键字过滤 {status_text}")
@@ -6604,9 +6618,8 @@ class TelegramBot:
             channel_filters['keywords'] = []
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer("✅ 关键字已清空")
             
@@ -6657,9 +6670,8 @@ class TelegramBot:
                     channel_filters['keywords'] = keywords
                     
                     # 保存配置
-                    user_config = await self.data_manager.get_user_config(user_id)
-                    user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                    await self.data_manager.save_user_config(user_id, user_config)
+                    await self.data_manager.update_user_fields(
+                        user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                     
                     await message.reply_text(f"✅ 已删除关键字: {keyword_to_remove}")
                 else:
@@ -6685,9 +6697,8 @@ class TelegramBot:
                 channel_filters['keywords'] = []
                 
                 # 保存配置
-                user_config = await self.data_manager.get_user_config(user_id)
-                user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                 
                 await message.reply_text("✅ 已清空所有关键字")
                 
@@ -6713,9 +6724,8 @@ class TelegramBot:
                 channel_filters['keywords_enabled'] = enabled
                 
                 # 保存配置
-                user_config = await self.data_manager.get_user_config(user_id)
-                user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                 
                 status_text = "✅ 已启用" if enabled else "❌ 已禁用"
                 await message.reply_text(f"关键字过滤 {status_text}")
@@ -6755,9 +6765,8 @@ class TelegramBot:
                     channel_filters['keywords'] = keywords
                     
                     # 保存配置
-                    user_config = await self.data_manager.get_user_config(user_id)
-                    user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                    await self.data_manager.save_user_config(user_id, user_config)
+                    await self.data_manager.update_user_fields(
+                        user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                     
                     success_msg = f"✅ 已添加关键字: {', '.join(added_keywords)}"
                     if duplicate_keywords:
@@ -7214,9 +7223,8 @@ class TelegramBot:
             channel_filters['tail_text'] = ''
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer("✅ 小尾巴已清空")
             
@@ -7332,9 +7340,8 @@ class TelegramBot:
             channel_filters['additional_buttons'] = []
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer("✅ 按钮已清空")
             
@@ -7413,9 +7420,8 @@ class TelegramBot:
                 channel_filters['tail_text'] = text
                 
                 # 保存配置
-                user_config = await self.data_manager.get_user_config(user_id)
-                user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                 
                 await message.reply_text(f"✅ 小尾巴设置成功: {text}")
                 
@@ -7483,9 +7489,8 @@ class TelegramBot:
                         channel_filters['additional_buttons'] = additional_buttons
                         
                         # 保存配置
-                        user_config = await self.data_manager.get_user_config(user_id)
-                        user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                        await self.data_manager.save_user_config(user_id, user_config)
+                        await self.data_manager.update_user_fields(
+                            user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                         
                         await message.reply_text(f"✅ 按钮添加成功: {button_text} -> {button_url}")
                         
@@ -7542,9 +7547,8 @@ class TelegramBot:
             channel_filters['tail_frequency'] = frequency
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer(f"✅ 小尾巴频率设置为 {frequency}%")
             
@@ -7570,9 +7574,8 @@ class TelegramBot:
             channel_filters['tail_position'] = position
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             position_text = "末尾" if position == "end" else "开头"
             await callback_query.answer(f"✅ 小尾巴位置设置为 {position_text}")
@@ -7599,9 +7602,8 @@ class TelegramBot:
             channel_filters['button_frequency'] = frequency
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer(f"✅ 按钮频率设置为 {frequency}%")
             
@@ -8955,9 +8957,8 @@ https://t.me/channel_name 1-10
             channel_filters['replacements_enabled'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['replacements_enabled'] else "❌ 已禁用"
             await callback_query.answer(f"敏感词替换 {status_text}")
@@ -9006,9 +9007,8 @@ https://t.me/channel_name 1-10
             channel_filters['replacements'] = {}
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             await callback_query.answer("✅ 替换规则已清空")
             
@@ -9059,9 +9059,8 @@ https://t.me/channel_name 1-10
                     channel_filters['replacements'] = replacements
                     
                     # 保存配置
-                    user_config = await self.data_manager.get_user_config(user_id)
-                    user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                    await self.data_manager.save_user_config(user_id, user_config)
+                    await self.data_manager.update_user_fields(
+                        user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                     
                     await message.reply_text(f"✅ 已删除替换规则: {original_word}")
                 else:
@@ -9087,9 +9086,8 @@ https://t.me/channel_name 1-10
                 channel_filters['replacements'] = {}
                 
                 # 保存配置
-                user_config = await self.data_manager.get_user_config(user_id)
-                user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                 
                 await message.reply_text("✅ 已清空所有替换规则")
                 
@@ -9115,9 +9113,8 @@ https://t.me/channel_name 1-10
                 channel_filters['replacements_enabled'] = enabled
                 
                 # 保存配置
-                user_config = await self.data_manager.get_user_config(user_id)
-                user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                 
                 status_text = "✅ 已启用" if enabled else "❌ 已禁用"
                 await message.reply_text(f"敏感词替换 {status_text}")
@@ -9152,9 +9149,8 @@ https://t.me/channel_name 1-10
                         channel_filters['replacements'] = replacements
                         
                         # 保存配置
-                        user_config = await self.data_manager.get_user_config(user_id)
-                        user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-                        await self.data_manager.save_user_config(user_id, user_config)
+                        await self.data_manager.update_user_fields(
+                            user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
                         
                         await message.reply_text(f"✅ 替换规则添加成功: {original_word} → {replacement_word}")
                     else:
@@ -9196,9 +9192,8 @@ https://t.me/channel_name 1-10
             channel_filters['enhanced_filter_enabled'] = not current_status
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             status_text = "✅ 已启用" if channel_filters['enhanced_filter_enabled'] else "❌ 已禁用"
             await callback_query.answer(f"增强版链接过滤 {status_text}")
@@ -9271,9 +9266,8 @@ https://t.me/channel_name 1-10
             channel_filters['enhanced_filter_enabled'] = True  # 启用功能
             
             # 保存配置
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_config['admin_channel_filters'][str(channel_id)] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'admin_channel_filters', str(channel_id)): channel_filters})
             
             mode_names = {
                 'aggressive': '激进模式',
@@ -11715,7 +11709,7 @@ https://t.me/channel_name 1-10
                 # 清空所有附加按钮
                 user_config = await self.data_manager.get_user_config(user_id)
                 user_config['additional_buttons'] = []
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(user_id, {'config.additional_buttons': []})
                 
                 # 清除用户状态
                 del self.user_states[user_id]
@@ -11892,7 +11886,7 @@ https://t.me/channel_name 1-10
             user_config['content_removal'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.content_removal': new_status})
             
             # 先回答回调查询
             action_text = "启用" if new_status else "禁用"
@@ -11984,7 +11978,7 @@ https://t.me/channel_name 1-10
             user_config['content_removal_mode'] = mode
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.content_removal_mode': mode})
             
             # 模式描述
             mode_descriptions = {
@@ -12027,7 +12021,7 @@ https://t.me/channel_name 1-10
             user_config['filter_buttons'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.filter_buttons': new_status})
             
             # 状态文本
             action_text = "启用" if new_status else "禁用"
@@ -12121,7 +12115,7 @@ https://t.me/channel_name 1-10
             user_config['button_filter_mode'] = mode
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.button_filter_mode': mode})
             
             # 模式描述
             mode_descriptions = {
@@ -12431,7 +12425,7 @@ https://t.me/channel_name 1-10
             user_config['remove_all_links'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.remove_all_links': new_status})
             
             status_text = "✅ 已开启" if new_status else "❌ 已关闭"
             message_text = f"""
@@ -12469,7 +12463,7 @@ https://t.me/channel_name 1-10
             user_config['remove_hashtags'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.remove_hashtags': new_status})
             
             status_text = "✅ 已开启" if new_status else "❌ 已关闭"
             message_text = f"""
@@ -12507,7 +12501,7 @@ https://t.me/channel_name 1-10
             user_config['remove_usernames'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.remove_usernames': new_status})
             
             status_text = "✅ 已开启" if new_status else "❌ 已关闭"
             message_text = f"""
@@ -12927,7 +12921,7 @@ https://t.me/channel_name 1-10
             user_config['filter_photo'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.filter_photo': new_status})
             
             status_text = "✅ 已过滤" if new_status else "❌ 不过滤"
             message_text = f"""
@@ -12965,7 +12959,7 @@ https://t.me/channel_name 1-10
             user_config['filter_video'] = new_status
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.filter_video': new_status})
             
             status_text = "✅ 已过滤" if new_status else "❌ 不过滤"
             message_text = f"""
@@ -13462,7 +13456,7 @@ https://t.me/channel_name 1-10
             user_config['enhanced_filter_enabled'] = not current_state
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.enhanced_filter_enabled': user_config['enhanced_filter_enabled']})
             
             # 重新显示菜单
             await self._show_enhanced_filter_config(callback_query)
@@ -13485,7 +13479,7 @@ https://t.me/channel_name 1-10
             user_config['enhanced_filter_mode'] = modes[next_index]
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.enhanced_filter_mode': user_config['enhanced_filter_mode']})
             
             # 重新显示菜单
             await self._show_enhanced_filter_config(callback_query)
@@ -13621,7 +13615,7 @@ t.me/test_channel
             user_config['remove_links_mode'] = new_mode
             
             # 保存配置
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.remove_links_mode': new_mode})
             
             mode_text = "🗑️ 移除整条消息" if new_mode == 'remove_message' else "📝 智能移除链接"
             message_text = f"""
@@ -15216,6 +15210,12 @@ t.me/test_channel
                 except Exception as e:
                     logger.warning(f"停止实时监听引擎时出错: {e}")
             
+            # 停止内存优化器
+            try:
+                await stop_memory_optimizer(self.bot_id)
+            except Exception as e:
+                logger.warning(f"停止内存优化器时出错: {e}")
+            
             # 停止批量存储处理器
             if not self.config.get('use_local_storage', False):
                 try:
@@ -15227,6 +15227,14 @@ t.me/test_channel
                     logger.warning("⚠️ 停止批量存储处理器超时，强制继续")
                 except Exception as e:
                     logger.warning(f"停止批量存储处理器时出错: {e}")
+            elif isinstance(self.data_manager, SQLiteLocalDataManager):
+                try:
+                    await asyncio.wait_for(self.data_manager.close(), timeout=3.0)
+                    logger.info("✅ SQLite本地存储已关闭")
+                except asyncio.TimeoutError:
+                    logger.warning("⚠️ 关闭SQLite本地存储超时，强制继续")
+                except Exception as e:
+                    logger.warning(f"关闭SQLite本地存储时出错: {e}")
             
             # 停止User API客户端
             if hasattr(self, 'user_api_manager') and self.user_api_manager:
@@ -15327,7 +15335,7 @@ t.me/test_channel
                 # 清空所有替换规则
                 user_config = await self.data_manager.get_user_config(user_id)
                 user_config['replacement_words'] = {}
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(user_id, {'config.replacement_words': {}})
                 
                 # 清除用户状态
                 del self.user_states[user_id]
@@ -15415,7 +15423,7 @@ t.me/test_channel
                 # 清空所有关键字
                 user_config = await self.data_manager.get_user_config(user_id)
                 user_config['filter_keywords'] = []
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(user_id, {'config.filter_keywords': []})
                 logger.info(f"用户 {user_id} 的关键字已清空")
                 
                 # 清除用户状态
@@ -15539,7 +15547,7 @@ t.me/test_channel
             
             # 清空附加按钮
             user_config['additional_buttons'] = []
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.additional_buttons': []})
             
             await callback_query.edit_message_text(
                 "✅ 附加按钮已清空！\n\n"
@@ -16629,7 +16637,8 @@ t.me/test_channel
                 if 'channel_filters' not in user_config:
                     user_config['channel_filters'] = {}
                 user_config['channel_filters'][pair['id']] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'channel_filters', pair['id']): channel_filters})
                 
                 await message.reply_text(
                     f"✅ **关键字过滤状态已切换！**\n\n"
@@ -16776,7 +16785,8 @@ t.me/test_channel
                 if 'channel_filters' not in user_config:
                     user_config['channel_filters'] = {}
                 user_config['channel_filters'][pair['id']] = channel_filters
-                await self.data_manager.save_user_config(user_id, user_config)
+                await self.data_manager.update_user_fields(
+                    user_id, {('config', 'channel_filters', pair['id']): channel_filters})
                 
                 await message.reply_text(
                     f"✅ **替换规则已清空！**\n\n"
@@ -17067,7 +17077,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             await callback_query.answer(f"✅ 纯文本过滤已{'启用' if new_status else '禁用'}")
             
@@ -17110,7 +17121,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             mode_descriptions = {
                 'text_only': '仅移除纯文本',
@@ -17408,7 +17420,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             await callback_query.answer(f"✅ 链接移除已{'启用' if new_status else '禁用'}")
             
@@ -17451,7 +17464,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             mode_descriptions = {
                 'links_only': '智能移除链接',
@@ -17513,7 +17527,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             await callback_query.answer(f"✅ 增强链接过滤已{'启用' if new_status else '禁用'}")
             
@@ -17556,7 +17571,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             mode_descriptions = {
                 'aggressive': '激进模式',
@@ -17620,7 +17636,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             await callback_query.answer(f"✅ 用户名移除已{'启用' if new_status else '禁用'}")
             
@@ -17662,7 +17679,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             await callback_query.answer(f"✅ 按钮移除已{'启用' if new_status else '禁用'}")
             
@@ -17705,7 +17723,8 @@ t.me/test_channel
             if 'channel_filters' not in user_config:
                 user_config['channel_filters'] = {}
             user_config['channel_filters'][pair['id']] = channel_filters
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(
+                user_id, {('config', 'channel_filters', pair['id']): channel_filters})
             
             mode_descriptions = {
                 'remove_buttons_only': '仅移除按钮',
@@ -19373,7 +19392,7 @@ t.me/test_channel
             
             # 保存配置
             user_config['monitored_pairs'] = monitored_pairs
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.monitored_pairs': monitored_pairs})
             
             # 如果监听功能已启用，更新监听系统
             if user_config.get('monitor_enabled', False) and self.monitor_system:
@@ -19422,7 +19441,7 @@ t.me/test_channel
                 monitored_pairs.append(monitor_pair)
             
             user_config['monitored_pairs'] = monitored_pairs
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.monitored_pairs': monitored_pairs})
             
             # 监听系统已移除
             
@@ -19443,7 +19462,7 @@ t.me/test_channel
             
             # 清空监听频道
             user_config['monitored_pairs'] = []
-            await self.data_manager.save_user_config(user_id, user_config)
+            await self.data_manager.update_user_fields(user_id, {'config.monitored_pairs': []})
             
             # 监听系统已移除
             
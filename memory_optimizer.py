@@ -6,18 +6,92 @@
 """
 
 import asyncio
+import ctypes
+import ctypes.util
 import logging
+import math
+import sys
 import time
 import gc
 import psutil
 import threading
-from typing import Dict, List, Any, Optional, Callable
+from typing import Dict, List, Any, Optional, Callable, MutableMapping
 from dataclasses import dataclass
 from collections import defaultdict
 import weakref
 
+from task_resource_tracker import detect_memory_limit_mb
+
 logger = logging.getLogger(__name__)
 
+# 缓存淘汰优先级：数值越小越先淘汰（重建成本越低）
+CACHE_PRIORITY_CHEAP = 10  # 可随时重新拉取的数据（消息、频道名称）
+CACHE_PRIORITY_NORMAL = 30  # 需要读取本地配置才能重建
+CACHE_PRIORITY_COSTLY = 50  # 重建需要消耗Firebase读配额
+CACHE_PRIORITY_CRITICAL = 90  # 淘汰会影响正确性（如去重集合），只在紧急时裁剪
+
+# 各内存级别允许淘汰的最高优先级（不含）
+PRESSURE_PRIORITY_LIMITS = {
+    'warning': CACHE_PRIORITY_COSTLY,
+    'critical': CACHE_PRIORITY_CRITICAL,
+    'emergency': CACHE_PRIORITY_CRITICAL + 1
+}
+
+def estimate_object_bytes(obj: Any, depth: int = 3) -> int:
+    """递归估算对象占用的字节数（限制深度，避免遍历整个对象图）"""
+    size = sys.getsizeof(obj)
+    if depth <= 0:
+        return size
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(estimate_object_bytes(k, depth - 1) + estimate_object_bytes(v, depth - 1)
+                          for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(estimate_object_bytes(item, depth - 1) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return size + estimate_object_bytes(vars(obj), depth - 1)
+    return size
+
+def estimate_container_bytes(container: Any, sample_size: int = 32) -> int:
+    """按抽样估算容器的总字节数：容器本身 + 抽样条目的平均大小 × 条目数"""
+    count = len(container)
+    size = sys.getsizeof(container)
+    if not count:
+        return size
+    items = container.items() if isinstance(container, dict) else container
+    sampled = 0
+    sampled_bytes = 0
+    for item in items:
+        sampled_bytes += estimate_object_bytes(item)
+        sampled += 1
+        if sampled >= sample_size:
+            break
+    return size + int(sampled_bytes / sampled * count)
+
+def evict_mapping(mapping: MutableMapping, fraction: float, lock=None) -> int:
+    """按插入顺序淘汰映射中最旧的一部分条目，返回淘汰条目数"""
+    def _evict():
+        count = min(len(mapping), math.ceil(len(mapping) * fraction))
+        for key in list(mapping.keys())[:count]:
+            mapping.pop(key, None)
+        return count
+    if lock is None:
+        return _evict()
+    with lock:
+        return _evict()
+
+@dataclass
+class CacheRegistration:
+    """已注册的缓存"""
+    name: str
+    size_estimator: Callable[[], int]  # 返回当前占用的估算字节数
+    evictor: Callable[[float], Any]  # 按比例(0-1]淘汰条目
+    priority: int = CACHE_PRIORITY_NORMAL
+    bytes_reclaimed: int = 0
+    evictions: int = 0
+    last_size: int = 0
+
 @dataclass
 class MemoryStats:
     """内存统计信息"""
@@ -65,9 +139,16 @@ class MemoryOptimizer:
             'emergency_cleanup': self._emergency_cleanup
         }
         
+        # 缓存注册表：各模块登记大小估算和淘汰函数，内存紧张时按优先级淘汰
+        self.cache_registry: Dict[str, CacheRegistration] = {}
+        self._registry_lock = threading.RLock()
+        
         # 缓存清理回调
         self.cache_cleanup_callbacks: List[Callable] = []
         
+        # 容器内存上限（Render等平台上整机内存远大于实例可用内存）
+        self.memory_limit_mb = detect_memory_limit_mb()
+        
         # 任务暂停回调
         self.task_pause_callbacks: List[Callable] = []
         
@@ -78,7 +159,9 @@ class MemoryOptimizer:
             'cache_cleanups': 0,
             'task_pauses': 0,
             'emergency_cleanups': 0,
-            'memory_saved_mb': 0
+            'memory_saved_mb': 0,
+            'cache_bytes_reclaimed': 0,
+            'memory_trims': 0
         }
         
         logger.info(f"✅ 内存优化管理器初始化完成 (Bot: {bot_id})")
@@ -143,12 +226,25 @@ class MemoryOptimizer:
             total_gc_objects = sum(stat['collected'] for stat in gc_stats)
             total_gc_collections = sum(stat['collections'] for stat in gc_stats)
             
+            process_memory_mb = process_memory.rss / (1024 * 1024)
+            if self.memory_limit_mb:
+                # 容器内：以本进程占容器上限的比例作为内存使用率
+                return MemoryStats(
+                    total_memory_mb=self.memory_limit_mb,
+                    used_memory_mb=process_memory_mb,
+                    available_memory_mb=max(0.0, self.memory_limit_mb - process_memory_mb),
+                    memory_percent=process_memory_mb / self.memory_limit_mb * 100,
+                    process_memory_mb=process_memory_mb,
+                    gc_objects=total_gc_objects,
+                    gc_collections=total_gc_collections
+                )
+            
             return MemoryStats(
                 total_memory_mb=memory_info.total / (1024 * 1024),
                 used_memory_mb=memory_info.used / (1024 * 1024),
                 available_memory_mb=memory_info.available / (1024 * 1024),
                 memory_percent=memory_info.percent,
-                process_memory_mb=process_memory.rss / (1024 * 1024),
+                process_memory_mb=process_memory_mb,
                 gc_objects=total_gc_objects,
                 gc_collections=total_gc_collections
             )
@@ -180,6 +276,7 @@ class MemoryOptimizer:
                 logger.warning(f"⚠️ 内存使用率严重: {memory_percent:.1f}%，执行多重优化")
                 await self._execute_optimization_strategy('gc_collection')
                 await self._execute_optimization_strategy('cache_cleanup')
+                await self._execute_optimization_strategy('memory_compression')
                 await self._execute_optimization_strategy('task_pause')
                 
             elif memory_percent >= self.thresholds.warning_threshold:
@@ -231,9 +328,82 @@ class MemoryOptimizer:
         except Exception as e:
             logger.error(f"强制垃圾回收失败: {e}")
     
+    def _pressure_level(self, memory_stats: MemoryStats) -> str:
+        """根据内存使用率判断压力级别"""
+        if memory_stats.memory_percent >= self.thresholds.emergency_threshold:
+            return 'emergency'
+        if memory_stats.memory_percent >= self.thresholds.critical_threshold:
+            return 'critical'
+        return 'warning'
+    
+    def evict_caches(self, target_bytes: int, max_priority: int) -> Dict[str, int]:
+        """按成本收益淘汰已注册的缓存，返回每个缓存回收的字节数
+        
+        重建成本低（优先级数值小）的缓存先淘汰，同一优先级内先淘汰占用大的；
+        每个缓存只淘汰凑够目标所需的比例。
+        """
+        reclaimed: Dict[str, int] = {}
+        total = 0
+        
+        with self._registry_lock:
+            candidates = []
+            for registration in list(self.cache_registry.values()):
+                if registration.priority >= max_priority:
+                    continue
+                try:
+                    size = registration.size_estimator()
+                except ReferenceError:
+                    # 缓存所属对象已被回收
+                    self.cache_registry.pop(registration.name, None)
+                    continue
+                except Exception as e:
+                    logger.error(f"估算缓存大小失败 {registration.name}: {e}")
+                    continue
+                registration.last_size = size
+                if size > 0:
+                    candidates.append((registration.priority, -size, registration))
+            candidates.sort(key=lambda item: (item[0], item[1]))
+            
+            for _, negative_size, registration in candidates:
+                if total >= target_bytes:
+                    break
+                size = -negative_size
+                fraction = min(1.0, (target_bytes - total) / size)
+                try:
+                    registration.evictor(fraction)
+                    after = registration.size_estimator()
+                except ReferenceError:
+                    self.cache_registry.pop(registration.name, None)
+                    continue
+                except Exception as e:
+                    logger.error(f"淘汰缓存失败 {registration.name}: {e}")
+                    continue
+                
+                freed = max(0, size - after)
+                registration.last_size = after
+                registration.bytes_reclaimed += freed
+                registration.evictions += 1
+                reclaimed[registration.name] = freed
+                total += freed
+        
+        self.stats['cache_bytes_reclaimed'] += total
+        return reclaimed
+    
     async def _cleanup_caches(self):
         """清理缓存"""
         try:
+            # 按当前内存压力计算需回收的字节数（降到清理阈值以下）
+            if self.memory_history:
+                memory_stats = self.memory_history[-1]
+                level = self._pressure_level(memory_stats)
+                excess_percent = max(0.0, memory_stats.memory_percent - self.thresholds.cleanup_threshold)
+                target_bytes = int(excess_percent / 100 * memory_stats.total_memory_mb * 1024 * 1024)
+                if target_bytes > 0:
+                    reclaimed = self.evict_caches(target_bytes, PRESSURE_PRIORITY_LIMITS[level])
+                    if reclaimed:
+                        details = ", ".join(f"{name}: {freed / 1024:.0f}KB" for name, freed in reclaimed.items())
+                        logger.info(f"🧹 缓存淘汰({level}): 共 {sum(reclaimed.values()) / (1024 * 1024):.1f}MB [{details}]")
+            
             # 调用缓存清理回调
             for callback in self.cache_cleanup_callbacks:
                 try:
@@ -264,11 +434,26 @@ class MemoryOptimizer:
             logger.error(f"暂停低优先级任务失败: {e}")
     
     async def _compress_memory(self):
-        """压缩内存"""
+        """压缩内存：把已释放的堆内存归还给操作系统（glibc malloc_trim）
+        
+        Python释放对象后内存通常仍留在分配器中，RSS不会下降；
+        缓存淘汰和垃圾回收之后调用，才能真正降低进程占用。
+        """
         try:
-            # 这里可以实现内存压缩逻辑
-            # 例如：压缩数据结构、合并相似对象等
-            logger.debug("🗜️ 内存压缩完成")
+            libc_name = ctypes.util.find_library('c')
+            if not libc_name:
+                return
+            libc = ctypes.CDLL(libc_name)
+            if not hasattr(libc, 'malloc_trim'):
+                return
+            
+            before_memory = psutil.Process().memory_info().rss / (1024 * 1024)
+            libc.malloc_trim(0)
+            after_memory = psutil.Process().memory_info().rss / (1024 * 1024)
+            
+            self.stats['memory_trims'] += 1
+            self.stats['memory_saved_mb'] += max(0.0, before_memory - after_memory)
+            logger.debug(f"🗜️ 内存压缩完成，释放 {before_memory - after_memory:.1f}MB")
             
         except Exception as e:
             logger.error(f"压缩内存失败: {e}")
@@ -286,6 +471,73 @@ class MemoryOptimizer:
         except Exception as e:
             logger.error(f"紧急清理失败: {e}")
     
+    def register_cache(self, name: str, size_estimator: Callable[[], int],
+                       evictor: Callable[[float], Any], priority: int = CACHE_PRIORITY_NORMAL) -> str:
+        """注册缓存，返回注册名（同名且仍存活的注册会自动加序号）
+        
+        Args:
+            name: 缓存名称（用于报告回收字节数）
+            size_estimator: 返回缓存当前占用的估算字节数
+            evictor: 接收淘汰比例(0-1]，淘汰相应比例的条目
+            priority: 淘汰优先级，数值越小越先淘汰（重建成本越低）
+        
+        绑定方法以弱引用保存，所属对象被回收后注册自动失效。
+        """
+        with self._registry_lock:
+            unique_name = name
+            index = 2
+            while unique_name in self.cache_registry:
+                unique_name = f"{name}#{index}"
+                index += 1
+            
+            self.cache_registry[unique_name] = CacheRegistration(
+                name=unique_name,
+                size_estimator=self._weak_callable(size_estimator),
+                evictor=self._weak_callable(evictor),
+                priority=priority
+            )
+        logger.debug(f"📝 缓存已注册: {unique_name} (优先级: {priority})")
+        return unique_name
+    
+    def unregister_cache(self, name: str):
+        """注销缓存"""
+        with self._registry_lock:
+            self.cache_registry.pop(name, None)
+    
+    @staticmethod
+    def _weak_callable(func: Callable) -> Callable:
+        """绑定方法转为弱引用调用，所属对象被回收后抛出ReferenceError"""
+        if not hasattr(func, '__self__') or func.__self__ is None:
+            return func
+        weak_method = weakref.WeakMethod(func)
+        
+        def call(*args, **kwargs):
+            method = weak_method()
+            if method is None:
+                raise ReferenceError("缓存所属对象已被回收")
+            return method(*args, **kwargs)
+        return call
+    
+    def get_cache_report(self) -> Dict[str, Any]:
+        """获取已注册缓存的大小、优先级和累计回收字节数"""
+        report = {}
+        with self._registry_lock:
+            for name, registration in list(self.cache_registry.items()):
+                try:
+                    registration.last_size = registration.size_estimator()
+                except ReferenceError:
+                    self.cache_registry.pop(name, None)
+                    continue
+                except Exception:
+                    pass
+                report[name] = {
+                    'priority': registration.priority,
+                    'size_bytes': registration.last_size,
+                    'bytes_reclaimed': registration.bytes_reclaimed,
+                    'evictions': registration.evictions
+                }
+        return report
+    
     def add_cache_cleanup_callback(self, callback: Callable):
         """添加缓存清理回调"""
         self.cache_cleanup_callbacks.append(callback)
@@ -315,6 +567,7 @@ class MemoryOptimizer:
                     'emergency': self.thresholds.emergency_threshold,
                     'cleanup': self.thresholds.cleanup_threshold
                 },
+                'caches': self.get_cache_report(),
                 'stats': self.stats.copy()
             }
         except Exception as e:
@@ -401,6 +654,14 @@ __all__ = [
     "MemoryOptimizer",
     "MemoryStats",
     "MemoryThreshold",
+    "CacheRegistration",
+    "CACHE_PRIORITY_CHEAP",
+    "CACHE_PRIORITY_NORMAL",
+    "CACHE_PRIORITY_COSTLY",
+    "CACHE_PRIORITY_CRITICAL",
+    "estimate_object_bytes",
+    "estimate_container_bytes",
+    "evict_mapping",
     "get_global_memory_optimizer",
     "start_memory_optimizer",
     "stop_memory_optimizer"
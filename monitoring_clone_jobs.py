@@ -0,0 +1,189 @@
+# ==================== 监听搬运作业队列 ====================
+"""
+监听搬运作业队列
+ID范围监听模式把待搬运范围提交到这里，由一个长期存在的搬运引擎执行；
+同一(监听任务, 源频道, 目标频道)的相邻或重叠范围在等待期间合并，
+同一组合同时只有一个搬运任务在执行，共享引擎的缓存和API限流
+"""
+
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pyrogram import Client
+
+from cloning_engine import CloningEngine, create_cloning_engine
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# (监听任务ID, 源频道ID, 目标频道ID)
+JobKey = Tuple[str, str, str]
+
+# 作业结束回调: (是否成功) -> None，合并后的作业结束时调用所有被合并范围的回调
+CompletionCallback = Callable[[bool], None]
+
+class MonitoringCloneJobQueue:
+    """监听搬运作业队列类"""
+    
+    def __init__(self, client: Client, config: Dict[str, Any], bot_id: str = "default_bot",
+                 engine: Optional[CloningEngine] = None):
+        """初始化作业队列
+        
+        Args:
+            client: Telegram客户端
+            config: 搬运引擎配置
+            bot_id: 机器人ID，用于数据分离
+            engine: 已有的搬运引擎（不传时首次使用时创建）
+        """
+        self.client = client
+        self.config = config
+        self.bot_id = bot_id
+        
+        self._engine: Optional[CloningEngine] = engine
+        self._pending: Dict[JobKey, List[Dict[str, Any]]] = {}
+        self._runners: Dict[JobKey, asyncio.Task] = {}
+        
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'launched': 0,
+            'failed': 0
+        }
+    
+    @property
+    def engine(self) -> CloningEngine:
+        """共享的搬运引擎（首次使用时创建）"""
+        if self._engine is None:
+            self._engine = create_cloning_engine(self.client, self.config, bot_id=self.bot_id)
+            logger.info("🔧 监听搬运共享引擎已创建")
+        return self._engine
+    
+    def submit(self, monitor_task_id: str, source_chat_id: str, target_chat_id: str,
+               start_id: int, end_id: int, clone_config: Dict[str, Any],
+               on_complete: Optional[CompletionCallback] = None, source_username: str = "") -> bool:
+        """提交一个ID范围，返回是否已接受
+        
+        Args:
+            on_complete: 包含该范围的搬运任务结束（或启动失败）后调用，参数为是否成功
+        """
+        if start_id > end_id:
+            return False
+        
+        key = (str(monitor_task_id), str(source_chat_id), str(target_chat_id))
+        jobs = self._pending.setdefault(key, [])
+        jobs.append({
+            'source_chat_id': source_chat_id,
+            'target_chat_id': target_chat_id,
+            'start_id': start_id,
+            'end_id': end_id,
+            'config': clone_config,
+            'source_username': source_username,
+            'callbacks': [on_complete] if on_complete else []
+        })
+        self.stats['submitted'] += 1
+        self._coalesce(jobs)
+        
+        runner = self._runners.get(key)
+        if runner is None or runner.done():
+            self._runners[key] = asyncio.create_task(self._run_key(key))
+        return True
+    
+    def _coalesce(self, jobs: List[Dict[str, Any]]):
+        """合并相邻或重叠的范围（配置以较新的为准）"""
+        jobs.sort(key=lambda job: job['start_id'])
+        merged: List[Dict[str, Any]] = []
+        for job in jobs:
+            if merged and job['start_id'] <= merged[-1]['end_id'] + 1:
+                last = merged[-1]
+                last['end_id'] = max(last['end_id'], job['end_id'])
+                last['config'] = job['config']
+                last['callbacks'].extend(job['callbacks'])
+                self.stats['coalesced'] += 1
+            else:
+                merged.append(job)
+        jobs[:] = merged
+    
+    async def _run_key(self, key: JobKey):
+        """按顺序执行同一组合的作业，每次只运行一个搬运任务"""
+        monitor_task_id = key[0]
+        try:
+            while self._pending.get(key):
+                job = self._pending[key].pop(0)
+                start_id, end_id = job['start_id'], job['end_id']
+                
+                clone_config = dict(job['config'])
+                clone_config.update({
+                    'start_id': start_id,
+                    'end_id': end_id,
+                    'description': f"监听搬运: {start_id}-{end_id}"
+                })
+                clone_task_id = f"monitor_clone_{monitor_task_id}_{start_id}_{end_id}"
+                
+                success = False
+                try:
+                    clone_task = await self.engine.create_task(
+                        source_chat_id=job['source_chat_id'],
+                        target_chat_id=job['target_chat_id'],
+                        start_id=start_id,
+                        end_id=end_id,
+                        config=clone_config,
+                        source_username=job.get('source_username', ''),
+                        task_id=clone_task_id
+                    )
+                    if not clone_task or not await self.engine.start_cloning(clone_task):
+                        self.stats['failed'] += 1
+                        logger.error(f"❌ 监听搬运任务启动失败: {clone_task_id}")
+                    else:
+                        self.stats['launched'] += 1
+                        logger.info(f"✅ 监听搬运任务已启动: {clone_task_id}")
+                        
+                        # 等待本次搬运完成，期间新提交的范围继续合并
+                        background_task = self.engine.background_tasks.get(clone_task_id)
+                        if background_task:
+                            # asyncio.wait 被取消时不会取消搬运任务本身
+                            await asyncio.wait({background_task})
+                        # 后台搬运会捕获所有异常，只能从任务状态判断是否成功
+                        success = clone_task.status == "completed"
+                        if not success:
+                            self.stats['failed'] += 1
+                            logger.error(f"❌ 监听搬运任务未完成: {clone_task_id} (状态: {clone_task.status})")
+                
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    logger.error(f"❌ 执行监听搬运作业失败 {clone_task_id}: {e}")
+                
+                for callback in job['callbacks']:
+                    try:
+                        callback(success)
+                    except Exception as e:
+                        logger.warning(f"⚠️ 监听搬运作业完成回调失败 {clone_task_id}: {e}")
+        finally:
+            if not self._pending.get(key):
+                self._pending.pop(key, None)
+            if self._runners.get(key) is asyncio.current_task():
+                self._runners.pop(key, None)
+    
+    def cancel_task(self, monitor_task_id: str) -> int:
+        """丢弃监听任务尚未执行的作业"""
+        removed = 0
+        for key in [key for key in self._pending if key[0] == str(monitor_task_id)]:
+            removed += len(self._pending.pop(key))
+        return removed
+    
+    async def stop(self):
+        """停止作业执行（已启动的搬运任务由搬运引擎继续管理）"""
+        runners = list(self._runners.values())
+        for runner in runners:
+            runner.cancel()
+        if runners:
+            await asyncio.gather(*runners, return_exceptions=True)
+        self._runners.clear()
+        self._pending.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取作业统计"""
+        stats = self.stats.copy()
+        stats['pending_ranges'] = sum(len(jobs) for jobs in self._pending.values())
+        stats['running_keys'] = len(self._runners)
+        return stats
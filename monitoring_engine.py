@@ -6,17 +6,30 @@
 """
 
 import asyncio
+import bisect
+import functools
+import heapq
 import logging
+import random
 import time
 import os
-import json
-from typing import Dict, List, Any, Optional, Tuple, Set
+from collections import deque
+from typing import Dict, List, Any, Optional, Tuple, Set, Callable, Awaitable, Deque
 from datetime import datetime, timedelta
 from pyrogram import Client
 from pyrogram.types import Message, Chat, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio, InputMediaAnimation
 from pyrogram.errors import FloodWait, ChannelPrivate, ChannelInvalid
 from message_engine import MessageEngine
 from data_manager import data_manager
+from monitoring_watermark_store import MonitoringWatermarkStore
+from delayed_delivery_scheduler import DelayedDeliveryScheduler, DeliveryDeferred
+from monitoring_clone_jobs import MonitoringCloneJobQueue
+from monitoring_shards import ShardedMonitoringCoordinator
+from latency_histogram import LatencyRecorder
+from monitoring_task_store import MonitoringTaskStore
+from task_resource_tracker import get_global_resource_tracker
+from memory_optimizer import (get_global_memory_optimizer, estimate_container_bytes, evict_mapping,
+                              CACHE_PRIORITY_NORMAL, CACHE_PRIORITY_CRITICAL)
 from config import DEFAULT_USER_CONFIG
 
 # 配置日志 - 使用优化的日志配置
@@ -109,6 +122,11 @@ class MonitoringEngine:
         self.is_running = False
         self.monitoring_loop_task = None
         
+        # ID范围搬运作业队列（共享一个搬运引擎，合并相邻范围）
+        self.clone_jobs = MonitoringCloneJobQueue(
+            self.client, self.config, bot_id=self.config.get('bot_id', 'default_bot')
+        )
+        
         # 监听配置 - 优化并发处理
         self.global_check_interval = 60  # 全局检查间隔（60秒）
         self.max_concurrent_tasks = config.get('max_concurrent_tasks', 50)  # 最大并发任务数（从10提升到50）
@@ -174,6 +192,8 @@ class MonitoringEngine:
             except asyncio.CancelledError:
                 pass
         
+        await self.clone_jobs.stop()
+        
         logger.info("✅ 监听系统已停止")
     
     async def create_monitoring_task(self, user_id: str, target_channel: str, 
@@ -270,6 +290,7 @@ class MonitoringEngine:
             
             task.status = "stopped"
             task.is_running = False
+            self.clone_jobs.cancel_task(task_id)
             
             # 保存任务状态
             await self._save_monitoring_task(task)
@@ -429,25 +450,10 @@ class MonitoringEngine:
             filter_config = await self._get_channel_filter_config(task.user_id, task.target_channel)
             clone_config.update(filter_config)
             
-            # 创建搬运任务
-            from cloning_engine import create_cloning_engine
-            clone_engine = create_cloning_engine(self.client, self.config)
-            
-            clone_task_id = f"monitor_clone_{task.task_id}_{start_id}_{end_id}"
-            clone_task = await clone_engine.create_task(
-                source_chat_id=channel_id,
-                target_chat_id=task.target_channel,
-                start_id=start_id,
-                end_id=end_id,
-                config=clone_config
+            # 提交到共享搬运引擎的作业队列
+            return self.clone_jobs.submit(
+                task.task_id, channel_id, task.target_channel, start_id, end_id, clone_config
             )
-            
-            if clone_task:
-                logger.info(f"✅ 监听搬运任务创建成功: {clone_task_id}")
-                return True
-            else:
-                logger.error(f"❌ 监听搬运任务创建失败: {clone_task_id}")
-                return False
                 
         except Exception as e:
             logger.error(f"创建监听搬运任务失败: {e}")
@@ -550,20 +556,9 @@ class MonitoringEngine:
             filter_config = await self._get_channel_filter_config(task.user_id, task.target_channel)
             clone_config.update(filter_config)
             
-            # 创建搬运任务
-            from cloning_engine import create_cloning_engine
-            clone_engine = create_cloning_engine(self.client, self.config)
-            
+            # 提交到共享搬运引擎的作业队列
             clone_task_id = f"monitor_clone_{task_id}_{start_id}_{end_id}"
-            clone_task = await clone_engine.create_task(
-                source_chat_id=channel_id,
-                target_chat_id=task.target_channel,
-                start_id=start_id,
-                end_id=end_id,
-                config=clone_config
-            )
-            
-            if clone_task:
+            if self.clone_jobs.submit(task_id, channel_id, task.target_channel, start_id, end_id, clone_config):
                 # 更新监听ID
                 source_channel['last_message_id'] = end_id
                 task.update_source_last_id(channel_id, end_id)
@@ -571,10 +566,10 @@ class MonitoringEngine:
                 # 保存任务状态
                 await self._save_monitoring_task(task)
                 
-                logger.info(f"✅ 手动监听搬运任务创建成功: {clone_task_id}")
+                logger.info(f"✅ 手动监听搬运任务已提交: {clone_task_id}")
                 return True
             else:
-                logger.error(f"❌ 手动监听搬运任务创建失败: {clone_task_id}")
+                logger.error(f"❌ 手动监听搬运任务提交失败: {clone_task_id}")
                 return False
                 
         except Exception as e:
@@ -613,21 +608,10 @@ class MonitoringEngine:
                     filter_config = await self._get_channel_filter_config(task.user_id, task.target_channel)
                     clone_config.update(filter_config)
                     
-                    # 创建搬运任务
-                    from cloning_engine import create_cloning_engine
-                    clone_engine = create_cloning_engine(self.client, self.config)
-                    
+                    # 提交到共享搬运引擎的作业队列
                     task_id = f"monitor_clone_{task.task_id}_{start_id}_{end_id}"
-                    clone_task = await clone_engine.create_task(
-                        source_chat_id=channel_id,
-                        target_chat_id=task.target_channel,
-                        start_id=start_id,
-                        end_id=end_id,
-                        config=clone_config
-                    )
-                    
-                    if clone_task:
-                        logger.info(f"✅ 监听搬运任务创建成功: {task_id}")
+                    if self.clone_jobs.submit(task.task_id, channel_id, task.target_channel, start_id, end_id, clone_config):
+                        logger.info(f"✅ 监听搬运任务已提交: {task_id}")
                         success_count += 1
                         
                         # 自动更新监听ID到结束ID
@@ -743,13 +727,8 @@ class MonitoringEngine:
                 'last_check_time': task.last_check_time.isoformat() if task.last_check_time else None
             }
             
-            # 保存到用户配置
-            user_config = await data_manager.get_user_config(task.user_id)
-            if 'monitoring_tasks' not in user_config:
-                user_config['monitoring_tasks'] = {}
-            
-            user_config['monitoring_tasks'][task.task_id] = task_data
-            await data_manager.save_user_config(task.user_id, user_config)
+            # 保存到监听任务集合
+            await data_manager.save_monitoring_task(task.user_id, task_data)
             
         except Exception as e:
             logger.error(f"保存监听任务失败: {e}")
@@ -757,15 +736,9 @@ class MonitoringEngine:
     async def _delete_monitoring_task(self, task_id: str):
         """从数据库删除监听任务"""
         try:
-            # 这里需要根据task_id找到对应的user_id
-            # 简化实现，实际应该维护一个映射关系
-            for user_id in data_manager.get_all_user_ids():
-                user_config = await data_manager.get_user_config(user_id)
-                if 'monitoring_tasks' in user_config and task_id in user_config['monitoring_tasks']:
-                    del user_config['monitoring_tasks'][task_id]
-                    await data_manager.save_user_config(user_id, user_config)
-                    break
-                    
+            # 任务按task_id存储，不需要查找所属用户
+            await data_manager.delete_monitoring_task(None, task_id)
+        
         except Exception as e:
             logger.error(f"删除监听任务失败: {e}")
     
@@ -774,27 +747,23 @@ class MonitoringEngine:
         try:
             logger.info("📂 加载监听任务")
             
-            all_user_ids = await data_manager.get_all_user_ids()
-            for user_id in all_user_ids:
-                user_config = await data_manager.get_user_config(user_id)
-                monitoring_tasks = user_config.get('monitoring_tasks', {})
-                
-                for task_id, task_data in monitoring_tasks.items():
-                    if task_data.get('status') == 'active':
-                        # 重建任务对象
-                        task = MonitoringTask(
-                            task_id=task_id,
-                            user_id=user_id,
-                            target_channel=task_data['target_channel'],
-                            source_channels=task_data['source_channels'],
-                            config=task_data.get('config', {})
-                        )
-                        
-                        task.status = task_data.get('status', 'pending')
-                        task.stats = task_data.get('stats', {})
-                        
-                        self.active_tasks[task_id] = task
-                        logger.info(f"✅ 加载监听任务: {task_id}")
+            # 按 status 索引分页查询活跃任务，不遍历所有用户
+            async for task_data in data_manager.iter_active_monitoring_tasks():
+                task_id = task_data['task_id']
+                # 重建任务对象
+                task = MonitoringTask(
+                    task_id=task_id,
+                    user_id=task_data['user_id'],
+                    target_channel=task_data['target_channel'],
+                    source_channels=task_data['source_channels'],
+                    config=task_data.get('config', {})
+                )
+                
+                task.status = task_data.get('status', 'pending')
+                task.stats = task_data.get('stats', {})
+                
+                self.active_tasks[task_id] = task
+                logger.info(f"✅ 加载监听任务: {task_id}")
             
             logger.info(f"📂 加载完成，共 {len(self.active_tasks)} 个任务")
             
@@ -869,6 +838,7 @@ class RealTimeMonitoringTask:
         self.monitoring_mode = self.config.get('monitoring_mode', 'realtime')  # realtime, delayed, batch
         self.delay_seconds = self.config.get('delay_seconds', 5)  # 延迟模式的延迟时间
         self.batch_size = self.config.get('batch_size', 10)  # 批量模式的批量大小
+        self.batch_max_age = self.config.get('batch_max_age', 60)  # 批量模式的最长等待时间（秒）
         
         # 统计信息
         self.stats = {
@@ -887,6 +857,9 @@ class RealTimeMonitoringTask:
         self.batch_cache = []
         self.last_batch_time = None
         
+        # 按源频道记录本任务已处理的消息ID
+        self.processed_message_ids: Dict[str, Set[int]] = {}
+        
         logger.info(f"✅ 实时监听任务创建: {task_id}, 模式: {self.monitoring_mode}")
     
     def get_status_info(self) -> Dict[str, Any]:
@@ -940,6 +913,179 @@ class RealTimeMonitoringTask:
         """检查是否应该停止"""
         return self.status in ["stopped", "failed"] or not self.is_running
 
+class AdaptivePollScheduler:
+    """自适应轮询调度器
+    
+    基于最小堆按频道的下次检查时间调度轮询。每个频道根据观测到的发帖间隔
+    （EWMA）动态调整检查间隔：活跃频道检查更频繁，冷门频道逐步退避到最大间隔。
+    所有频道的总检查频率受共享API预算约束。
+    """
+    
+    def __init__(self, min_interval: float = 5, max_interval: float = 300,
+                 initial_interval: float = 30, ewma_alpha: float = 0.3,
+                 backoff_factor: float = 1.5, jitter_ratio: float = 0.1,
+                 api_budget_per_minute: int = 30):
+        """初始化调度器"""
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.initial_interval = min(max(initial_interval, self.min_interval), self.max_interval)
+        self.ewma_alpha = ewma_alpha
+        self.backoff_factor = backoff_factor
+        self.jitter_ratio = jitter_ratio
+        self.api_budget_per_minute = api_budget_per_minute
+        
+        # 最小堆: (下次检查时间, 版本号, 频道键)
+        self._heap: List[Tuple[float, int, str]] = []
+        # 频道键 -> 调度状态
+        self._states: Dict[str, Dict[str, Any]] = {}
+        self._version = 0
+        # 所有频道的期望检查频率之和（次/分钟），间隔变化和频道增删时增量维护
+        self._demand_per_minute = 0.0
+    
+    def sync_channels(self, keys: Set[str]):
+        """同步需要调度的频道集合：新增频道立即检查，移除的频道惰性出堆"""
+        now = time.time()
+        for key in keys:
+            if key not in self._states:
+                self._states[key] = {
+                    'interval': self.initial_interval,
+                    'ewma_gap': None,
+                    'last_post_time': None,
+                    'next_check': now,
+                    'version': 0,
+                    'checks': 0,
+                    'hits': 0
+                }
+                self._demand_per_minute += 60.0 / self.initial_interval
+                self._push(key, now)
+        
+        for key in list(self._states.keys()):
+            if key not in keys:
+                # 堆中的旧条目会因版本号不匹配被丢弃
+                state = self._states.pop(key)
+                self._demand_per_minute -= 60.0 / state['interval']
+        if not self._states:
+            # 消除浮点累积误差
+            self._demand_per_minute = 0.0
+    
+    def pop_due(self, limit: int) -> List[str]:
+        """弹出已到期的频道（最多limit个）"""
+        now = time.time()
+        due = []
+        while self._heap and len(due) < limit:
+            due_time, version, key = self._heap[0]
+            state = self._states.get(key)
+            if state is None or state['version'] != version:
+                heapq.heappop(self._heap)
+                continue
+            if due_time > now:
+                break
+            heapq.heappop(self._heap)
+            due.append(key)
+        return due
+    
+    def seconds_until_next(self) -> float:
+        """距离下一个频道到期的秒数"""
+        while self._heap:
+            due_time, version, key = self._heap[0]
+            state = self._states.get(key)
+            if state is None or state['version'] != version:
+                heapq.heappop(self._heap)
+                continue
+            return max(0.0, due_time - time.time())
+        return self.max_interval
+    
+    def record_check(self, key: str, post_times: List[float]):
+        """记录一次检查结果并重新调度
+        
+        Args:
+            key: 频道键
+            post_times: 本次检查发现的新消息发布时间戳（秒）
+        """
+        state = self._states.get(key)
+        if state is None:
+            return
+        
+        state['checks'] += 1
+        if post_times:
+            state['hits'] += 1
+            for post_time in sorted(post_times):
+                last_post = state['last_post_time']
+                if last_post is not None and post_time > last_post:
+                    gap = post_time - last_post
+                    if state['ewma_gap'] is None:
+                        state['ewma_gap'] = gap
+                    else:
+                        state['ewma_gap'] = self.ewma_alpha * gap + (1 - self.ewma_alpha) * state['ewma_gap']
+                if last_post is None or post_time > last_post:
+                    state['last_post_time'] = post_time
+            
+            # 检查间隔取平均发帖间隔的一半，保证大部分消息在下一次发帖前被发现
+            if state['ewma_gap'] is not None:
+                interval = state['ewma_gap'] / 2
+            else:
+                interval = self.min_interval
+        else:
+            # 无新消息：指数退避
+            interval = state['interval'] * self.backoff_factor
+            # 长时间未发帖的频道不应比其平均发帖间隔检查得更频繁
+            if state['ewma_gap'] is not None and state['last_post_time'] is not None:
+                idle = time.time() - state['last_post_time']
+                if idle > state['ewma_gap'] * 2:
+                    interval = max(interval, state['ewma_gap'])
+        
+        self._set_interval(state, min(max(interval, self.min_interval), self.max_interval))
+        self._reschedule(key)
+    
+    def _reschedule(self, key: str):
+        """根据当前间隔、预算和抖动计算下次检查时间"""
+        state = self._states[key]
+        interval = state['interval'] * self._budget_scale()
+        if self.jitter_ratio > 0:
+            interval *= 1 + random.uniform(-self.jitter_ratio, self.jitter_ratio)
+        self._push(key, time.time() + max(interval, 0.0))
+    
+    def _set_interval(self, state: Dict[str, Any], interval: float):
+        """更新频道检查间隔，同时更新总检查频率"""
+        self._demand_per_minute += 60.0 / interval - 60.0 / state['interval']
+        state['interval'] = interval
+    
+    def _budget_scale(self) -> float:
+        """当所有频道的期望检查频率超出API预算时，按比例拉长间隔"""
+        if not self._states or self.api_budget_per_minute <= 0:
+            return 1.0
+        return max(1.0, self._demand_per_minute / self.api_budget_per_minute)
+    
+    def _push(self, key: str, due_time: float):
+        """推入堆并更新版本号"""
+        self._version += 1
+        state = self._states[key]
+        state['version'] = self._version
+        state['next_check'] = due_time
+        heapq.heappush(self._heap, (due_time, self._version, key))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取调度统计"""
+        now = time.time()
+        intervals = [state['interval'] for state in self._states.values()]
+        return {
+            'channels': len(self._states),
+            'min_interval': min(intervals) if intervals else 0,
+            'max_interval': max(intervals) if intervals else 0,
+            'budget_scale': round(self._budget_scale(), 2),
+            'next_due_in': round(self.seconds_until_next(), 2) if self._states else None,
+            'channels_detail': {
+                key: {
+                    'interval': round(state['interval'], 2),
+                    'ewma_gap': round(state['ewma_gap'], 2) if state['ewma_gap'] is not None else None,
+                    'next_check_in': round(max(0.0, state['next_check'] - now), 2),
+                    'checks': state['checks'],
+                    'hits': state['hits']
+                }
+                for key, state in self._states.items()
+            }
+        }
+
 class RealTimeMonitoringEngine:
     """实时监听引擎类"""
     
@@ -956,12 +1102,78 @@ class RealTimeMonitoringEngine:
         self.message_handlers: Dict[str, MessageHandler] = {}
         self.is_running = False
         
-        # 任务持久化
-        self.tasks_file = f"data/{self.config.get('bot_id', 'default_bot')}/monitoring_tasks.json"
+        # 任务持久化（任务定义变化时原子写入，统计以增量日志追加）
+        self.task_store = MonitoringTaskStore(
+            bot_id=self.config.get('bot_id', 'default_bot'),
+            compact_threshold=self.config.get('monitoring_stats_compact_lines', 1000),
+            flush_interval=self.config.get('monitoring_stats_flush_interval', 30)
+        )
+        self.tasks_file = self.task_store.definitions_file
+        
+        # 按(任务, 源频道)持久化的水位线，用于重启后补齐停机期间的消息
+        self.watermark_store = MonitoringWatermarkStore(
+            bot_id=self.config.get('bot_id', 'default_bot'),
+            flush_interval=self.config.get('monitoring_watermark_flush_interval', 10)
+        )
+        self.catchup_max_messages = self.config.get('monitoring_catchup_max_messages', 5000)
+        
+        # 已提交补齐的ID范围：(任务ID, 源频道ID) -> [[起始ID, 结束ID, 是否完成]]（按起始ID排序）
+        # 水位线只推进到最早未完成范围之前，范围完成后才放行连续完成的前缀
+        self._catch_up_ranges: Dict[Tuple[str, str], List[List[Any]]] = {}
+        self._held_watermarks: Dict[Tuple[str, str], int] = {}  # 被未完成范围挡住的最大水位线
+        # 补齐搬运失败后按指数退避重新提交，成功前范围一直挡住水位线
+        self.catchup_retry_delay = self.config.get('monitoring_catchup_retry_delay', 30)
+        self.catchup_retry_max_delay = self.config.get('monitoring_catchup_retry_max_delay', 600)
+        self._catch_up_retries: Set[asyncio.Task] = set()
+        
+        # 补齐范围提交到作业队列：共享搬运引擎，同一(任务, 源频道, 目标)的相邻范围合并、依次执行
+        self.clone_jobs = MonitoringCloneJobQueue(
+            self.client, self.config, bot_id=self.config.get('bot_id', 'default_bot'), engine=cloning_engine
+        )
+        
+        # 延迟模式调度器（单个堆保存紧凑条目，替代每条消息一个休眠协程）
+        self.delayed_scheduler = DelayedDeliveryScheduler(
+            dispatch=self._dispatch_delayed_messages,
+            bot_id=self.config.get('bot_id', 'default_bot'),
+            max_batch_size=self.config.get('delayed_dispatch_batch_size', 100)
+        )
         
         # 消息去重和缓存
         self.processed_messages: Dict[str, Set[int]] = {}  # channel_id -> message_ids
         self.message_cache: Dict[str, List[Message]] = {}  # 批量模式缓存
+        self._batch_flush_timers: Dict[str, asyncio.Task] = {}  # 批量模式超时投递计时器
+        self._filter_config_cache: Dict[str, Dict[str, Any]] = {}  # (用户, 目标频道) -> 过滤配置
+        
+        # 登记到内存优化器：过滤配置可随时重新读取；去重集合只在紧急时裁剪，且只裁剪已落盘水位线以下的ID
+        memory_optimizer = get_global_memory_optimizer(self.config.get('bot_id', 'default_bot'))
+        memory_optimizer.register_cache(
+            "monitoring.filter_config_cache", self._estimate_filter_config_cache_bytes,
+            self._evict_filter_config_cache, priority=CACHE_PRIORITY_NORMAL
+        )
+        memory_optimizer.register_cache(
+            "monitoring.processed_messages", self._estimate_processed_messages_bytes,
+            self._trim_processed_messages, priority=CACHE_PRIORITY_CRITICAL
+        )
+        memory_optimizer.register_cache(
+            "monitoring.task_processed_ids", self._estimate_task_processed_ids_bytes,
+            self._trim_task_processed_ids, priority=CACHE_PRIORITY_CRITICAL
+        )
+        
+        # 按目标频道的有序发送队列（每个目标一个工作协程，互不阻塞）
+        self.send_queue_max_size = self.config.get('send_queue_max_size', 1000)
+        self.target_send_queues: Dict[str, asyncio.Queue] = {}
+        self.target_send_overflow: Dict[str, Deque[Tuple]] = {}  # 队列满时暂存的作业，按顺序补入队列
+        # 溢出缓冲也满时不再保留持有消息对象的作业，改为延迟调度器中的紧凑条目，积压消化后重新拉取
+        self.send_overflow_max_size = self.config.get('send_overflow_max_size', 1000)
+        self.target_send_enqueue_times: Dict[str, Deque[float]] = {}  # 尚未开始发送的作业的入队时间
+        self.target_send_workers: Dict[str, asyncio.Task] = {}
+        self.target_send_stats: Dict[str, Dict[str, Any]] = {}
+        
+        # 延迟直方图：收到->入队、入队->开始发送、发送耗时、源频道发帖->目标频道发出
+        self.latency = LatencyRecorder()
+        
+        # 按任务统计缓冲/排队消息和发送作业（供并发任务管理器做准入估计）
+        self.resource_tracker = get_global_resource_tracker(self.config.get('bot_id', 'default_bot'))
         
         # 全局统计
         self.global_stats = {
@@ -986,6 +1198,42 @@ class RealTimeMonitoringEngine:
         self.circuit_breaker_active = False  # 熔断器状态
         self.circuit_breaker_reset_time = None  # 熔断器重置时间
         
+        # 自适应轮询调度（按频道发帖频率调整检查间隔）
+        self.poll_scheduler = AdaptivePollScheduler(
+            min_interval=self.config.get('poll_min_interval', self.check_interval),
+            max_interval=self.config.get('poll_max_interval', 300),
+            initial_interval=self.config.get('poll_initial_interval', 30),
+            ewma_alpha=self.config.get('poll_ewma_alpha', 0.3),
+            backoff_factor=self.config.get('poll_backoff_factor', 1.5),
+            jitter_ratio=self.config.get('poll_jitter_ratio', 0.1),
+            api_budget_per_minute=self.api_rate_limit
+        )
+        self._poll_wakeup = asyncio.Event()
+        self.poll_probe_limit = self.config.get('poll_probe_limit', 200)  # 每次轮询拉取的最近消息数
+        
+        # 缺口恢复：按频道记录已见最大消息ID，ID不连续或断线重连时补齐缺失消息
+        self.channel_last_seen: Dict[str, int] = {}  # channel_id -> 已见最大消息ID
+        self._pending_gaps: Dict[str, Set[int]] = {}  # channel_id -> 疑似缺失的消息ID
+        self._gap_flush_task: Optional[asyncio.Task] = None
+        self._reconnect_recovery_task: Optional[asyncio.Task] = None
+        self.gap_grace_seconds = self.config.get('gap_recovery_grace_seconds', 3)
+        # 机器人会话不能读取频道历史：只处理实时更新，不轮询、不补齐
+        self.history_enabled = self.config.get('monitoring_history_enabled', True)
+        self.gap_stats = {
+            'gaps_detected': 0,
+            'late_arrivals': 0,
+            'messages_recovered': 0,
+            'disconnects': 0
+        }
+        
+        # 分片模式：配置了分片会话时，本引擎只作为协调器，源频道由各分片进程监听
+        self.shard_coordinator: Optional[ShardedMonitoringCoordinator] = None
+        shard_sessions = self.config.get('monitoring_shard_sessions') or []
+        if shard_sessions:
+            self.shard_coordinator = ShardedMonitoringCoordinator(
+                self.config, shard_sessions, lambda: list(self.active_tasks.values())
+            )
+        
         # 性能监控
         self.performance_metrics = {
             'total_messages_processed': 0,
@@ -1003,55 +1251,55 @@ class RealTimeMonitoringEngine:
         # 加载任务
         self._load_tasks()
     
+    def _build_task_definitions(self) -> Dict[str, Dict[str, Any]]:
+        """构建任务定义（不含统计）"""
+        definitions = {}
+        for task_id, task in self.active_tasks.items():
+            definitions[task_id] = {
+                'task_id': task.task_id,
+                'user_id': task.user_id,
+                'target_channel': task.target_channel,
+                'source_channels': task.source_channels,
+                'config': task.config,
+                'status': task.status,
+                'monitoring_mode': task.monitoring_mode,
+                'delay_seconds': task.delay_seconds,
+                'batch_size': task.batch_size,
+                'created_at': task.created_at.isoformat() if task.created_at else None,
+                'last_activity': task.last_activity.isoformat() if task.last_activity else None
+            }
+        return definitions
+    
     def _save_tasks(self):
-        """保存监听任务到文件"""
+        """保存监听任务：定义有变化时原子写入，统计只追加变化的计数"""
         try:
-            import os
-            import json
-            
-            # 创建目录
-            os.makedirs(os.path.dirname(self.tasks_file), exist_ok=True)
-            
-            # 序列化任务数据
-            tasks_data = {}
-            for task_id, task in self.active_tasks.items():
-                tasks_data[task_id] = {
-                    'task_id': task.task_id,
-                    'user_id': task.user_id,
-                    'target_channel': task.target_channel,
-                    'source_channels': task.source_channels,
-                    'config': task.config,
-                    'status': task.status,
-                    'monitoring_mode': task.monitoring_mode,
-                    'delay_seconds': task.delay_seconds,
-                    'batch_size': task.batch_size,
-                    'stats': task.stats,
-                    'created_at': task.created_at.isoformat() if task.created_at else None,
-                    'last_activity': task.last_activity.isoformat() if task.last_activity else None
-                }
-            
-            # 保存到文件
-            with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                json.dump(tasks_data, f, ensure_ascii=False, indent=2)
-            
-            logger.info(f"✅ 监听任务已保存: {len(tasks_data)} 个任务")
+            if self.task_store.save_definitions(self._build_task_definitions()):
+                logger.info(f"✅ 监听任务已保存: {len(self.active_tasks)} 个任务")
+            self._save_task_stats()
             
         except Exception as e:
             logger.error(f"❌ 保存监听任务失败: {e}")
     
+    def _save_task_stats(self):
+        """追加监听任务统计增量"""
+        try:
+            self.task_store.save_stats(self._collect_task_stats())
+        except Exception as e:
+            logger.error(f"❌ 保存监听任务统计失败: {e}")
+    
+    def _collect_task_stats(self) -> Dict[str, Dict[str, Any]]:
+        """收集所有任务的统计"""
+        return {task_id: task.stats for task_id, task in self.active_tasks.items()}
+    
     def _load_tasks(self):
         """从文件加载监听任务"""
         try:
-            import os
-            import json
-            from datetime import datetime
-            
             if not os.path.exists(self.tasks_file):
                 logger.info("ℹ️ 监听任务文件不存在，跳过加载")
                 return
             
-            with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                tasks_data = json.load(f)
+            tasks_data = self.task_store.load_definitions()
+            stats_data = self.task_store.load_stats()
             
             # 重建任务对象
             for task_id, task_data in tasks_data.items():
@@ -1075,7 +1323,8 @@ class RealTimeMonitoringEngine:
                     
                     # 恢复状态
                     task.status = task_data.get('status', 'pending')
-                    task.stats = task_data.get('stats', {})
+                    # 统计优先取增量日志，旧版任务文件中的统计作为兼容回退
+                    task.stats.update(stats_data.get(task_id) or task_data.get('stats', {}))
                     
                     # 恢复时间
                     if task_data.get('created_at'):
@@ -1104,13 +1353,20 @@ class RealTimeMonitoringEngine:
         
         self.is_running = True
         self.global_stats['start_time'] = datetime.now()
+        self.watermark_store.start_auto_flush()
+        self.task_store.start_auto_flush(self._collect_task_stats)
+        if self.shard_coordinator:
+            self.shard_coordinator.start()
         
         logger.info("🚀 实时监听系统启动成功")
         
-        # 启动所有待处理的任务
-        for task in self.active_tasks.values():
-            if task.status == "pending":
+        # 启动所有待处理的任务，以及重启前处于运行状态的任务
+        for task in list(self.active_tasks.values()):
+            if task.status in ("pending", "active"):
                 await self.start_monitoring_task(task.task_id)
+        
+        # 任务就绪后再开始投递重启前遗留的延迟消息
+        self.delayed_scheduler.start()
     
     async def stop_monitoring(self):
         """停止实时监听系统"""
@@ -1121,9 +1377,17 @@ class RealTimeMonitoringEngine:
         self.is_running = False
         logger.info("🛑 停止实时监听系统")
         
-        # 停止所有任务
-        for task_id in list(self.active_tasks.keys()):
-            await self.stop_monitoring_task(task_id)
+        # 停止所有任务的消息处理（保留任务定义和水位线，重启后继续监听并补齐消息）
+        for task in list(self.active_tasks.values()):
+            if task.is_running:
+                await self._unregister_message_handlers(task)
+                task.is_running = False
+                self.global_stats['active_tasks'] -= 1
+            self.resource_tracker.end_task(task.task_id)
+        self._save_tasks()
+        
+        if self.shard_coordinator:
+            await self.shard_coordinator.stop()
         
         # 清理资源
         await self._cleanup_resources()
@@ -1185,8 +1449,14 @@ class RealTimeMonitoringEngine:
             task.is_running = True
             task.start_time = datetime.now()
             task.stats['start_time'] = task.start_time
+            self.resource_tracker.begin_task(task_id, 'monitoring')
             
             self.global_stats['active_tasks'] += 1
+            self._save_tasks()
+            
+            # 补齐停机期间错过的消息（走搬运引擎的批量通道；分片模式下由各分片自行补齐）
+            if not self.shard_coordinator and self.history_enabled:
+                asyncio.create_task(self._catch_up_task(task))
             
             logger.info(f"🚀 实时监听任务启动成功: {task_id}")
             return True
@@ -1218,11 +1488,19 @@ class RealTimeMonitoringEngine:
             
             # 清理任务相关资源
             await self._cleanup_task_resources(task)
+            self.resource_tracker.end_task(task_id)
             
             # 从活动任务中移除
             if task_id in self.active_tasks:
                 del self.active_tasks[task_id]
             
+            # 删除水位线、待投递的延迟消息和延迟统计
+            self.watermark_store.remove_task(task_id)
+            self.clone_jobs.cancel_task(task_id)
+            self._release_catch_up_ranges(task_id)
+            self.delayed_scheduler.remove_task(task_id)
+            self.latency.remove('task', task_id)
+            
             # 从数据库删除
             await self._delete_monitoring_task(task_id)
             
@@ -1251,8 +1529,10 @@ class RealTimeMonitoringEngine:
             # 更新任务状态
             task.status = "paused"
             task.pause_time = datetime.now()
+            self.resource_tracker.end_task(task_id)
             
             self.global_stats['active_tasks'] -= 1
+            self._save_tasks()
             
             logger.info(f"⏸️ 实时监听任务暂停成功: {task_id}")
             return True
@@ -1279,8 +1559,10 @@ class RealTimeMonitoringEngine:
             # 更新任务状态
             task.status = "active"
             task.pause_time = None
+            self.resource_tracker.begin_task(task_id, 'monitoring')
             
             self.global_stats['active_tasks'] += 1
+            self._save_tasks()
             
             logger.info(f"▶️ 实时监听任务恢复成功: {task_id}")
             return True
@@ -1291,6 +1573,11 @@ class RealTimeMonitoringEngine:
     
     async def _register_message_handlers(self, task: RealTimeMonitoringTask):
         """注册消息处理器 - 使用简单版监听引擎的成功模式"""
+        if self.shard_coordinator:
+            # 分片模式：任务状态更新后把任务下发给源频道所属的分片
+            self.shard_coordinator.request_sync()
+            return
+        
         try:
             logger.info(f"🔍 开始注册消息处理器，使用客户端: {type(self.client).__name__}")
             logger.info(f"🔍 客户端连接状态: {self.client.is_connected}")
@@ -1340,30 +1627,12 @@ class RealTimeMonitoringEngine:
                     # 只处理来自源频道的消息
                     channel_id = str(message.chat.id)
                     
-                    # 查找匹配的监听任务
-                    matching_tasks = []
-                    for active_task in self.active_tasks.values():
-                        if active_task.is_running:
-                            for source_channel in active_task.source_channels:
-                                source_channel_id = str(source_channel['channel_id'])
-                                if source_channel_id == channel_id:
-                                    matching_tasks.append((active_task, source_channel))
-                    
-                    if not matching_tasks:
-                        return
-                    
-                    # 消息去重
-                    if message.id in self.processed_messages.get(channel_id, set()):
+                    # 查找订阅该频道的监听任务
+                    subscriptions = self._get_channel_subscriptions().get(channel_id)
+                    if not subscriptions:
                         return
                     
-                    # 添加到已处理集合
-                    if channel_id not in self.processed_messages:
-                        self.processed_messages[channel_id] = set()
-                    self.processed_messages[channel_id].add(message.id)
-                    
-                    # 处理消息
-                    for active_task, source_config in matching_tasks:
-                        await self._handle_new_message(active_task, message, source_config)
+                    await self._dispatch_channel_message(channel_id, message, subscriptions)
                         
                 except Exception as e:
                     logger.error(f"❌ 全局消息处理器错误: {e}")
@@ -1378,9 +1647,21 @@ class RealTimeMonitoringEngine:
             except Exception as e:
                 logger.error(f"❌ add_handler注册失败: {e}")
             
-            # 启动轮询检查消息
-            import asyncio
-            asyncio.create_task(self._poll_messages())
+            # 断线处理器：重连后按已见最大ID补齐断线期间的消息
+            if not getattr(self, '_disconnect_handler_registered', False):
+                try:
+                    from pyrogram.handlers import DisconnectHandler
+                    self.client.add_handler(DisconnectHandler(self._on_client_disconnect))
+                    self._disconnect_handler_registered = True
+                except Exception as e:
+                    logger.warning(f"⚠️ 注册断线处理器失败: {e}")
+            
+            # 启动轮询检查消息（全局只启动一个轮询循环，新任务通过唤醒事件立即纳入调度；不能读取历史的会话不轮询）
+            if self.history_enabled:
+                if getattr(self, '_poll_task', None) is None or self._poll_task.done():
+                    self._poll_task = asyncio.create_task(self._poll_messages())
+                else:
+                    self._poll_wakeup.set()
             
             self._global_handler_registered = True
             logger.info("✅ 全局消息处理器注册成功（简单版模式）")
@@ -1388,53 +1669,86 @@ class RealTimeMonitoringEngine:
             logger.error(f"❌ 注册消息处理器失败: {e}")
     
     async def _poll_messages(self):
-        """分批轮换检查消息 - 优化API调用频率"""
-        logger.info(f"🔄 启动分批轮换检查（每{self.check_interval}秒检查一批，每批{self.batch_size}个频道）...")
+        """自适应轮询检查消息 - 按频道活跃度调度检查时间"""
+        logger.info(f"🔄 启动自适应轮询检查（检查间隔 {self.poll_scheduler.min_interval}-{self.poll_scheduler.max_interval} 秒，"
+                    f"每轮最多 {self.batch_size} 个频道，API预算 {self.api_rate_limit} 次/分钟）...")
         last_message_id = {}
-        current_batch = 0
-        batch_size = self.batch_size  # 使用配置的批处理大小
         
         while True:
             try:
-                # 收集所有需要检查的频道
-                all_channels = []
-                for task_id, task in self.active_tasks.items():
-                    if not task.is_running:
-                        continue
-                    
-                    for source_channel in task.source_channels:
-                        all_channels.append((task, source_channel))
+                # 收集所有需要检查的频道（按源频道去重，多个任务共享一次拉取）
+                all_channels = self._get_channel_subscriptions()
+                
+                self.poll_scheduler.sync_channels(set(all_channels.keys()))
                 
                 if not all_channels:
-                    await asyncio.sleep(self.check_interval)
+                    await self._wait_poll_wakeup(self.check_interval)
                     continue
                 
-                # 分批处理
-                total_batches = (len(all_channels) + batch_size - 1) // batch_size
-                start_idx = current_batch * batch_size
-                end_idx = min(start_idx + batch_size, len(all_channels))
-                current_batch_channels = all_channels[start_idx:end_idx]
+                # 取出已到期的频道，每轮最多batch_size个
+                due_keys = self.poll_scheduler.pop_due(self.batch_size)
+                if not due_keys:
+                    await self._wait_poll_wakeup(self.poll_scheduler.seconds_until_next())
+                    continue
                 
-                logger.debug(f"🔍 检查批次 {current_batch + 1}/{total_batches} ({len(current_batch_channels)} 个频道)")
+                logger.debug(f"🔍 检查到期频道 {len(due_keys)}/{len(all_channels)} 个")
                 
-                # 并发检查当前批次的所有频道
+                # 并发检查到期的频道
                 check_tasks = []
-                for task, source_channel in current_batch_channels:
-                    check_tasks.append(self._check_single_channel_batch(task, source_channel, last_message_id))
-                
-                if check_tasks:
-                    await asyncio.gather(*check_tasks, return_exceptions=True)
+                for channel_id in due_keys:
+                    check_tasks.append(self._check_single_channel_batch(channel_id, all_channels[channel_id], last_message_id))
                 
-                # 移动到下一批次
-                current_batch = (current_batch + 1) % total_batches
+                results = await asyncio.gather(*check_tasks, return_exceptions=True)
                 
-                # 等待检查间隔再检查下一批次
-                await asyncio.sleep(self.check_interval)
+                # 根据检查结果更新各频道的发帖频率并重新调度
+                for key, result in zip(due_keys, results):
+                    post_times = []
+                    if isinstance(result, list):
+                        for msg in result:
+                            msg_date = getattr(msg, 'date', None)
+                            post_times.append(msg_date.timestamp() if msg_date else time.time())
+                    self.poll_scheduler.record_check(key, post_times)
                 
             except Exception as e:
-                logger.error(f"❌ [分批轮换] 检查失败: {e}")
+                logger.error(f"❌ [自适应轮询] 检查失败: {e}")
                 await asyncio.sleep(10)
     
+    def _get_channel_subscriptions(self) -> Dict[str, List[Tuple[RealTimeMonitoringTask, Dict[str, Any]]]]:
+        """按源频道汇总运行中任务的订阅: channel_id -> [(任务, 源频道配置)]"""
+        subscriptions: Dict[str, List[Tuple[RealTimeMonitoringTask, Dict[str, Any]]]] = {}
+        for task in self.active_tasks.values():
+            if not task.is_running:
+                continue
+            for source_channel in task.source_channels:
+                channel_id = str(source_channel['channel_id'])
+                subscriptions.setdefault(channel_id, []).append((task, source_channel))
+        return subscriptions
+    
+    async def _dispatch_channel_message(self, channel_id: str, message: Message,
+                                        subscriptions: List[Tuple[RealTimeMonitoringTask, Dict[str, Any]]]):
+        """将一条源频道消息分发给所有订阅任务（频道级去重，每个任务使用自己的过滤配置和目标频道）"""
+        # 频道级去重：实时处理器和轮询可能拿到同一条消息
+        if channel_id not in self.processed_messages:
+            self.processed_messages[channel_id] = set()
+        if message.id in self.processed_messages[channel_id]:
+            return
+        self.processed_messages[channel_id].add(message.id)
+        
+        self._track_message_id(channel_id, message.id)
+        
+        received_at = time.time()
+        for task, source_config in subscriptions:
+            await self._handle_new_message(task, message, source_config, received_at)
+    
+    async def _wait_poll_wakeup(self, timeout: float):
+        """等待下一个频道到期，或在任务变化时提前唤醒"""
+        try:
+            await asyncio.wait_for(self._poll_wakeup.wait(), timeout=max(timeout, 0.1))
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._poll_wakeup.clear()
+    
     async def _check_api_rate_limit(self):
         """检查API调用频率限制"""
         current_time = datetime.now()
@@ -1489,27 +1803,29 @@ class RealTimeMonitoringEngine:
             self.consecutive_errors = 0
             logger.info("✅ 熔断器重置，恢复正常运行")
 
-    async def _check_single_channel_batch(self, task, source_channel, last_message_id):
-        """检查单个频道（分批模式）"""
+    async def _check_single_channel_batch(self, channel_id: str,
+                                          subscriptions: List[Tuple[RealTimeMonitoringTask, Dict[str, Any]]],
+                                          last_message_id: Dict[str, int]) -> List[Message]:
+        """检查单个源频道（一次拉取，分发给所有订阅任务），返回本次发现的新消息"""
         try:
             # 检查熔断器状态
             await self._reset_circuit_breaker()
             
             if self.circuit_breaker_active:
                 logger.warning("⚠️ 熔断器激活，跳过本次检查")
-                return
+                return []
             
             # 检查API调用频率
             await self._check_api_rate_limit()
             
-            channel_id = source_channel['channel_id']
+            source_channel = subscriptions[0][1] if subscriptions else {}
             channel_name = source_channel.get('channel_name', 'Unknown')
             
-            # 获取频道最新消息
+            # 获取频道最新消息（首次只需最新ID，之后拉取最近 poll_probe_limit 条，间隔中的缺失由缺口恢复补齐）
             messages = []
-            max_messages = self.config.get('max_messages_per_check', 200)
+            max_messages = self.poll_probe_limit if channel_id in last_message_id else 1
             async for message in self.client.get_chat_history(
-                chat_id=channel_id, 
+                chat_id=source_channel.get('channel_id', channel_id), 
                 limit=max_messages
             ):
                 messages.append(message)
@@ -1522,6 +1838,7 @@ class RealTimeMonitoringEngine:
                 if channel_id not in last_message_id:
                     # 初始化：记录最新消息ID
                     last_message_id[channel_id] = messages[-1].id
+                    self.channel_last_seen[channel_id] = max(self.channel_last_seen.get(channel_id, 0), messages[-1].id)
                     logger.info(f"🔍 [分批] 初始化频道 {channel_name} 最新消息ID: {last_message_id[channel_id]}")
                 else:
                     # 处理所有新消息 - 修复：检查所有消息，不仅仅是ID递增的
@@ -1536,20 +1853,21 @@ class RealTimeMonitoringEngine:
                         # 更新最新消息ID
                         last_message_id[channel_id] = messages[-1].id
                         
-                        # 处理每条新消息
+                        # 处理每条新消息，分发给所有订阅该频道的任务
                         for message in new_messages:
-                            source_config = {
-                                'channel_id': channel_id,
-                                'channel_name': channel_name
-                            }
-                            await self._handle_new_message(task, message, source_config)
+                            await self._dispatch_channel_message(channel_id, message, subscriptions)
+                        
+                        return new_messages
                     else:
                         # 即使没有新消息，也记录检查状态
                         logger.debug(f"🔍 [分批] 频道 {channel_name} 无新消息，当前最新ID: {messages[-1].id}")
+            
+            return []
                         
         except Exception as e:
             logger.error(f"❌ [分批] 检查频道 {channel_id} 失败: {e}")
             await self._handle_api_error(e)
+            return []
     
     async def _monitor_performance(self):
         """监控系统性能"""
@@ -1578,11 +1896,18 @@ class RealTimeMonitoringEngine:
     
     async def _unregister_message_handlers(self, task: RealTimeMonitoringTask):
         """移除消息处理器 - 简化版（使用全局处理器）"""
+        if self.shard_coordinator:
+            self.shard_coordinator.request_sync()
+            return
+        
         try:
-            # 由于使用全局处理器，只需要清理消息去重集合
+            # 由于使用全局处理器，只需要清理消息去重集合（仍被其他任务订阅的频道保留）
+            subscriptions = self._get_channel_subscriptions()
             for source_channel in task.source_channels:
                 channel_id = str(source_channel['channel_id'])
-                if channel_id in self.processed_messages:
+                task.processed_message_ids.pop(channel_id, None)
+                if channel_id in self.processed_messages and not any(
+                        other is not task for other, _ in subscriptions.get(channel_id, [])):
                     # 清理该频道的已处理消息记录
                     self.processed_messages[channel_id].clear()
                     logger.info(f"📡 清理消息去重集合: {channel_id}")
@@ -1591,7 +1916,7 @@ class RealTimeMonitoringEngine:
             logger.error(f"❌ 移除消息处理器失败: {e}")
     
     async def _handle_new_message(self, task: RealTimeMonitoringTask, message: Message, 
-                                source_config: Dict[str, Any]):
+                                source_config: Dict[str, Any], received_at: Optional[float] = None):
         """处理新消息"""
         try:
             # 记录所有消息处理日志
@@ -1625,15 +1950,15 @@ class RealTimeMonitoringEngine:
                 # 媒体组消息暂时不添加到processed_messages，等整个媒体组处理完成后再添加
                 logger.debug(f"🔍 检测到媒体组消息: {message.id} (媒体组: {media_group_id})")
             else:
-                # 普通消息：检查是否已经处理过
-                if channel_id not in self.processed_messages:
-                    self.processed_messages[channel_id] = set()
+                # 普通消息：按任务去重（同一源频道的消息会分发给多个任务）
+                if channel_id not in task.processed_message_ids:
+                    task.processed_message_ids[channel_id] = set()
                 
-                if message.id in self.processed_messages[channel_id]:
+                if message.id in task.processed_message_ids[channel_id]:
                     logger.debug(f"⚠️ 消息已处理过，跳过: {message.id}")
                     return
                 
-                self.processed_messages[channel_id].add(message.id)
+                task.processed_message_ids[channel_id].add(message.id)
             
             # 更新统计
             task.stats['total_processed'] += 1
@@ -1657,7 +1982,16 @@ class RealTimeMonitoringEngine:
             
             # 根据监听模式处理消息
             if task.monitoring_mode == 'realtime':
-                await self._process_message_realtime(task, message, source_config)
+                # 只入队，由目标频道的发送队列按源顺序发送，慢目标不会阻塞其他频道
+                accepted = await self._enqueue_send(
+                    task.target_channel,
+                    functools.partial(self._process_message_realtime, task, message, source_config),
+                    task_id=task.task_id,
+                    received_at=received_at,
+                    source_times=[self._message_timestamp(message)]
+                )
+                if not accepted:
+                    self._shed_to_delayed(task, [message])
             elif task.monitoring_mode == 'delayed':
                 await self._process_message_delayed(task, message, source_config)
             elif task.monitoring_mode == 'batch':
@@ -1677,6 +2011,7 @@ class RealTimeMonitoringEngine:
             success = await self._transfer_message(task, message, source_config)
             
             if success:
+                self._advance_watermark(task, message)
                 task.stats['successful_transfers'] += 1
                 self.global_stats['successful_transfers'] += 1
                 
@@ -1706,15 +2041,75 @@ class RealTimeMonitoringEngine:
     
     async def _process_message_delayed(self, task: RealTimeMonitoringTask, 
                                      message: Message, source_config: Dict[str, Any]):
-        """延迟模式处理消息"""
+        """延迟模式处理消息 - 只登记紧凑条目，到期后由延迟调度器批量投递"""
         try:
-            delay = task.delay_seconds
-            # 减少延迟处理的日志输出
-            
-            # 延迟后处理
-            await asyncio.sleep(delay)
-            
-            if not task.should_stop():
+            # 待投递条目落盘后才推进水位线，落盘前重启时由补齐重新登记
+            self.delayed_scheduler.schedule(
+                task.task_id, message.chat.id, message.id, time.time() + task.delay_seconds,
+                on_persisted=lambda: self._advance_watermark(task, message)
+            )
+                    
+        except Exception as e:
+            logger.error(f"❌ 延迟处理消息失败: {e}")
+    
+    async def _dispatch_delayed_messages(self, task_id: str, chat_id: int,
+                                         message_ids: List[int]) -> Optional[asyncio.Future]:
+        """投递到期的延迟消息（同一任务同一频道的消息一次拉取）
+        
+        返回发送完成的 Future，调度器在消息实际发送后才移除条目
+        """
+        task = self.active_tasks.get(task_id)
+        if not task:
+            logger.debug(f"⚠️ 任务 {task_id} 已删除，丢弃 {len(message_ids)} 条延迟消息")
+            return None
+        if task.should_stop():
+            # 暂停/停止的任务保留条目，恢复运行后再投递
+            raise DeliveryDeferred(f"任务 {task_id} 未运行")
+        
+        if self._target_send_saturated(task.target_channel):
+            # 目标频道积压已满，条目留在调度器中，稍后再拉取
+            raise DeliveryDeferred(f"目标频道 {task.target_channel} 发送积压已满")
+        
+        source_config = next(
+            (source for source in task.source_channels if str(source['channel_id']) == str(chat_id)),
+            {'channel_id': chat_id}
+        )
+        
+        await self._check_api_rate_limit()
+        messages = await self.client.get_messages(chat_id, message_ids)
+        if not isinstance(messages, list):
+            messages = [messages]
+        
+        # 发送交给目标频道队列，与实时/批量消息共享同一顺序
+        delivered = asyncio.get_running_loop().create_future()
+        accepted = await self._enqueue_send(
+            task.target_channel,
+            functools.partial(self._send_delayed_messages, task, messages, source_config, delivered),
+            item_count=len(messages),
+            task_id=task.task_id,
+            source_times=[self._message_timestamp(message) for message in messages if message]
+        )
+        if not accepted:
+            raise DeliveryDeferred(f"目标频道 {task.target_channel} 发送积压已满")
+        return delivered
+    
+    async def _send_delayed_messages(self, task: RealTimeMonitoringTask, messages: List[Message],
+                                     source_config: Dict[str, Any],
+                                     delivered: Optional[asyncio.Future] = None):
+        """发送一组到期的延迟消息
+        
+        Args:
+            delivered: 发送结束时写入未投递的消息ID列表（任务中途停止时剩余的消息）
+        """
+        undelivered: List[int] = []
+        try:
+            for index, message in enumerate(messages):
+                if task.should_stop():
+                    undelivered = [m.id for m in messages[index:] if m]
+                    break
+                if not message or getattr(message, 'empty', False):
+                    continue
+                
                 success = await self._transfer_message(task, message, source_config)
                 
                 if success:
@@ -1725,21 +2120,34 @@ class RealTimeMonitoringEngine:
                     task.stats['failed_transfers'] += 1
                     self.global_stats['failed_transfers'] += 1
                     logger.error(f"❌ 延迟搬运失败: {message.id}")
-                    
+        except asyncio.CancelledError:
+            if delivered is not None and not delivered.done():
+                delivered.cancel()
+            raise
         except Exception as e:
-            logger.error(f"❌ 延迟处理消息失败: {e}")
+            if delivered is not None and not delivered.done():
+                delivered.set_exception(e)
+            raise
+        
+        if delivered is not None and not delivered.done():
+            delivered.set_result(undelivered)
     
     async def _process_message_batch(self, task: RealTimeMonitoringTask, 
                                    message: Message, source_config: Dict[str, Any]):
-        """批量模式处理消息"""
+        """批量模式处理消息 - 达到批量大小或最长等待时间时投递"""
         try:
             # 添加到批量缓存
             if task.task_id not in self.message_cache:
                 self.message_cache[task.task_id] = []
             
             self.message_cache[task.task_id].append((message, source_config))
+            self.resource_tracker.set_buffered(task.task_id, [m for m, _ in self.message_cache[task.task_id]])
             
-            # 减少批量缓存的日志输出
+            # 批次中的第一条消息启动超时投递计时器
+            if len(self.message_cache[task.task_id]) == 1:
+                self._batch_flush_timers[task.task_id] = asyncio.create_task(
+                    self._flush_batch_after_max_age(task)
+                )
             
             # 检查是否达到批量大小
             if len(self.message_cache[task.task_id]) >= task.batch_size:
@@ -1748,32 +2156,84 @@ class RealTimeMonitoringEngine:
         except Exception as e:
             logger.error(f"❌ 批量处理消息失败: {e}")
     
+    async def _flush_batch_after_max_age(self, task: RealTimeMonitoringTask):
+        """批次等待超过最长时间后投递，避免冷门频道的消息长期滞留"""
+        try:
+            await asyncio.sleep(task.batch_max_age)
+            if self.message_cache.get(task.task_id):
+                self._batch_flush_timers.pop(task.task_id, None)
+                await self._process_message_batch_execute(task)
+        except asyncio.CancelledError:
+            pass
+    
     async def _process_message_batch_execute(self, task: RealTimeMonitoringTask):
-        """执行批量消息处理"""
+        """执行批量消息处理 - 取出当前批次，交给目标频道的发送队列"""
         try:
             if task.task_id not in self.message_cache:
                 return
             
+            # 取消超时计时器（当前调用即为投递）
+            timer = self._batch_flush_timers.pop(task.task_id, None)
+            if timer and timer is not asyncio.current_task() and not timer.done():
+                timer.cancel()
+            
             batch_messages = self.message_cache[task.task_id].copy()
             self.message_cache[task.task_id].clear()
+            self.resource_tracker.set_buffered(task.task_id, [])
             
+            if not batch_messages:
+                return
+            
+            accepted = await self._enqueue_send(
+                task.target_channel,
+                functools.partial(self._send_message_batch, task, batch_messages),
+                item_count=len(batch_messages),
+                task_id=task.task_id,
+                source_times=[self._message_timestamp(message) for message, _ in batch_messages]
+            )
+            if not accepted:
+                self._shed_to_delayed(task, [message for message, _ in batch_messages])
+        
+        except Exception as e:
+            logger.error(f"❌ 执行批量处理失败: {e}")
+    
+    async def _send_message_batch(self, task: RealTimeMonitoringTask,
+                                  batch_messages: List[Tuple[Message, Dict[str, Any]]]):
+        """发送一个批次"""
+        try:
             logger.info(f"🚀 开始批量处理: {len(batch_messages)} 条消息")
             
             success_count = 0
             failed_count = 0
             
-            for message, source_config in batch_messages:
+            # 未经修改的消息（含完整媒体组）按源频道合并为服务端批量复制，其余逐条搬运
+            copy_groups, fallback_messages = await self._split_batch_for_copy(task, batch_messages)
+            
+            for chat_id, messages in copy_groups.items():
                 if task.should_stop():
                     break
                 
-                success = await self._transfer_message(task, message, source_config)
+                copied_ids = await self._copy_messages_batch(chat_id, messages, task.target_channel)
+                for message in messages:
+                    if message.id in copied_ids:
+                        success_count += 1
+                        self._advance_watermark(task, message)
+                        task.processed_message_ids.setdefault(str(message.chat.id), set()).add(message.id)
+                    else:
+                        # 未能批量复制的消息退回逐条搬运
+                        fallback_messages.append((message, None))
+            
+            fallback_messages.sort(key=lambda item: (str(item[0].chat.id), item[0].id))
+            for message, source_config in fallback_messages:
+                if task.should_stop():
+                    break
+                
+                success = await self._transfer_message(task, message, source_config or {})
+                self._advance_watermark(task, message)
                 if success:
                     success_count += 1
                 else:
                     failed_count += 1
-                
-                # 批量处理时添加小延迟
-                await asyncio.sleep(0.1)
             
             # 更新统计
             task.stats['successful_transfers'] += success_count
@@ -1786,6 +2246,568 @@ class RealTimeMonitoringEngine:
         except Exception as e:
             logger.error(f"❌ 执行批量处理失败: {e}")
     
+    async def _split_batch_for_copy(self, task: RealTimeMonitoringTask,
+                                    batch_messages: List[Tuple[Message, Dict[str, Any]]]
+                                    ) -> Tuple[Dict[int, List[Message]], List[Tuple[Message, Dict[str, Any]]]]:
+        """拆分批次：可直接服务端复制的消息按源频道分组，需要改写内容的消息逐条搬运
+        
+        只有过滤规则不改动文本和按钮、且不追加小尾巴时，消息才能原样复制；
+        媒体组只有全部成员都可原样复制时才整体复制，否则整体走逐条搬运以保持相册完整。
+        """
+        filter_config = await self._get_channel_filter_config(task.user_id, task.target_channel)
+        engine_tail = bool(str(self.message_engine.config.get('tail_text', '') or '').strip())
+        
+        copyable: Dict[int, Message] = {}
+        fallback: List[Tuple[Message, Dict[str, Any]]] = []
+        blocked_groups: Set[str] = set()
+        
+        for message, source_config in batch_messages:
+            eligible = not engine_tail
+            if eligible:
+                processed_result, should_process = self.message_engine.process_message(message, filter_config)
+                if not should_process or not processed_result:
+                    # 被过滤的消息交给逐条路径统计
+                    eligible = False
+                else:
+                    eligible = (processed_result.get('text', '') == (message.text or message.caption or '')
+                                and processed_result.get('buttons') == message.reply_markup)
+            
+            if eligible:
+                copyable[message.id] = message
+            else:
+                fallback.append((message, source_config))
+                if getattr(message, 'media_group_id', None):
+                    blocked_groups.add(message.media_group_id)
+        
+        copy_groups: Dict[int, List[Message]] = {}
+        for message in copyable.values():
+            if getattr(message, 'media_group_id', None) in blocked_groups:
+                fallback.append((message, {}))
+                continue
+            copy_groups.setdefault(message.chat.id, []).append(message)
+        
+        for messages in copy_groups.values():
+            messages.sort(key=lambda msg: msg.id)
+        
+        return copy_groups, fallback
+    
+    @staticmethod
+    def _chunk_ids_by_media_group(messages: List[Message], limit: int = 100) -> List[List[int]]:
+        """按顺序把消息ID切成每块最多limit条，同一媒体组的消息不跨块（相册最多10条）"""
+        chunks: List[List[int]] = []
+        chunk: List[int] = []
+        index = 0
+        while index < len(messages):
+            group_id = getattr(messages[index], 'media_group_id', None)
+            end = index + 1
+            while group_id and end < len(messages) and getattr(messages[end], 'media_group_id', None) == group_id:
+                end += 1
+            unit = [message.id for message in messages[index:end]]
+            if chunk and len(chunk) + len(unit) > limit:
+                chunks.append(chunk)
+                chunk = []
+            chunk.extend(unit)
+            index = end
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+    
+    async def _copy_messages_batch(self, chat_id: int, messages: List[Message], target_channel: str) -> Set[int]:
+        """服务端批量复制消息（不带转发来源，同一次调用中的媒体组保持为相册），每次最多100条，媒体组不跨批
+        
+        Returns:
+            实际复制成功的源消息ID，其余消息由调用方逐条搬运
+        """
+        from pyrogram import raw
+        
+        copied: Set[int] = set()
+        try:
+            from_peer = await self.client.resolve_peer(chat_id)
+            to_peer = await self.client.resolve_peer(target_channel)
+            
+            for chunk in self._chunk_ids_by_media_group(messages):
+                random_ids = {self.client.rnd_id(): msg_id for msg_id in chunk}
+                await self._check_api_rate_limit()
+                result = await self.client.invoke(
+                    raw.functions.messages.ForwardMessages(
+                        from_peer=from_peer,
+                        id=chunk,
+                        random_id=list(random_ids),
+                        to_peer=to_peer,
+                        drop_author=True
+                    )
+                )
+                
+                # 按 UpdateMessageID 的 random_id 对应回源消息，已删除等未复制的消息没有对应更新
+                updates = getattr(result, 'updates', None)
+                if updates is None:
+                    copied.update(chunk)
+                    continue
+                copied.update(random_ids[update.random_id] for update in updates
+                              if isinstance(update, raw.types.UpdateMessageID) and update.random_id in random_ids)
+            
+            logger.info(f"📦 批量复制 {len(copied)}/{len(messages)} 条消息: {chat_id} -> {target_channel}")
+        
+        except FloodWait as e:
+            logger.warning(f"⚠️ 批量复制触发限流，等待 {e.value} 秒后剩余消息改为逐条搬运")
+            await asyncio.sleep(e.value)
+        except Exception as e:
+            logger.warning(f"⚠️ 批量复制失败，剩余消息改为逐条搬运: {e}")
+        
+        return copied
+    
+    def _target_send_saturated(self, target_channel: str) -> bool:
+        """目标频道的发送队列和溢出缓冲是否都已满"""
+        target_key = str(target_channel)
+        queue = self.target_send_queues.get(target_key)
+        overflow = self.target_send_overflow.get(target_key)
+        return bool(queue is not None and queue.full() and overflow is not None
+                    and len(overflow) >= self.send_overflow_max_size)
+    
+    async def _enqueue_send(self, target_channel: str, job: Callable[[], Awaitable[Any]], item_count: int = 1,
+                            task_id: Optional[str] = None, received_at: Optional[float] = None,
+                            source_times: Optional[List[Optional[float]]] = None) -> bool:
+        """将发送作业加入目标频道的有界队列（不等待；队列满时暂存到溢出缓冲，由工作协程按顺序补入）
+        
+        Returns:
+            溢出缓冲也已满时返回False，作业未入队，由调用方改为紧凑条目（见 _shed_to_delayed）
+        """
+        target_key = str(target_channel)
+        if self._target_send_saturated(target_key):
+            stats = self.target_send_stats[target_key]
+            if not stats['shed']:
+                logger.warning(f"⚠️ 目标频道 {target_key} 发送积压已达上限，新消息转为延迟调度条目")
+            stats['shed'] += item_count
+            return False
+        
+        queue = self.target_send_queues.get(target_key)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.send_queue_max_size)
+            self.target_send_queues[target_key] = queue
+            self.target_send_overflow[target_key] = deque()
+            self.target_send_enqueue_times[target_key] = deque()
+            self.target_send_stats[target_key] = {
+                'enqueued': 0,
+                'completed': 0,
+                'failed': 0,
+                'last_lag': 0.0,
+                'max_lag': 0.0,
+                'last_send_time': None,
+                'shed': 0
+            }
+        
+        worker = self.target_send_workers.get(target_key)
+        if worker is None or worker.done():
+            self.target_send_workers[target_key] = asyncio.create_task(self._target_send_worker(target_key))
+        
+        # 溢出缓冲中的作业同样占用内存，计入任务的排队消息数
+        self.resource_tracker.adjust_queued(task_id, item_count)
+        enqueued_at = time.time()
+        item = (enqueued_at, job, task_id, source_times or [], item_count)
+        self.target_send_enqueue_times[target_key].append(enqueued_at)
+        
+        # 溢出缓冲非空时新作业排在其后，保证同一目标的发送顺序
+        overflow = self.target_send_overflow[target_key]
+        if overflow or queue.full():
+            if not overflow:
+                logger.warning(f"⚠️ 目标频道 {target_key} 发送队列已满({queue.qsize()})，新作业暂存到溢出缓冲")
+            overflow.append(item)
+        else:
+            queue.put_nowait(item)
+        self.target_send_stats[target_key]['enqueued'] += item_count
+        
+        if received_at is not None:
+            self.latency.record('receipt_to_enqueue', time.time() - received_at, task_id, target_key)
+        return True
+    
+    def _shed_to_delayed(self, task: RealTimeMonitoringTask, messages: List[Message]):
+        """目标频道积压已满：只保留(频道ID, 消息ID)紧凑条目交给延迟调度器，积压消化后重新拉取发送
+        
+        条目落盘后不推进水位线：队列中更早的消息尚未发送，水位线仍由它们发送成功后推进
+        """
+        now = time.time()
+        for message in messages:
+            self.delayed_scheduler.schedule(task.task_id, message.chat.id, message.id, now)
+    
+    async def _target_send_worker(self, target_key: str):
+        """目标频道发送工作协程：按入队顺序逐个执行发送作业"""
+        queue = self.target_send_queues[target_key]
+        overflow = self.target_send_overflow[target_key]
+        enqueue_times = self.target_send_enqueue_times[target_key]
+        stats = self.target_send_stats[target_key]
+        
+        while True:
+            enqueued_at, job, task_id, source_times, item_count = await queue.get()
+            if enqueue_times:
+                enqueue_times.popleft()
+            while overflow and not queue.full():
+                queue.put_nowait(overflow.popleft())
+            try:
+                # 排队延迟：从入队到开始发送
+                send_start = time.time()
+                lag = send_start - enqueued_at
+                stats['last_lag'] = lag
+                stats['max_lag'] = max(stats['max_lag'], lag)
+                self.latency.record('enqueue_to_send', lag, task_id, target_key)
+                
+                self.resource_tracker.record_api_call(task_id)
+                await job()
+                
+                send_end = time.time()
+                stats['completed'] += 1
+                stats['last_send_time'] = send_end
+                self.latency.record('send_duration', send_end - send_start, task_id, target_key)
+                for source_time in source_times:
+                    if source_time:
+                        self.latency.record('source_to_target', send_end - source_time, task_id, target_key)
+                self.performance_metrics['average_processing_time'] = self.latency.get_mean('send_duration')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                stats['failed'] += 1
+                logger.error(f"❌ 目标频道 {target_key} 发送作业失败: {e}")
+            finally:
+                self.resource_tracker.adjust_queued(task_id, -item_count)
+                queue.task_done()
+    
+    @staticmethod
+    def _message_timestamp(message: Message) -> Optional[float]:
+        """源消息发布时间戳"""
+        message_date = getattr(message, 'date', None)
+        return message_date.timestamp() if message_date else None
+    
+    def get_latency_stats(self, task_id: Optional[str] = None, target: Optional[str] = None) -> Dict[str, Any]:
+        """获取延迟直方图摘要（p50/p95/p99/max，单位秒），可按任务或目标频道筛选"""
+        return self.latency.get_snapshot(task_id=task_id, target=target)
+    
+    def get_send_queue_stats(self) -> Dict[str, Any]:
+        """获取各目标频道发送队列的深度和延迟"""
+        now = time.time()
+        result = {}
+        for target_key, queue in self.target_send_queues.items():
+            stats = self.target_send_stats.get(target_key, {})
+            # 队头等待时间：尚未开始发送的最早作业已经等待的时长
+            enqueue_times = self.target_send_enqueue_times.get(target_key)
+            head_wait = now - enqueue_times[0] if enqueue_times else 0.0
+            overflow = len(self.target_send_overflow.get(target_key, ()))
+            result[target_key] = {
+                'depth': queue.qsize() + overflow,
+                'overflow': overflow,
+                'max_size': queue.maxsize,
+                'head_wait': round(head_wait, 3),
+                'last_lag': round(stats.get('last_lag', 0.0), 3),
+                'max_lag': round(stats.get('max_lag', 0.0), 3),
+                'enqueued': stats.get('enqueued', 0),
+                'completed': stats.get('completed', 0),
+                'failed': stats.get('failed', 0),
+                'shed': stats.get('shed', 0)
+            }
+        return result
+    
+    def _track_message_id(self, channel_id: str, message_id: int):
+        """更新频道已见最大ID，发现ID不连续时登记缺口"""
+        pending = self._pending_gaps.get(channel_id)
+        if pending and message_id in pending:
+            # 乱序到达的消息填上了缺口
+            pending.discard(message_id)
+            self.gap_stats['late_arrivals'] += 1
+        
+        last_seen = self.channel_last_seen.get(channel_id)
+        if last_seen is None or message_id > last_seen:
+            self.channel_last_seen[channel_id] = message_id
+        
+        # 只有频道/超级群的消息ID在会话内连续
+        if last_seen is not None and message_id > last_seen + 1 and channel_id.startswith('-100'):
+            self._record_gap(channel_id, last_seen + 1, message_id - 1)
+    
+    def _record_gap(self, channel_id: str, start_id: int, end_id: int):
+        """登记疑似缺失的消息ID，宽限期后仍未到达的交给搬运引擎补齐"""
+        if not self.history_enabled:
+            return
+        
+        if end_id - start_id + 1 > self.catchup_max_messages:
+            logger.warning(f"⚠️ 频道 {channel_id} 缺口 {end_id - start_id + 1} 条超过补齐上限，"
+                           f"只补齐最近 {self.catchup_max_messages} 条")
+            start_id = end_id - self.catchup_max_messages + 1
+        
+        processed = self.processed_messages.get(channel_id, set())
+        missing = {msg_id for msg_id in range(start_id, end_id + 1) if msg_id not in processed}
+        if not missing:
+            return
+        
+        self._pending_gaps.setdefault(channel_id, set()).update(missing)
+        self.gap_stats['gaps_detected'] += 1
+        logger.debug(f"🕳️ 频道 {channel_id} 检测到消息缺口: {start_id}-{end_id}")
+        
+        if self._gap_flush_task is None or self._gap_flush_task.done():
+            self._gap_flush_task = asyncio.create_task(self._flush_gaps_after_grace())
+    
+    async def _flush_gaps_after_grace(self):
+        """等待乱序消息到达，然后只补齐仍然缺失的消息ID"""
+        try:
+            await asyncio.sleep(self.gap_grace_seconds)
+            
+            pending_gaps, self._pending_gaps = self._pending_gaps, {}
+            subscriptions = self._get_channel_subscriptions()
+            
+            for channel_id, missing_ids in pending_gaps.items():
+                processed = self.processed_messages.setdefault(channel_id, set())
+                missing_ids = sorted(missing_ids - processed)
+                if not missing_ids or channel_id not in subscriptions:
+                    continue
+                
+                # 标记为已处理，之后即使实时通道再收到也不重复搬运
+                processed.update(missing_ids)
+                
+                for task, source_channel in subscriptions[channel_id]:
+                    await self._recover_missing_ids(task, source_channel, missing_ids)
+                
+                self.gap_stats['messages_recovered'] += len(missing_ids)
+        
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"❌ 缺口恢复失败: {e}")
+    
+    async def _recover_missing_ids(self, task: RealTimeMonitoringTask, source_channel: Dict[str, Any],
+                                   missing_ids: List[int]):
+        """将缺失ID合并为连续区间，逐段交给搬运引擎"""
+        channel_id = str(source_channel['channel_id'])
+        processed_ids = task.processed_message_ids.setdefault(channel_id, set())
+        
+        ranges = []
+        for msg_id in missing_ids:
+            if ranges and msg_id == ranges[-1][1] + 1:
+                ranges[-1][1] = msg_id
+            else:
+                ranges.append([msg_id, msg_id])
+        
+        for start_id, end_id in ranges:
+            if task.should_stop():
+                return
+            range_ids = set(range(start_id, end_id + 1)) - processed_ids
+            if not range_ids:
+                continue
+            # 每个缺失ID只尝试补齐一次，失败也保持已处理，避免反复登记同一缺口
+            processed_ids.update(range_ids)
+            try:
+                if await self._submit_catch_up_range(task, source_channel, start_id, end_id):
+                    logger.info(f"🔁 补齐缺失消息: {source_channel.get('channel_name', channel_id)} ({start_id}-{end_id})")
+                else:
+                    logger.error(f"❌ 提交缺口补齐失败，放弃ID {channel_id} ({start_id}-{end_id})")
+            except Exception as e:
+                logger.error(f"❌ 提交缺口补齐失败，放弃ID {channel_id} ({start_id}-{end_id}): {e}")
+    
+    async def _on_client_disconnect(self, client):
+        """客户端断线：等待重连后检查断线期间错过的消息"""
+        self.gap_stats['disconnects'] += 1
+        if not self.history_enabled:
+            logger.warning("⚠️ 监听客户端连接断开（当前会话不能读取历史，断线期间的消息无法补齐）")
+            return
+        logger.warning("⚠️ 监听客户端连接断开，重连后将检查消息缺口")
+        if self._reconnect_recovery_task is None or self._reconnect_recovery_task.done():
+            self._reconnect_recovery_task = asyncio.create_task(self._recover_after_reconnect())
+    
+    async def _recover_after_reconnect(self):
+        """重连后比较各频道已见最大ID与最新ID，缺口交给补齐流程"""
+        try:
+            while not self.client.is_connected:
+                if not self.is_running:
+                    return
+                await asyncio.sleep(1)
+            
+            for channel_id in list(self._get_channel_subscriptions().keys()):
+                last_seen = self.channel_last_seen.get(channel_id)
+                if last_seen is None:
+                    continue
+                try:
+                    latest_id = await self._get_latest_message_id(int(channel_id))
+                except Exception as e:
+                    logger.warning(f"⚠️ 获取频道 {channel_id} 最新消息ID失败: {e}")
+                    continue
+                if latest_id and latest_id > last_seen:
+                    self.channel_last_seen[channel_id] = latest_id
+                    self._record_gap(channel_id, last_seen + 1, latest_id)
+        
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"❌ 重连后缺口检查失败: {e}")
+    
+    def _advance_watermark(self, task: RealTimeMonitoringTask, message: Message):
+        """消息处理完成后推进该任务在源频道上的水位线"""
+        try:
+            self._advance_watermark_to(task.task_id, str(message.chat.id), message.id)
+        except Exception as e:
+            logger.warning(f"⚠️ 更新监听水位线失败: {e}")
+    
+    def _advance_watermark_to(self, task_id: str, channel_id: str, message_id: int):
+        """推进水位线；有未完成的补齐范围时只推进到最早未完成范围之前"""
+        key = (task_id, channel_id)
+        if key in self._catch_up_ranges:
+            self._held_watermarks[key] = max(self._held_watermarks.get(key, 0), message_id)
+            self._release_watermark(key)
+        else:
+            self.watermark_store.advance(task_id, channel_id, message_id)
+    
+    def _release_watermark(self, key: Tuple[str, str]):
+        """移除已完成的连续前缀，把水位线推进到最早未完成范围之前"""
+        ranges = self._catch_up_ranges.get(key, [])
+        while ranges and ranges[0][2]:
+            ranges.pop(0)
+        
+        held = self._held_watermarks.get(key)
+        if held is not None:
+            target = min(held, ranges[0][0] - 1) if ranges else held
+            self.watermark_store.advance(key[0], key[1], target)
+        
+        if not ranges:
+            self._catch_up_ranges.pop(key, None)
+            self._held_watermarks.pop(key, None)
+    
+    def _track_catch_up_range(self, key: Tuple[str, str], start_id: int, end_id: int) -> List[Any]:
+        """登记一个补齐范围，完成前水位线不越过它"""
+        entry = [start_id, end_id, False]
+        ranges = self._catch_up_ranges.setdefault(key, [])
+        ranges.append(entry)
+        ranges.sort(key=lambda item: item[0])
+        return entry
+    
+    def _complete_catch_up_range(self, key: Tuple[str, str], entry: List[Any], advance: bool = True):
+        """补齐范围结束：advance为True时水位线可以越过该范围"""
+        ranges = self._catch_up_ranges.get(key)
+        if not ranges or entry not in ranges:
+            return
+        entry[2] = True
+        if advance:
+            self._held_watermarks[key] = max(self._held_watermarks.get(key, 0), entry[1])
+        self._release_watermark(key)
+    
+    def _release_catch_up_ranges(self, task_id: str):
+        """任务删除时丢弃其补齐范围"""
+        for key in [key for key in self._catch_up_ranges if key[0] == task_id]:
+            self._catch_up_ranges.pop(key, None)
+            self._held_watermarks.pop(key, None)
+    
+    async def _get_latest_message_id(self, channel_id) -> Optional[int]:
+        """获取频道当前最新消息ID"""
+        await self._check_api_rate_limit()
+        async for message in self.client.get_chat_history(chat_id=channel_id, limit=1):
+            return message.id
+        return None
+    
+    async def _catch_up_task(self, task: RealTimeMonitoringTask):
+        """补齐停机期间错过的消息
+        
+        对每个源频道比较持久化水位线与频道最新消息ID，
+        缺口范围交给搬运引擎批量搬运，之后由实时通道继续处理新消息。
+        """
+        for source_channel in task.source_channels:
+            if task.should_stop():
+                return
+            
+            channel_id = str(source_channel['channel_id'])
+            channel_name = source_channel.get('channel_name', channel_id)
+            
+            try:
+                watermark = self.watermark_store.get(task.task_id, channel_id)
+                latest_id = await self._get_latest_message_id(source_channel['channel_id'])
+                if latest_id is None:
+                    continue
+                
+                if watermark is None:
+                    # 首次启动：以当前最新消息为起点
+                    self.watermark_store.advance(task.task_id, channel_id, latest_id)
+                    continue
+                
+                if latest_id <= watermark:
+                    continue
+                
+                start_id = watermark + 1
+                if latest_id - start_id + 1 > self.catchup_max_messages:
+                    logger.warning(f"⚠️ 频道 {channel_name} 缺口 {latest_id - watermark} 条超过补齐上限，"
+                                   f"只补齐最近 {self.catchup_max_messages} 条")
+                    start_id = latest_id - self.catchup_max_messages + 1
+                
+                # 缺口范围内的消息由搬运引擎处理，实时通道不再重复处理
+                processed_ids = task.processed_message_ids.setdefault(channel_id, set())
+                catchup_ids = set(range(start_id, latest_id + 1)) - processed_ids
+                processed_ids.update(catchup_ids)
+                
+                if await self._submit_catch_up_range(task, source_channel, start_id, latest_id):
+                    logger.info(f"🔁 补齐停机期间消息: {channel_name} ({start_id}-{latest_id})")
+                else:
+                    processed_ids.difference_update(catchup_ids)
+            
+            except Exception as e:
+                logger.error(f"❌ 补齐频道 {channel_name} 消息失败: {e}")
+    
+    async def _submit_catch_up_range(self, task: RealTimeMonitoringTask, source_channel: Dict[str, Any],
+                                     start_id: int, end_id: int) -> bool:
+        """将缺口范围提交给搬运作业队列（与相邻范围合并），搬运成功后才推进水位线
+        
+        搬运失败（临时错误、FloodWait等）时范围继续挡住水位线，按指数退避重新提交，直到成功或任务删除。
+        """
+        channel_id = str(source_channel['channel_id'])
+        key = (task.task_id, channel_id)
+        
+        filter_config = await self._get_channel_filter_config(task.user_id, task.target_channel)
+        clone_config = dict(filter_config)
+        clone_config.update({
+            'user_id': task.user_id,
+            'source_chat_id': source_channel['channel_id'],
+            'target_chat_id': task.target_channel,
+            'skip_message_count': True
+        })
+        
+        entry = self._track_catch_up_range(key, start_id, end_id)
+        accepted = self._submit_catch_up_job(task, source_channel, key, entry, clone_config, 0)
+        if not accepted:
+            self._complete_catch_up_range(key, entry, advance=False)
+        return accepted
+    
+    def _submit_catch_up_job(self, task: RealTimeMonitoringTask, source_channel: Dict[str, Any],
+                             key: Tuple[str, str], entry: List[Any], clone_config: Dict[str, Any],
+                             attempt: int) -> bool:
+        """提交补齐范围的搬运作业；失败时保留范围，退避后重新提交"""
+        start_id, end_id = entry[0], entry[1]
+        
+        def on_complete(success: bool):
+            if success:
+                self._complete_catch_up_range(key, entry)
+                return
+            if entry not in self._catch_up_ranges.get(key, []):
+                return  # 任务已删除
+            delay = min(self.catchup_retry_delay * (2 ** attempt), self.catchup_retry_max_delay)
+            logger.warning(f"⚠️ 补齐搬运失败 {key[1]} ({start_id}-{end_id})，{delay:.0f}秒后重试")
+            retry = asyncio.create_task(
+                self._retry_catch_up_range(task, source_channel, key, entry, clone_config, attempt + 1, delay)
+            )
+            self._catch_up_retries.add(retry)
+            retry.add_done_callback(self._catch_up_retries.discard)
+        
+        return self.clone_jobs.submit(
+            task.task_id, source_channel['channel_id'], task.target_channel, start_id, end_id, clone_config,
+            on_complete=on_complete, source_username=source_channel.get('channel_username', '')
+        )
+    
+    async def _retry_catch_up_range(self, task: RealTimeMonitoringTask, source_channel: Dict[str, Any],
+                                    key: Tuple[str, str], entry: List[Any], clone_config: Dict[str, Any],
+                                    attempt: int, delay: float):
+        """等待退避时间后重新提交补齐范围；任务暂停期间继续等待，任务删除后放弃"""
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                if entry not in self._catch_up_ranges.get(key, []):
+                    return
+                current = self.active_tasks.get(task.task_id)
+                if not current or current.should_stop():
+                    continue
+                if self._submit_catch_up_job(current, source_channel, key, entry, clone_config, attempt):
+                    return
+        except asyncio.CancelledError:
+            pass
+    
     async def _transfer_message(self, task: RealTimeMonitoringTask, message: Message, 
                               source_config: Dict[str, Any]) -> bool:
         """搬运单条消息"""
@@ -2260,12 +3282,9 @@ class RealTimeMonitoringEngine:
         try:
             # 添加缓存机制，避免重复加载
             cache_key = f"{user_id}_{target_channel}"
-            if hasattr(self, '_filter_config_cache') and cache_key in self._filter_config_cache:
+            if cache_key in self._filter_config_cache:
                 return self._filter_config_cache[cache_key]
             
-            if not hasattr(self, '_filter_config_cache'):
-                self._filter_config_cache = {}
-            
             # 获取用户配置
             user_config = await data_manager.get_user_config(user_id)
             
@@ -2361,18 +3380,73 @@ class RealTimeMonitoringEngine:
             logger.error(f"❌ 获取频道过滤配置失败: {e}")
             return DEFAULT_USER_CONFIG.copy()
     
+    def _estimate_filter_config_cache_bytes(self) -> int:
+        """估算过滤配置缓存占用（供内存优化器使用）"""
+        return estimate_container_bytes(self._filter_config_cache)
+    
+    def _evict_filter_config_cache(self, fraction: float):
+        """淘汰最早加入的一部分过滤配置（供内存优化器使用）"""
+        evict_mapping(self._filter_config_cache, fraction)
+    
+    def _estimate_processed_messages_bytes(self) -> int:
+        """估算去重集合占用（供内存优化器使用）"""
+        return sum(estimate_container_bytes(ids) for ids in self.processed_messages.values())
+    
+    def _trim_processed_messages(self, fraction: float):
+        """裁剪每个频道去重集合中最旧（ID最小）的一部分（供内存优化器使用）
+        
+        只裁剪不超过订阅该频道的所有任务已落盘水位线的ID：重启补齐从水位线之后开始，
+        水位线以上的ID仍可能被补齐或轮询再次送达，必须保留。
+        """
+        subscriptions = self._get_channel_subscriptions()
+        for channel_id, message_ids in list(self.processed_messages.items()):
+            floors = [self.watermark_store.get_persisted(task.task_id, channel_id)
+                      for task, _ in subscriptions.get(channel_id, [])]
+            if not floors or None in floors:
+                continue
+            self.processed_messages[channel_id] = self._trim_ids_below(message_ids, min(floors), fraction)
+    
+    def _estimate_task_processed_ids_bytes(self) -> int:
+        """估算任务去重集合占用（供内存优化器使用）"""
+        return sum(estimate_container_bytes(ids) for task in self.active_tasks.values()
+                   for ids in task.processed_message_ids.values())
+    
+    def _trim_task_processed_ids(self, fraction: float):
+        """裁剪任务去重集合中不超过该任务已落盘水位线的最旧ID（供内存优化器使用）"""
+        for task in list(self.active_tasks.values()):
+            for channel_id, message_ids in list(task.processed_message_ids.items()):
+                floor = self.watermark_store.get_persisted(task.task_id, channel_id)
+                if floor is not None:
+                    task.processed_message_ids[channel_id] = self._trim_ids_below(message_ids, floor, fraction)
+    
+    @staticmethod
+    def _trim_ids_below(message_ids: Set[int], floor: int, fraction: float) -> Set[int]:
+        """去掉最旧的一部分ID（最多 fraction 比例），只去掉不超过 floor 的ID"""
+        drop_count = min(len(message_ids), int(len(message_ids) * fraction))
+        if not drop_count:
+            return message_ids
+        ordered = sorted(message_ids)
+        drop_count = min(drop_count, bisect.bisect_right(ordered, floor))
+        return set(ordered[drop_count:]) if drop_count else message_ids
+    
     async def _cleanup_task_resources(self, task: RealTimeMonitoringTask):
         """清理任务相关资源"""
         try:
-            # 清理消息去重缓存
+            # 清理消息去重缓存（仍被其他任务订阅的频道保留）
+            task.processed_message_ids.clear()
+            subscriptions = self._get_channel_subscriptions()
             for source_channel in task.source_channels:
-                channel_id = source_channel['channel_id']
-                if channel_id in self.processed_messages:
+                channel_id = str(source_channel['channel_id'])
+                if channel_id in self.processed_messages and not any(
+                        other is not task for other, _ in subscriptions.get(channel_id, [])):
                     self.processed_messages[channel_id].clear()
             
             # 清理批量缓存
             if task.task_id in self.message_cache:
                 del self.message_cache[task.task_id]
+            timer = self._batch_flush_timers.pop(task.task_id, None)
+            if timer and not timer.done():
+                timer.cancel()
             
             logger.info(f"🧹 任务资源清理完成: {task.task_id}")
             
@@ -2390,15 +3464,50 @@ class RealTimeMonitoringEngine:
             
             # 清理批量缓存
             self.message_cache.clear()
+            for timer in self._batch_flush_timers.values():
+                if not timer.done():
+                    timer.cancel()
+            self._batch_flush_timers.clear()
+            
+            # 停止目标频道发送工作协程
+            for worker in self.target_send_workers.values():
+                if not worker.done():
+                    worker.cancel()
+            self.target_send_workers.clear()
+            self.target_send_queues.clear()
+            self.target_send_overflow.clear()
+            self.target_send_enqueue_times.clear()
             
             # 清理消息处理器
             self.message_handlers.clear()
             
-            # 删除任务文件
-            import os
-            if os.path.exists(self.tasks_file):
-                os.remove(self.tasks_file)
-                logger.info(f"🗑️ 已删除任务文件: {self.tasks_file}")
+            # 停止轮询循环
+            if getattr(self, '_poll_task', None) and not self._poll_task.done():
+                self._poll_task.cancel()
+            self._poll_task = None
+            self.poll_scheduler.sync_channels(set())
+            
+            # 停止缺口恢复
+            for recovery_task in (self._gap_flush_task, self._reconnect_recovery_task):
+                if recovery_task and not recovery_task.done():
+                    recovery_task.cancel()
+            self._gap_flush_task = None
+            self._reconnect_recovery_task = None
+            for retry in list(self._catch_up_retries):
+                retry.cancel()
+            self._catch_up_retries.clear()
+            self._pending_gaps.clear()
+            self.channel_last_seen.clear()
+            
+            # 停止补齐作业（未完成的范围不推进水位线，重启后重新补齐）
+            await self.clone_jobs.stop()
+            self._catch_up_ranges.clear()
+            self._held_watermarks.clear()
+            
+            # 水位线和延迟队列落盘（任务文件保留，重启后据此补齐消息）
+            await self.task_store.stop_auto_flush()
+            await self.watermark_store.stop_auto_flush()
+            await self.delayed_scheduler.stop()
             
             logger.info("🧹 所有资源清理完成")
             
@@ -2444,13 +3553,20 @@ class RealTimeMonitoringEngine:
         try:
             tasks_status = []
             for task in self.active_tasks.values():
-                tasks_status.append(task.get_status_info())
+                tasks_status.append(self._get_task_status_info(task))
             
             return {
                 'is_running': self.is_running,
                 'global_stats': self.global_stats.copy(),
                 'active_tasks_count': len([t for t in self.active_tasks.values() if t.is_running]),
                 'total_tasks_count': len(self.active_tasks),
+                'poll_scheduler': self.poll_scheduler.get_stats(),
+                'delayed_queue': self.delayed_scheduler.get_stats(),
+                'send_queues': self.get_send_queue_stats(),
+                'gap_recovery': dict(self.gap_stats, pending=sum(len(ids) for ids in self._pending_gaps.values())),
+                'shards': self.shard_coordinator.get_status() if self.shard_coordinator else None,
+                'latency': self.get_latency_stats(),
+                'resources': self.resource_tracker.get_snapshot(self.active_tasks.keys()),
                 'tasks': tasks_status
             }
             
@@ -2462,9 +3578,28 @@ class RealTimeMonitoringEngine:
         """获取指定任务状态"""
         task = self.active_tasks.get(task_id)
         if task:
-            return task.get_status_info()
+            return self._get_task_status_info(task)
         return None
     
+    def _get_task_status_info(self, task: RealTimeMonitoringTask) -> Dict[str, Any]:
+        """任务状态信息；分片模式下合并各分片上报的统计"""
+        info = task.get_status_info()
+        if not self.shard_coordinator:
+            return info
+        
+        shard_stats = self.shard_coordinator.get_task_stats(task.task_id)
+        for key, value in shard_stats.items():
+            if key != 'source_channel_stats' and isinstance(info['stats'].get(key, 0), (int, float)):
+                info['stats'][key] = info['stats'].get(key, 0) + value
+        for channel_id, channel_stats in shard_stats.get('source_channel_stats', {}).items():
+            source_stats = info['source_stats'].get(channel_id)
+            if source_stats is None:
+                continue
+            for key, value in channel_stats.items():
+                if key in source_stats:
+                    source_stats[key] += value
+        return info
+    
     def get_active_tasks(self) -> Dict[str, Any]:
         """获取所有活跃任务"""
         return self.active_tasks
@@ -2475,7 +3610,7 @@ class RealTimeMonitoringEngine:
             user_tasks = []
             for task in self.active_tasks.values():
                 if task.user_id == user_id:
-                    user_tasks.append(task.get_status_info())
+                    user_tasks.append(self._get_task_status_info(task))
             
             return user_tasks
             
@@ -2486,25 +3621,15 @@ class RealTimeMonitoringEngine:
     async def _delete_monitoring_task(self, task_id: str):
         """从数据库删除监听任务"""
         try:
-            # 从本地文件删除任务
-            if os.path.exists(self.tasks_file):
-                try:
-                    with open(self.tasks_file, 'r', encoding='utf-8') as f:
-                        tasks_data = json.load(f)
-                    
-                    # 删除指定任务
-                    if task_id in tasks_data:
-                        del tasks_data[task_id]
-                        
-                        with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                            json.dump(tasks_data, f, ensure_ascii=False, indent=2)
-                        
-                        logger.info(f"✅ 任务已从本地文件删除: {task_id}")
-                    else:
-                        logger.warning(f"⚠️ 任务不在本地文件中: {task_id}")
-                        
-                except Exception as e:
-                    logger.error(f"❌ 从本地文件删除任务失败: {e}")
+            # 从本地文件删除任务（任务已从活动列表移除，按当前任务重写定义并删除统计）
+            try:
+                if self.task_store.save_definitions(self._build_task_definitions()):
+                    logger.info(f"✅ 任务已从本地文件删除: {task_id}")
+                else:
+                    logger.warning(f"⚠️ 任务不在本地文件中: {task_id}")
+                self.task_store.remove_task(task_id)
+            except Exception as e:
+                logger.error(f"❌ 从本地文件删除任务失败: {e}")
             
             # 从用户配置中删除任务
             try:
@@ -0,0 +1,333 @@
+# ==================== 分片监听 ====================
+"""
+分片监听
+可选的多进程监听模式：按源频道的一致性哈希把频道分配到N个工作进程，
+每个工作进程使用运维提供的独立会话（session_string 或 bot_token）运行自己的实时监听引擎；
+主进程中的实时监听引擎作为协调器，持有任务定义并汇总各分片统计。
+机器人会话不能读取频道历史，使用 bot_token 的分片只处理实时更新，不轮询、不补齐缺口。
+未配置分片会话时保持单进程模式。
+"""
+
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import queue
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+class ConsistentHashRing:
+    """一致性哈希环（带虚拟节点）"""
+    
+    def __init__(self, nodes: List[int], replicas: int = 100):
+        """初始化哈希环
+        
+        Args:
+            nodes: 节点编号列表
+            replicas: 每个节点的虚拟节点数
+        """
+        self._ring: List[int] = []
+        self._owners: Dict[int, int] = {}
+        for node in nodes:
+            for replica in range(replicas):
+                point = self._hash(f"{node}:{replica}")
+                self._owners[point] = node
+                self._ring.append(point)
+        self._ring.sort()
+    
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+    
+    def get_node(self, key: str) -> int:
+        """获取键所属的节点"""
+        index = bisect.bisect(self._ring, self._hash(str(key))) % len(self._ring)
+        return self._owners[self._ring[index]]
+
+def run_shard_worker(shard_index: int, session: Dict[str, Any], config: Dict[str, Any],
+                     command_queue, result_queue):
+    """分片工作进程入口"""
+    try:
+        asyncio.run(_shard_worker(shard_index, session, config, command_queue, result_queue))
+    except KeyboardInterrupt:
+        pass
+
+async def _shard_worker(shard_index: int, session: Dict[str, Any], config: Dict[str, Any],
+                        command_queue, result_queue):
+    """分片工作进程：运行独立的客户端和实时监听引擎，按协调器下发的任务定义监听"""
+    from pyrogram import Client
+    from cloning_engine import create_cloning_engine
+    from monitoring_engine import RealTimeMonitoringEngine, RealTimeMonitoringTask
+    
+    client = Client(
+        name=f"monitor_shard_{shard_index}",
+        api_id=config.get('api_id'),
+        api_hash=config.get('api_hash'),
+        session_string=session.get('session_string'),
+        bot_token=session.get('bot_token'),
+        in_memory=True
+    )
+    await client.start()
+    logger.info(f"✅ 分片 {shard_index} 客户端已启动")
+    
+    cloning_engine = create_cloning_engine(client, config, bot_id=config.get('bot_id', 'default_bot'))
+    engine = RealTimeMonitoringEngine(client, cloning_engine, config)
+    loop = asyncio.get_running_loop()
+    
+    try:
+        while True:
+            command = await loop.run_in_executor(None, command_queue.get)
+            action = command[0]
+            
+            if action == 'sync':
+                await _apply_task_definitions(engine, command[1], RealTimeMonitoringTask)
+            elif action == 'status':
+                status = engine.get_monitoring_status()
+                result_queue.put((shard_index, {
+                    'global_stats': {k: v for k, v in status.get('global_stats', {}).items()
+                                     if isinstance(v, (int, float))},
+                    'active_tasks_count': status.get('active_tasks_count', 0),
+                    'gap_recovery': status.get('gap_recovery', {}),
+                    'task_stats': {
+                        task_id: _numeric_task_stats(task.stats)
+                        for task_id, task in engine.active_tasks.items()
+                    },
+                    'updated_at': time.time()
+                }))
+            elif action == 'stop':
+                break
+    finally:
+        if engine.is_running:
+            await engine.stop_monitoring()
+        await client.stop()
+        logger.info(f"✅ 分片 {shard_index} 已停止")
+
+def _numeric_task_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """任务统计中可以跨分片累加的部分（数值字段和按源频道的计数）"""
+    result: Dict[str, Any] = {k: v for k, v in stats.items() if isinstance(v, (int, float))}
+    result['source_channel_stats'] = {
+        str(channel_id): {k: v for k, v in channel_stats.items() if isinstance(v, (int, float))}
+        for channel_id, channel_stats in stats.get('source_channel_stats', {}).items()
+    }
+    return result
+
+async def _apply_task_definitions(engine, definitions: Dict[str, Dict[str, Any]], task_class):
+    """使分片引擎的任务与协调器下发的定义一致"""
+    # 移除不再属于本分片或源频道已变化的任务（只停止本地处理，任务定义由协调器维护）
+    for task_id, task in list(engine.active_tasks.items()):
+        definition = definitions.get(task_id)
+        if definition and definition['source_channels'] == task.source_channels:
+            continue
+        if task.is_running:
+            await engine._unregister_message_handlers(task)
+            engine.global_stats['active_tasks'] -= 1
+        task.status = "stopped"
+        task.is_running = False
+        await engine._cleanup_task_resources(task)
+        engine.delayed_scheduler.remove_task(task_id)
+        del engine.active_tasks[task_id]
+    
+    for task_id, definition in definitions.items():
+        if task_id not in engine.active_tasks:
+            engine.active_tasks[task_id] = task_class(
+                task_id=task_id,
+                user_id=definition['user_id'],
+                target_channel=definition['target_channel'],
+                source_channels=definition['source_channels'],
+                config=definition['config']
+            )
+    
+    engine._save_tasks()
+    if not engine.is_running:
+        await engine.start_monitoring()
+    else:
+        for task in list(engine.active_tasks.values()):
+            if not task.is_running:
+                await engine.start_monitoring_task(task.task_id)
+
+class ShardedMonitoringCoordinator:
+    """分片监听协调器类"""
+    
+    def __init__(self, config: Dict[str, Any], sessions: List[Dict[str, Any]],
+                 task_provider: Callable[[], List[Any]]):
+        """初始化协调器
+        
+        Args:
+            config: 监听配置（传给各分片进程）
+            sessions: 每个分片的会话配置，含 session_string 或 bot_token
+            task_provider: 返回协调器当前持有的实时监听任务列表
+        """
+        self.config = config
+        self.sessions = sessions
+        self.task_provider = task_provider
+        self.num_shards = len(sessions)
+        self.status_interval = config.get('monitoring_shard_status_interval', 10)
+        
+        self.ring = ConsistentHashRing(list(range(self.num_shards)))
+        self._ctx = multiprocessing.get_context('spawn')
+        self._processes: Dict[int, Any] = {}
+        self._command_queues: Dict[int, Any] = {}
+        self._result_queue = None
+        self._last_definitions: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self._shard_status: Dict[int, Dict[str, Any]] = {}
+        self._sync_task: Optional[asyncio.Task] = None
+        self._status_task: Optional[asyncio.Task] = None
+    
+    def get_shard(self, channel_id) -> int:
+        """获取源频道所属分片"""
+        return self.ring.get_node(str(channel_id))
+    
+    def start(self):
+        """启动所有分片进程"""
+        self._result_queue = self._ctx.Queue()
+        for shard_index in range(self.num_shards):
+            self._start_shard(shard_index)
+        self._status_task = asyncio.create_task(self._status_loop())
+        logger.info(f"🚀 分片监听已启动: {self.num_shards} 个工作进程")
+    
+    def _start_shard(self, shard_index: int):
+        """启动（或重启）单个分片进程"""
+        shard_config = dict(self.config)
+        shard_config['bot_id'] = f"{self.config.get('bot_id', 'default_bot')}/shard_{shard_index}"
+        shard_config['monitoring_shard_sessions'] = []  # 分片进程内使用单进程模式
+        
+        # 机器人会话不能调用 get_chat_history，关闭轮询和缺口补齐
+        session = self.sessions[shard_index]
+        if session.get('bot_token') and not session.get('session_string'):
+            shard_config['monitoring_history_enabled'] = False
+            logger.warning(f"⚠️ 分片 {shard_index} 使用机器人会话，只处理实时更新，不轮询、不补齐缺口")
+        
+        command_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=run_shard_worker,
+            args=(shard_index, session, shard_config, command_queue, self._result_queue),
+            name=f"monitor_shard_{shard_index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[shard_index] = process
+        self._command_queues[shard_index] = command_queue
+        
+        # 重启的分片恢复上次下发的任务定义
+        if shard_index in self._last_definitions:
+            command_queue.put(('sync', self._last_definitions[shard_index]))
+    
+    def request_sync(self):
+        """任务变化后请求同步（合并同一轮事件循环内的多次变化）"""
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync_soon())
+    
+    async def _sync_soon(self):
+        await asyncio.sleep(0)
+        self.sync_tasks()
+    
+    def sync_tasks(self):
+        """按源频道哈希拆分运行中的任务，下发给各分片"""
+        definitions: Dict[int, Dict[str, Dict[str, Any]]] = {i: {} for i in range(self.num_shards)}
+        for task in self.task_provider():
+            if task.status != "active" or not task.is_running:
+                continue
+            for source_channel in task.source_channels:
+                shard_index = self.get_shard(source_channel['channel_id'])
+                definition = definitions[shard_index].setdefault(task.task_id, {
+                    'user_id': task.user_id,
+                    'target_channel': task.target_channel,
+                    'source_channels': [],
+                    'config': task.config
+                })
+                definition['source_channels'].append(source_channel)
+        
+        for shard_index, shard_definitions in definitions.items():
+            if self._last_definitions.get(shard_index) == shard_definitions:
+                continue
+            self._last_definitions[shard_index] = shard_definitions
+            self._command_queues[shard_index].put(('sync', shard_definitions))
+    
+    async def _status_loop(self):
+        """定期收集分片统计，并重启意外退出的分片"""
+        while True:
+            try:
+                for shard_index, process in list(self._processes.items()):
+                    if not process.is_alive():
+                        logger.warning(f"⚠️ 分片 {shard_index} 进程已退出，正在重启")
+                        self._start_shard(shard_index)
+                    self._command_queues[shard_index].put(('status',))
+                
+                await asyncio.sleep(self.status_interval)
+                self._drain_results()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 收集分片统计失败: {e}")
+                await asyncio.sleep(self.status_interval)
+    
+    def _drain_results(self):
+        """读取分片回报的统计"""
+        while True:
+            try:
+                shard_index, status = self._result_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._shard_status[shard_index] = status
+    
+    async def stop(self, timeout: float = 10.0):
+        """停止所有分片进程"""
+        for task in (self._status_task, self._sync_task):
+            if task and not task.done():
+                task.cancel()
+        
+        for command_queue in self._command_queues.values():
+            command_queue.put(('stop',))
+        
+        loop = asyncio.get_running_loop()
+        for shard_index, process in self._processes.items():
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"⚠️ 分片 {shard_index} 未能正常退出，强制终止")
+                process.terminate()
+        
+        self._processes.clear()
+        self._command_queues.clear()
+        logger.info("✅ 分片监听已停止")
+    
+    def get_task_stats(self, task_id: str) -> Dict[str, Any]:
+        """汇总任务在各分片上的统计（source_channel_stats 按源频道分别累加）"""
+        totals: Dict[str, Any] = {'source_channel_stats': {}}
+        for status in self._shard_status.values():
+            for key, value in status.get('task_stats', {}).get(task_id, {}).items():
+                if key == 'source_channel_stats':
+                    for channel_id, channel_stats in value.items():
+                        channel_totals = totals['source_channel_stats'].setdefault(channel_id, {})
+                        for stat_key, stat_value in channel_stats.items():
+                            channel_totals[stat_key] = channel_totals.get(stat_key, 0) + stat_value
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取分片汇总状态"""
+        global_stats: Dict[str, Any] = {}
+        shards = {}
+        for shard_index in range(self.num_shards):
+            process = self._processes.get(shard_index)
+            status = self._shard_status.get(shard_index, {})
+            for key, value in status.get('global_stats', {}).items():
+                global_stats[key] = global_stats.get(key, 0) + value
+            shards[shard_index] = {
+                'alive': bool(process and process.is_alive()),
+                'tasks': len(self._last_definitions.get(shard_index, {})),
+                'channels': sum(len(d['source_channels']) for d in self._last_definitions.get(shard_index, {}).values()),
+                'active_tasks_count': status.get('active_tasks_count', 0),
+                'gap_recovery': status.get('gap_recovery', {}),
+                'updated_at': status.get('updated_at')
+            }
+        
+        return {
+            'num_shards': self.num_shards,
+            'alive_shards': sum(1 for shard in shards.values() if shard['alive']),
+            'global_stats': global_stats,
+            'shards': shards
+        }
@@ -0,0 +1,284 @@
+# ==================== 监听任务存储 ====================
+"""
+监听任务存储
+任务定义与统计分开持久化：
+- 任务定义（monitoring_tasks.json）只在内容变化时以临时文件 + 原子替换写入；
+- 统计（计数器）以增量形式追加到 monitoring_task_stats.log，
+  超过阈值后压缩为快照 monitoring_task_stats.json 并清空日志。
+保存开销与变化量成正比，而不是任务数乘以统计大小。
+序列化在调用方完成，磁盘写入（含fsync）按提交顺序在单独的IO线程中执行，不阻塞事件循环。
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# 统计中以ISO字符串保存的时间字段
+DATETIME_STAT_KEYS = {'last_message_time', 'start_time'}
+
+def _write_text_atomic(file_path: str, text: str):
+    """临时文件 + 原子替换写入文本"""
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def flatten_stats(stats: Dict[str, Any], prefix: str = '') -> Dict[str, Any]:
+    """把嵌套统计展开为 'a/b/c' -> 值（时间转为ISO字符串）"""
+    flat: Dict[str, Any] = {}
+    for key, value in stats.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_stats(value, f"{path}/"))
+        elif isinstance(value, datetime):
+            flat[path] = value.isoformat()
+        else:
+            flat[path] = value
+    return flat
+
+def unflatten_stats(flat: Dict[str, Any]) -> Dict[str, Any]:
+    """把展开的统计还原为嵌套字典"""
+    stats: Dict[str, Any] = {}
+    for path, value in flat.items():
+        parts = path.split('/')
+        node = stats
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        if parts[-1] in DATETIME_STAT_KEYS and isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        node[parts[-1]] = value
+    return stats
+
+class MonitoringTaskStore:
+    """监听任务存储类"""
+    
+    def __init__(self, bot_id: str = "default_bot", compact_threshold: int = 1000,
+                 flush_interval: float = 30.0):
+        """初始化任务存储
+        
+        Args:
+            bot_id: 机器人ID，用于数据分离
+            compact_threshold: 统计日志超过该行数时压缩为快照
+            flush_interval: 统计自动落盘间隔（秒）
+        """
+        directory = f"data/{bot_id}"
+        self.definitions_file = f"{directory}/monitoring_tasks.json"
+        self.stats_snapshot_file = f"{directory}/monitoring_task_stats.json"
+        self.stats_log_file = f"{directory}/monitoring_task_stats.log"
+        self.compact_threshold = compact_threshold
+        self.flush_interval = flush_interval
+        
+        self._last_definitions_json: Optional[str] = None
+        # task_id -> 已落盘的展开统计
+        self._persisted_stats: Dict[str, Dict[str, Any]] = {}
+        self._log_lines = 0
+        # 快照代数：日志首行记录所属代数（包括0代），压缩中途崩溃时旧日志不会被重复回放
+        self._generation = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        # 单线程IO执行器：写入按提交顺序执行
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"monitoring-task-store-{bot_id}")
+    
+    def _submit(self, operation, *args) -> Future:
+        """把磁盘写入交给IO线程"""
+        future = self._io.submit(operation, *args)
+        future.add_done_callback(self._log_write_error)
+        return future
+    
+    @staticmethod
+    def _log_write_error(future: Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"❌ 监听任务存储写入失败: {future.exception()}")
+    
+    async def drain(self):
+        """等待已提交的磁盘写入完成"""
+        await asyncio.wrap_future(self._submit(lambda: None))
+    
+    # ==================== 任务定义 ====================
+    
+    def load_definitions(self) -> Dict[str, Dict[str, Any]]:
+        """加载任务定义"""
+        if not os.path.exists(self.definitions_file):
+            return {}
+        with open(self.definitions_file, 'r', encoding='utf-8') as f:
+            definitions = json.load(f)
+        self._last_definitions_json = json.dumps(definitions, ensure_ascii=False, sort_keys=True)
+        return definitions
+    
+    def save_definitions(self, definitions: Dict[str, Dict[str, Any]]) -> bool:
+        """保存任务定义（内容未变化时跳过），返回是否实际写入"""
+        serialized = json.dumps(definitions, ensure_ascii=False, sort_keys=True)
+        if serialized == self._last_definitions_json:
+            return False
+        self._submit(_write_text_atomic, self.definitions_file,
+                     json.dumps(definitions, ensure_ascii=False, indent=2))
+        self._last_definitions_json = serialized
+        return True
+    
+    # ==================== 统计 ====================
+    
+    def load_stats(self) -> Dict[str, Dict[str, Any]]:
+        """加载统计：快照 + 回放增量日志"""
+        flat_stats: Dict[str, Dict[str, Any]] = {}
+        self._generation = 0
+        
+        if os.path.exists(self.stats_snapshot_file):
+            with open(self.stats_snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self._generation = snapshot.get('generation', 0)
+            flat_stats = snapshot.get('stats', {})
+        
+        self._log_lines = 0
+        if os.path.exists(self.stats_log_file):
+            with open(self.stats_log_file, 'r', encoding='utf-8') as f:
+                first = True
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时可能留下不完整的最后一行
+                        logger.warning("⚠️ 跳过损坏的监听统计日志行")
+                        continue
+                    if first and 'g' not in entry and self._generation > 0:
+                        # 没有代数首行的旧版本0代日志：快照已压缩过，内容已包含在快照中
+                        break
+                    first = False
+                    if 'g' in entry:
+                        if entry['g'] != self._generation:
+                            # 压缩后未及重写的旧日志，内容已包含在快照中
+                            break
+                        continue
+                    self._apply_entry(flat_stats, entry)
+                    self._log_lines += 1
+        
+        self._persisted_stats = {task_id: dict(flat) for task_id, flat in flat_stats.items()}
+        return {task_id: unflatten_stats(flat) for task_id, flat in flat_stats.items()}
+    
+    @staticmethod
+    def _apply_entry(flat_stats: Dict[str, Dict[str, Any]], entry: Dict[str, Any]):
+        """回放一条日志：d为计数器增量，s为直接赋值，r为删除任务"""
+        task_id = entry.get('t')
+        if entry.get('r'):
+            flat_stats.pop(task_id, None)
+            return
+        flat = flat_stats.setdefault(task_id, {})
+        for path, delta in entry.get('d', {}).items():
+            flat[path] = flat.get(path, 0) + delta
+        flat.update(entry.get('s', {}))
+    
+    def save_stats(self, stats_by_task: Dict[str, Dict[str, Any]]) -> int:
+        """追加统计增量，返回写入的日志行数"""
+        lines = []
+        for task_id, stats in stats_by_task.items():
+            flat = flatten_stats(stats)
+            previous = self._persisted_stats.get(task_id, {})
+            
+            deltas: Dict[str, Any] = {}
+            sets: Dict[str, Any] = {}
+            for path, value in flat.items():
+                old_value = previous.get(path)
+                if value == old_value:
+                    continue
+                if (isinstance(value, (int, float)) and not isinstance(value, bool)
+                        and isinstance(old_value, (int, float)) and not isinstance(old_value, bool)):
+                    deltas[path] = value - old_value
+                else:
+                    sets[path] = value
+            
+            if deltas or sets:
+                entry: Dict[str, Any] = {'t': task_id}
+                if deltas:
+                    entry['d'] = deltas
+                if sets:
+                    entry['s'] = sets
+                lines.append(json.dumps(entry, ensure_ascii=False, separators=(',', ':')))
+                self._persisted_stats[task_id] = flat
+        
+        if lines:
+            self._append_log(lines)
+        if self._log_lines >= self.compact_threshold:
+            self.compact()
+        return len(lines)
+    
+    def remove_task(self, task_id: str):
+        """删除任务统计"""
+        if self._persisted_stats.pop(task_id, None) is not None:
+            self._append_log([json.dumps({'t': task_id, 'r': 1}, separators=(',', ':'))])
+    
+    def _append_log(self, lines: List[str]):
+        self._submit(self._write_log_lines, lines, self._generation)
+        self._log_lines += len(lines)
+    
+    def _write_log_lines(self, lines: List[str], generation: int):
+        """追加日志行（在IO线程中执行）；新日志文件总是以代数首行开头（包括0代）"""
+        os.makedirs(os.path.dirname(self.stats_log_file), exist_ok=True)
+        if not os.path.exists(self.stats_log_file):
+            lines = [json.dumps({'g': generation})] + lines
+        with open(self.stats_log_file, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _write_compacted(self, snapshot_text: str, generation: int):
+        """写入快照并以新代数的首行重写日志（在IO线程中执行）"""
+        _write_text_atomic(self.stats_snapshot_file, snapshot_text)
+        # 快照已包含日志中的全部内容
+        _write_text_atomic(self.stats_log_file, json.dumps({'g': generation}) + '\n')
+    
+    def compact(self):
+        """把当前统计写为快照并清空增量日志"""
+        generation = self._generation + 1
+        snapshot_text = json.dumps({'generation': generation, 'stats': self._persisted_stats},
+                                   ensure_ascii=False, separators=(',', ':'))
+        self._submit(self._write_compacted, snapshot_text, generation)
+        self._generation = generation
+        self._log_lines = 0
+        logger.debug("🗜️ 监听统计日志已压缩")
+    
+    def start_auto_flush(self, stats_provider: Callable[[], Dict[str, Dict[str, Any]]]):
+        """启动统计定期落盘"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._auto_flush_loop(stats_provider))
+    
+    async def stop_auto_flush(self):
+        """停止统计定期落盘，并等待已提交的写入完成"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        await self.drain()
+    
+    async def _auto_flush_loop(self, stats_provider: Callable[[], Dict[str, Dict[str, Any]]]):
+        """统计定期落盘循环"""
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                self.save_stats(stats_provider())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 监听统计定期落盘失败: {e}")
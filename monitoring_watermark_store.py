@@ -0,0 +1,135 @@
+# ==================== 监听水位线存储 ====================
+"""
+监听水位线存储
+按 (监听任务, 源频道) 记录已处理到的最后消息ID，批量落盘到本地文件，
+用于重启后补齐停机期间错过的消息
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from typing import Dict, Optional
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+class MonitoringWatermarkStore:
+    """监听水位线存储类"""
+    
+    def __init__(self, bot_id: str = "default_bot", flush_interval: float = 10.0):
+        """初始化水位线存储
+        
+        Args:
+            bot_id: 机器人ID，用于数据分离
+            flush_interval: 自动落盘间隔（秒）
+        """
+        self.file_path = f"data/{bot_id}/monitoring_watermarks.json"
+        self.flush_interval = flush_interval
+        
+        # task_id -> channel_id -> last_message_id
+        self._watermarks: Dict[str, Dict[str, int]] = {}
+        # 最近一次成功落盘的水位线（重启后能恢复到的位置）
+        self._persisted: Dict[str, Dict[str, int]] = {}
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        
+        self._load()
+    
+    def _load(self):
+        """从文件加载水位线"""
+        try:
+            if not os.path.exists(self.file_path):
+                return
+            
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            for task_id, channels in data.items():
+                self._watermarks[task_id] = {str(k): int(v) for k, v in channels.items()}
+            self._persisted = {task_id: dict(channels) for task_id, channels in self._watermarks.items()}
+            
+            logger.info(f"✅ 监听水位线已加载: {len(self._watermarks)} 个任务")
+        
+        except Exception as e:
+            logger.error(f"❌ 加载监听水位线失败: {e}")
+    
+    def get(self, task_id: str, channel_id: str) -> Optional[int]:
+        """获取水位线"""
+        return self._watermarks.get(task_id, {}).get(str(channel_id))
+    
+    def get_persisted(self, task_id: str, channel_id: str) -> Optional[int]:
+        """获取已落盘的水位线"""
+        return self._persisted.get(task_id, {}).get(str(channel_id))
+    
+    def get_task_watermarks(self, task_id: str) -> Dict[str, int]:
+        """获取任务所有源频道的水位线"""
+        return dict(self._watermarks.get(task_id, {}))
+    
+    def advance(self, task_id: str, channel_id: str, message_id: int):
+        """推进水位线（只增不减），标记为待落盘"""
+        channels = self._watermarks.setdefault(task_id, {})
+        channel_id = str(channel_id)
+        if message_id > channels.get(channel_id, 0):
+            channels[channel_id] = message_id
+            self._dirty = True
+    
+    def remove_task(self, task_id: str):
+        """删除任务的所有水位线"""
+        self._persisted.pop(task_id, None)
+        if self._watermarks.pop(task_id, None) is not None:
+            self._dirty = True
+    
+    def flush(self) -> bool:
+        """落盘（仅在有变化时写入，临时文件 + 原子替换）"""
+        if not self._dirty:
+            return True
+        
+        try:
+            directory = os.path.dirname(self.file_path)
+            os.makedirs(directory, exist_ok=True)
+            
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._watermarks, f, separators=(',', ':'))
+                os.replace(temp_path, self.file_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+            
+            self._dirty = False
+            self._persisted = {task_id: dict(channels) for task_id, channels in self._watermarks.items()}
+            return True
+        
+        except Exception as e:
+            logger.error(f"❌ 保存监听水位线失败: {e}")
+            return False
+    
+    def start_auto_flush(self):
+        """启动定期落盘"""
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._auto_flush_loop())
+    
+    async def stop_auto_flush(self):
+        """停止定期落盘并立即落盘一次"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+        self.flush()
+    
+    async def _auto_flush_loop(self):
+        """定期落盘循环"""
+        while True:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ 监听水位线定期落盘失败: {e}")
@@ -196,6 +196,7 @@ class MultiBotConfigManager:
                 "api_hash": api_hash_str,
                 "firebase_project_id": os.getenv(f"{bot_prefix}FIREBASE_PROJECT_ID") or os.getenv('FIREBASE_PROJECT_ID'),
                 "use_local_storage": os.getenv(f"{bot_prefix}USE_LOCAL_STORAGE", "false").lower() == "true",
+                "local_storage_engine": (os.getenv(f"{bot_prefix}LOCAL_STORAGE_ENGINE") or os.getenv('LOCAL_STORAGE_ENGINE', 'json')).lower(),
                 "is_render": True,
                 "port": int(os.getenv('PORT', 8080)),
                 "session_name": f"render_bot_session_{actual_bot_name}",
@@ -277,6 +278,7 @@ class MultiBotConfigManager:
                 "api_hash": api_hash_str,
                 "firebase_project_id": os.getenv('FIREBASE_PROJECT_ID'),
                 "use_local_storage": os.getenv('USE_LOCAL_STORAGE', 'false').lower() == 'true',
+                "local_storage_engine": os.getenv('LOCAL_STORAGE_ENGINE', 'json').lower(),
                 "is_render": False,
                 "port": int(os.getenv('PORT', 8080)),
                 "session_name": f"bot_session_{bot_name}",
@@ -306,6 +308,7 @@ def create_bot_config_template(bot_name: str) -> Dict[str, Any]:
         "api_hash": "your_api_hash",
         "firebase_project_id": "your_project_id",
         "use_local_storage": True,
+        "local_storage_engine": "json",
         "is_render": False,
         "port": 8080,
         "session_name": f"bot_session_{bot_name}",
@@ -330,6 +333,9 @@ FIREBASE_PROJECT_ID=your_project_id
 # 存储模式 (true=本地存储, false=Firebase存储)
 USE_LOCAL_STORAGE=true
 
+# 本地存储引擎 (json=每用户一个JSON文件, sqlite=SQLite数据库)
+LOCAL_STORAGE_ENGINE=json
+
 # 端口配置
 PORT=8080
 
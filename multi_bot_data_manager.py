@@ -5,6 +5,7 @@
 支持按机器人ID分离数据存储
 """
 
+import copy
 import logging
 from datetime import datetime
 from typing import Dict, Any, List, Optional
@@ -14,6 +15,8 @@ from firebase_admin import credentials, firestore
 from config import DEFAULT_USER_CONFIG
 from firebase_batch_storage import get_global_batch_storage, batch_set, batch_update, batch_delete
 from optimized_firebase_manager import get_global_optimized_manager, get_doc, set_doc, update_doc, delete_doc
+from firestore_executor import run_firestore
+from field_patch import apply_field_updates, build_merge_patch
 
 logger = logging.getLogger(__name__)
 
@@ -180,7 +183,9 @@ class MultiBotDataManager:
         try:
             # 优先使用优化的Firebase管理器
             if self.optimized_manager:
-                user_data = await self.optimized_manager.get_document('users', str(user_id))
+                # 配置读取允许短暂返回旧值（后台刷新），避免过期时阻塞在Firebase读取上
+                user_data = await self.optimized_manager.get_document(
+                    'users', str(user_id), stale_while_revalidate=True)
                 if user_data:
                     config = user_data.get('config', {})
                     # 合并默认配置和用户配置
@@ -194,7 +199,7 @@ class MultiBotDataManager:
             else:
                 # 回退到标准Firebase操作
                 doc_ref = self._get_user_doc_ref(user_id)
-                doc = doc_ref.get()
+                doc = await run_firestore('users.get', doc_ref.get)
                 
                 if doc.exists:
                     user_data = doc.to_dict()
@@ -255,7 +260,7 @@ class MultiBotDataManager:
                     
                     # 获取现有配置
                     doc_ref = self._get_user_doc_ref(user_id)
-                    existing_doc = doc_ref.get()
+                    existing_doc = await run_firestore('users.get', doc_ref.get)
                     
                     if existing_doc.exists:
                         existing_data = existing_doc.to_dict()
@@ -279,16 +284,16 @@ class MultiBotDataManager:
                     doc_ref = self._get_user_doc_ref(user_id)
                 
                 # 获取现有配置
-                existing_doc = doc_ref.get()
+                existing_doc = await run_firestore('users.get', doc_ref.get)
                 if existing_doc.exists:
                     existing_data = existing_doc.to_dict()
                     # 完全替换config字段，而不是合并
                     existing_data['config'] = config
                     existing_data['updated_at'] = datetime.now().isoformat()
-                    doc_ref.set(existing_data)
+                    await run_firestore('users.set', doc_ref.set, existing_data)
                 else:
                     # 新用户，直接设置
-                    doc_ref.set({
+                    await run_firestore('users.set', doc_ref.set, {
                         'config': config,
                         'bot_id': self.bot_id,
                         'created_at': datetime.now().isoformat(),
@@ -308,6 +313,50 @@ class MultiBotDataManager:
         """创建新用户配置"""
         return await self.save_user_config(user_id, DEFAULT_USER_CONFIG.copy())
     
+    async def update_user_fields(self, user_id: str, updates: Dict[str, Any]) -> bool:
+        """按字段路径更新用户文档，不读取现有文档
+        
+        Args:
+            user_id: 用户ID
+            updates: {字段路径: 值}，如 {"config.tail_text": "..."}；值为 DELETE_FIELD 时删除字段
+        """
+        if not updates:
+            return True
+        
+        updates = dict(updates)
+        updates['updated_at'] = datetime.now().isoformat()
+        
+        if not self.initialized:
+            logger.warning(f"Firebase未初始化，尝试使用本地存储: {user_id}")
+            return await self._patch_local_storage(user_id, updates)
+        
+        try:
+            # 优先使用优化的Firebase管理器（与 get_user_config / save_user_config 使用同一文档）
+            if self.optimized_manager:
+                success = await self.optimized_manager.patch_document('users', str(user_id), updates)
+                if success:
+                    logger.debug(f"用户字段更新成功: {user_id} {list(updates)} (Bot: {self.bot_id})")
+                else:
+                    logger.error(f"用户字段更新失败: {user_id} (Bot: {self.bot_id})")
+                return success
+            
+            # 回退到标准Firebase操作：set(merge=字段路径) 只写入列出的字段，文档不存在时也能写入
+            data, merge_paths = build_merge_patch(updates, firestore.DELETE_FIELD)
+            if self.use_batch_storage:
+                collection = f"bots/{self.bot_id}/users"
+                await batch_set(collection, str(user_id), data, self.bot_id, merge=merge_paths)
+                logger.debug(f"用户字段更新已加入批量存储队列: {user_id} (Bot: {self.bot_id})")
+            else:
+                doc_ref = self._get_user_doc_ref(user_id)
+                await run_firestore('users.patch', doc_ref.set, data, merge=merge_paths)
+                logger.debug(f"用户字段更新成功: {user_id} (Bot: {self.bot_id})")
+            return True
+        
+        except Exception as e:
+            logger.error(f"更新用户字段失败 {user_id}: {e}")
+            logger.warning(f"Firebase更新失败，尝试使用本地存储: {user_id}")
+            return await self._patch_local_storage(user_id, updates)
+    
     async def get_channel_pairs(self, user_id: str) -> List[Dict[str, Any]]:
         """获取用户的频道组列表"""
         if not self.initialized:
@@ -333,7 +382,7 @@ class MultiBotDataManager:
                 return []
             
             doc_ref = self._get_user_doc_ref(user_id)
-            doc = doc_ref.get()
+            doc = await run_firestore('users.get', doc_ref.get)
             
             if doc.exists:
                 user_data = doc.to_dict()
@@ -358,7 +407,7 @@ class MultiBotDataManager:
                 
                 # 获取现有数据
                 doc_ref = self._get_user_doc_ref(user_id)
-                existing_doc = doc_ref.get()
+                existing_doc = await run_firestore('users.get', doc_ref.get)
                 
                 if existing_doc.exists:
                     existing_data = existing_doc.to_dict()
@@ -380,7 +429,7 @@ class MultiBotDataManager:
             else:
                 # 实时存储
                 doc_ref = self._get_user_doc_ref(user_id)
-                doc_ref.set({
+                await run_firestore('users.set', doc_ref.set, {
                     'channel_pairs': channel_pairs,
                     'bot_id': self.bot_id,
                     'updated_at': datetime.now().isoformat()
@@ -559,7 +608,7 @@ class MultiBotDataManager:
             
             # 回退到标准Firebase连接
             users_ref = self.db.collection('bots').document(self.bot_id).collection('users')
-            docs = users_ref.stream()
+            docs = await run_firestore('users.stream', lambda: list(users_ref.stream()))
             return [doc.id for doc in docs]
         except Exception as e:
             logger.error(f"获取用户列表失败: {e}")
@@ -576,7 +625,7 @@ class MultiBotDataManager:
             
             # 获取旧结构中的所有用户
             old_users_ref = old_data_manager.db.collection('users')
-            old_docs = old_users_ref.stream()
+            old_docs = await run_firestore('users.stream', lambda: list(old_users_ref.stream()))
             
             migrated_count = 0
             for doc in old_docs:
@@ -618,7 +667,8 @@ class MultiBotDataManager:
                 await self.optimized_manager.get_document('health', 'test')
             else:
                 # 回退到标准Firebase连接
-                self.db.collection('bots').document(self.bot_id).collection('health').document('test').get()
+                health_ref = self.db.collection('bots').document(self.bot_id).collection('health').document('test')
+                await run_firestore('health.get', health_ref.get)
             
             return {
                 'status': 'healthy',
@@ -655,7 +705,7 @@ class MultiBotDataManager:
                 if self.db:
                     tasks_ref = self.db.collection('bots').document(self.bot_id).collection('users').document(str(user_id)).collection('tasks')
                     query = tasks_ref.order_by('created_at', direction=firestore.Query.DESCENDING).limit(limit)
-                    docs = await query.get()
+                    docs = await run_firestore('tasks.query', query.get)
                     return [doc.to_dict() for doc in docs]
                 return []
         except Exception as e:
@@ -691,6 +741,32 @@ class MultiBotDataManager:
             logger.error(f"本地存储保存失败 {user_id}: {e}")
             return False
     
+    async def _patch_local_storage(self, user_id: str, updates: Dict[str, Any]) -> bool:
+        """按字段路径更新本地存储（Firebase不可用时的降级方案）"""
+        try:
+            import json
+            import os
+            
+            local_file = f"data/{self.bot_id}/users/{user_id}.json"
+            data = {}
+            if os.path.exists(local_file):
+                with open(local_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            if 'config' not in data:
+                data['config'] = copy.deepcopy(DEFAULT_USER_CONFIG)
+                data['bot_id'] = self.bot_id
+                data['created_at'] = datetime.now().isoformat()
+            apply_field_updates(data, updates)
+            
+            os.makedirs(os.path.dirname(local_file), exist_ok=True)
+            with open(local_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            return True
+        
+        except Exception as e:
+            logger.error(f"本地存储字段更新失败 {user_id}: {e}")
+            return False
+    
     async def _load_from_local_storage(self, user_id: str) -> Dict[str, Any]:
         """从本地存储加载（Firebase不可用时的降级方案）"""
         try:
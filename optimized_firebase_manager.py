@@ -13,12 +13,20 @@ from typing import Dict, Any, List, Optional, Union
 import firebase_admin
 from firebase_admin import credentials, firestore
 from firebase_batch_storage import FirebaseBatchStorage, get_global_batch_storage
-from firebase_cache_manager import FirebaseCacheManager, get_global_cache_manager
-from firebase_quota_monitor import FirebaseQuotaMonitor, get_global_quota_monitor
+from firebase_cache_manager import create_cache_manager, get_global_cache_manager
+from firebase_quota_monitor import get_global_quota_monitor
 from config import get_config
+from firestore_executor import run_firestore, get_firestore_io_stats
+from field_patch import apply_field_updates, build_merge_patch, parse_field_path, split_field_path
+from firebase_cache_listener import FirebaseCacheListener
+from firestore_emulator import get_emulator_client
+from firebase_write_scheduler import PRIORITY_CRITICAL, PRIORITY_NORMAL, get_global_write_scheduler
 
 logger = logging.getLogger(__name__)
 
+class ReadBlockedError(Exception):
+    """读取操作被配额限制阻止"""
+
 class OptimizedFirebaseManager:
     """优化的Firebase管理器 - 集成所有优化策略"""
     
@@ -35,7 +43,9 @@ class OptimizedFirebaseManager:
         # 初始化各个组件
         self.batch_storage = None
         self.cache_manager = None
+        self.cache_listener = None
         self.quota_monitor = None
+        self.write_scheduler = None
         
         # 配置
         self.config = get_config()
@@ -56,6 +66,13 @@ class OptimizedFirebaseManager:
     def _init_firebase(self):
         """初始化Firebase连接"""
         try:
+            # 本地测试：连接Firestore模拟器
+            emulator_client = get_emulator_client(self.config.get('firebase_project_id'))
+            if emulator_client is not None:
+                self.db = emulator_client
+                self.initialized = True
+                return
+            
             firebase_credentials = self.config.get('firebase_credentials')
             
             if not self._validate_firebase_credentials(firebase_credentials):
@@ -90,16 +107,22 @@ class OptimizedFirebaseManager:
             
             # 初始化缓存管理器
             if self.use_cache:
-                self.cache_manager = FirebaseCacheManager(
-                    self.bot_id,
-                    cache_ttl=300,  # 5分钟缓存
-                    max_cache_size=1000
-                )
+                self.cache_manager = create_cache_manager(self.bot_id)
                 logger.info("✅ 缓存管理器已初始化")
+                
+                # 集合变更监听（多实例部署时保持缓存新鲜，缓存TTL可以更长）
+                if self.config.get('firebase_cache_listener') and self.db is not None:
+                    self.cache_listener = FirebaseCacheListener(
+                        self.db, self.cache_manager,
+                        self.config.get('firebase_cache_listen_collections', ['users']),
+                        listener_ttl=self.config.get('firebase_cache_listener_ttl', 3600),
+                        has_pending_write=self.batch_storage.has_pending if self.batch_storage else None
+                    )
             
-            # 初始化配额监控器
+            # 初始化配额监控器（与批量存储共用全局计数，配额按项目计算）
             if self.use_quota_monitoring:
-                self.quota_monitor = FirebaseQuotaMonitor(self.bot_id)
+                self.quota_monitor = get_global_quota_monitor(self.bot_id)
+                self.write_scheduler = get_global_write_scheduler(self.bot_id)
                 logger.info("✅ 配额监控器已初始化")
                 
         except Exception as e:
@@ -135,6 +158,10 @@ class OptimizedFirebaseManager:
         if self.cache_manager:
             tasks.append(self.cache_manager.start_cleanup_task())
         
+        # 启动缓存监听
+        if self.cache_listener:
+            tasks.append(self.cache_listener.start())
+        
         # 启动配额监控
         if self.quota_monitor:
             tasks.append(self.quota_monitor.start_monitoring())
@@ -155,6 +182,10 @@ class OptimizedFirebaseManager:
         if self.cache_manager:
             tasks.append(self.cache_manager.stop_cleanup_task())
         
+        # 停止缓存监听
+        if self.cache_listener:
+            tasks.append(self.cache_listener.stop())
+        
         # 停止配额监控
         if self.quota_monitor:
             tasks.append(self.quota_monitor.stop_monitoring())
@@ -165,51 +196,55 @@ class OptimizedFirebaseManager:
     
     # ==================== 优化的读取操作 ====================
     
-    async def get_document(self, collection: str, document: str, 
-                          use_cache: bool = True) -> Optional[Dict[str, Any]]:
-        """获取文档（带缓存优化）"""
+    async def get_document(self, collection: str, document: str, use_cache: bool = True,
+                          stale_while_revalidate: bool = False) -> Optional[Dict[str, Any]]:
+        """获取文档（带缓存优化）
+        
+        同一文档的并发读取合并为一次Firebase读取，不存在的文档也会短暂缓存；
+        stale_while_revalidate 为True时，缓存过期后仍可返回旧值并在后台刷新。
+        """
         if not self.initialized:
             logger.error("Firebase未初始化")
             return None
         
-        # 检查配额
-        if self.quota_monitor and not self.quota_monitor.can_perform_operation('read', 1):
+        try:
+            if use_cache and self.cache_manager:
+                return await self.cache_manager.get_or_load(
+                    collection, document, lambda: self._load_document(collection, document),
+                    stale_while_revalidate=stale_while_revalidate)
+            return await self._load_document(collection, document)
+        
+        except ReadBlockedError:
             logger.warning("❌ 读取操作被配额限制阻止")
             return None
-        
-        # 尝试从缓存获取
-        if use_cache and self.cache_manager:
-            cached_data = self.cache_manager.get(collection, document)
-            if cached_data is not None:
-                logger.debug(f"缓存命中: {collection}/{document}")
-                return cached_data
-        
-        try:
-            # 从Firebase获取
-            doc_ref = self.db.collection(collection).document(document)
-            doc = doc_ref.get()
-            
-            if doc.exists:
-                data = doc.to_dict()
-                
-                # 记录配额使用
-                if self.quota_monitor:
-                    self.quota_monitor.record_operation('read', 1)
-                
-                # 存入缓存
-                if use_cache and self.cache_manager:
-                    self.cache_manager.set(collection, document, data)
-                
-                logger.debug(f"文档读取成功: {collection}/{document}")
-                return data
-            else:
-                logger.debug(f"文档不存在: {collection}/{document}")
-                return None
-                
         except Exception as e:
             logger.error(f"读取文档失败 {collection}/{document}: {e}")
             return None
     
+    async def _load_document(self, collection: str, document: str) -> Optional[Dict[str, Any]]:
+        """从Firebase读取文档（不存在时返回None）"""
+        # 检查配额
+        if self.quota_monitor and not self.quota_monitor.can_perform_operation('read', 1):
+            raise ReadBlockedError(f"{collection}/{document}")
+        
+        # 读取前获取批量队列中尚未确认提交的写入
+        pending = self.batch_storage.pending_writes(collection, document) if self.batch_storage else []
+        
+        doc_ref = self.db.collection(collection).document(document)
+        doc = await run_firestore('document.get', doc_ref.get)
+        
+        # 记录配额使用
+        if self.quota_monitor:
+            self.quota_monitor.record_operation('read', 1)
+        
+        data = doc.to_dict() if doc.exists else None
+        if pending:
+            # 叠加尚未提交的写入，避免缓存写入前的文档（之后的读改写会覆盖排队中的修改）
+            data = self.batch_storage.apply_pending_writes(data, pending)
+        
+        logger.debug(f"文档读取{'成功' if data is not None else '：不存在'}: {collection}/{document}")
+        return data
+    
     async def get_collection(self, collection: str, limit: int = None, 
                            order_by: str = None, use_cache: bool = True) -> List[Dict[str, Any]]:
         """获取集合（带缓存优化）"""
@@ -233,7 +268,7 @@ class OptimizedFirebaseManager:
                 query = query.limit(limit)
             
             # 执行查询
-            docs = query.stream()
+            docs = await run_firestore('collection.stream', lambda: list(query.stream()))
             
             # 记录配额使用
             if self.quota_monitor:
@@ -243,12 +278,18 @@ class OptimizedFirebaseManager:
             results = []
             for doc in docs:
                 data = doc.to_dict()
+                pending = self.batch_storage.pending_writes(collection, doc.id) if self.batch_storage else []
+                if pending:
+                    # 叠加尚未提交的写入，这些文档不存入缓存（读取前后队列可能已变化）
+                    data = self.batch_storage.apply_pending_writes(data, pending)
+                    if data is None:
+                        continue
+                elif use_cache and self.cache_manager:
+                    # 存入缓存（不含 _id，与 get_document 的结果一致）
+                    self.cache_manager.set(collection, doc.id, dict(data))
+                
                 data['_id'] = doc.id
                 results.append(data)
-                
-                # 存入缓存
-                if use_cache and self.cache_manager:
-                    self.cache_manager.set(collection, doc.id, data)
             
             logger.debug(f"集合读取成功: {collection} ({len(results)} 个文档)")
             return results
@@ -289,9 +330,14 @@ class OptimizedFirebaseManager:
         # 批量获取未缓存的文档
         if uncached_ids:
             try:
+                # 读取前获取批量队列中尚未确认提交的写入
+                pending = {}
+                if self.batch_storage:
+                    pending = {doc_id: self.batch_storage.pending_writes(collection, doc_id) for doc_id in uncached_ids}
+                
                 # 使用Firestore的批量获取
                 doc_refs = [self.db.collection(collection).document(doc_id) for doc_id in uncached_ids]
-                docs = self.db.get_all(doc_refs)
+                docs = await run_firestore('document.get_all', lambda: list(self.db.get_all(doc_refs)))
                 
                 # 记录配额使用
                 if self.quota_monitor:
@@ -299,14 +345,20 @@ class OptimizedFirebaseManager:
                 
                 # 处理结果
                 for doc in docs:
-                    if doc.exists:
-                        data = doc.to_dict()
+                    data = doc.to_dict() if doc.exists else None
+                    if pending.get(doc.id):
+                        # 叠加尚未提交的写入
+                        data = self.batch_storage.apply_pending_writes(data, pending[doc.id])
+                    
+                    if data is not None:
+                        # 存入缓存（不含 _id，与 get_document 的结果一致）
+                        if use_cache and self.cache_manager:
+                            self.cache_manager.set(collection, doc.id, dict(data))
+                        
                         data['_id'] = doc.id
                         results[doc.id] = data
-                        
-                        # 存入缓存
-                        if use_cache and self.cache_manager:
-                            self.cache_manager.set(collection, doc.id, data)
+                    elif use_cache and self.cache_manager:
+                        self.cache_manager.set_missing(collection, doc.id)
                 
                 logger.debug(f"批量读取成功: {collection} ({len(results)} 个文档)")
                 
@@ -317,36 +369,68 @@ class OptimizedFirebaseManager:
     
     # ==================== 优化的写入操作 ====================
     
+    def _write_priority(self, priority: Optional[int], collection: str, document: str,
+                        paths=None, data: Dict[str, Any] = None) -> int:
+        """写入优先级：未指定时由写入调度按集合和字段判断"""
+        if priority is not None:
+            return priority
+        if self.write_scheduler:
+            return self.write_scheduler.classify(collection, document, paths, data)
+        return PRIORITY_NORMAL
+    
+    def _route_write(self, operation_type: str, priority: int, use_batch: Optional[bool]) -> Optional[bool]:
+        """决定写入方式：返回是否使用批量队列，配额不足且无法延后时返回None
+        
+        批量写入在提交时由写入调度分配配额；直接写入配额不足时，非关键写入改为加入批量队列延后提交。
+        """
+        if use_batch is None:
+            use_batch = self.use_batch_storage
+        use_batch = bool(use_batch and self.batch_storage)
+        
+        if self.write_scheduler is None:
+            if self.quota_monitor and not self.quota_monitor.can_perform_operation(operation_type, 1):
+                return None
+            return use_batch
+        
+        if use_batch or self.write_scheduler.admit(priority, operation_type):
+            return use_batch
+        if self.batch_storage and priority < PRIORITY_CRITICAL:
+            logger.info(f"⏳ 写入配额不足，改为加入批量队列延后提交 (优先级: {priority})")
+            return True
+        return None
+    
     async def set_document(self, collection: str, document: str, data: Dict[str, Any],
-                          use_batch: bool = None, use_cache: bool = True) -> bool:
-        """设置文档（优化版）"""
+                          use_batch: bool = None, use_cache: bool = True, priority: int = None) -> bool:
+        """设置文档（优化版）
+        
+        Args:
+            priority: 写入优先级（见 firebase_write_scheduler），None时按集合和字段判断
+        """
         if not self.initialized:
             logger.error("Firebase未初始化")
             return False
         
-        # 检查配额
-        if self.quota_monitor and not self.quota_monitor.can_perform_operation('write', 1):
+        # 检查配额，决定是否使用批量存储
+        priority = self._write_priority(priority, collection, document, data=data)
+        use_batch = self._route_write('write', priority, use_batch)
+        if use_batch is None:
             logger.warning("❌ 写入操作被配额限制阻止")
             return False
         
-        # 决定是否使用批量存储
-        if use_batch is None:
-            use_batch = self.use_batch_storage
-        
         try:
-            if use_batch and self.batch_storage:
+            if use_batch:
                 # 使用批量存储
-                success = self.batch_storage.add_operation('set', collection, document, data)
+                success = self.batch_storage.add_operation('set', collection, document, data, priority)
                 if success:
                     # 更新缓存
                     if use_cache and self.cache_manager:
-                        self.cache_manager.set(collection, document, data, 'set')
+                        self.cache_manager.set(collection, document, data)
                     logger.debug(f"文档已加入批量队列: {collection}/{document}")
                 return success
             else:
                 # 直接写入
                 doc_ref = self.db.collection(collection).document(document)
-                doc_ref.set(data)
+                await run_firestore('document.set', doc_ref.set, data)
                 
                 # 记录配额使用
                 if self.quota_monitor:
@@ -354,7 +438,7 @@ class OptimizedFirebaseManager:
                 
                 # 更新缓存
                 if use_cache and self.cache_manager:
-                    self.cache_manager.set(collection, document, data, 'set')
+                    self.cache_manager.set(collection, document, data)
                 
                 logger.debug(f"文档写入成功: {collection}/{document}")
                 return True
@@ -364,25 +448,24 @@ class OptimizedFirebaseManager:
             return False
     
     async def update_document(self, collection: str, document: str, data: Dict[str, Any],
-                             use_batch: bool = None, use_cache: bool = True) -> bool:
+                             use_batch: bool = None, use_cache: bool = True, priority: int = None) -> bool:
         """更新文档（优化版）"""
         if not self.initialized:
             logger.error("Firebase未初始化")
             return False
         
-        # 检查配额
-        if self.quota_monitor and not self.quota_monitor.can_perform_operation('write', 1):
+        # 检查配额，决定是否使用批量存储
+        priority = self._write_priority(priority, collection, document,
+                                        paths=[parse_field_path(path) for path in data])
+        use_batch = self._route_write('write', priority, use_batch)
+        if use_batch is None:
             logger.warning("❌ 更新操作被配额限制阻止")
             return False
         
-        # 决定是否使用批量存储
-        if use_batch is None:
-            use_batch = self.use_batch_storage
-        
         try:
-            if use_batch and self.batch_storage:
+            if use_batch:
                 # 使用批量存储
-                success = self.batch_storage.add_operation('update', collection, document, data)
+                success = self.batch_storage.add_operation('update', collection, document, data, priority)
                 if success:
                     # 使缓存失效
                     if use_cache and self.cache_manager:
@@ -392,7 +475,7 @@ class OptimizedFirebaseManager:
             else:
                 # 直接更新
                 doc_ref = self.db.collection(collection).document(document)
-                doc_ref.update(data)
+                await run_firestore('document.update', doc_ref.update, data)
                 
                 # 记录配额使用
                 if self.quota_monitor:
@@ -409,44 +492,91 @@ class OptimizedFirebaseManager:
             logger.error(f"更新文档失败 {collection}/{document}: {e}")
             return False
     
+    async def patch_document(self, collection: str, document: str, updates: Dict[str, Any],
+                            use_batch: bool = None, use_cache: bool = True, priority: int = None) -> bool:
+        """按字段路径写入文档（不读取现有文档，只写入变化的字段）
+        
+        Args:
+            updates: {字段路径: 值}，见 field_patch；值为 DELETE_FIELD 时删除字段
+        """
+        if not self.initialized:
+            logger.error("Firebase未初始化")
+            return False
+        
+        # 检查配额，决定是否使用批量存储
+        priority = self._write_priority(priority, collection, document,
+                                        paths=[split_field_path(path) for path in updates])
+        use_batch = self._route_write('write', priority, use_batch)
+        if use_batch is None:
+            logger.warning("❌ 补丁写入操作被配额限制阻止")
+            return False
+        
+        try:
+            data, merge_paths = build_merge_patch(updates, firestore.DELETE_FIELD)
+            if use_batch:
+                success = self.batch_storage.add_operation('set', collection, document, data, priority, merge_paths)
+                if not success:
+                    return False
+                logger.debug(f"文档补丁已加入批量队列: {collection}/{document}")
+            else:
+                doc_ref = self.db.collection(collection).document(document)
+                await run_firestore('document.patch', doc_ref.set, data, merge=merge_paths)
+                
+                # 记录配额使用
+                if self.quota_monitor:
+                    self.quota_monitor.record_operation('write', 1)
+                logger.debug(f"文档补丁写入成功: {collection}/{document}")
+            
+            # 把补丁应用到已缓存的读取结果，避免下次读取整个文档
+            if use_cache and self.cache_manager:
+                cached_data = self.cache_manager.get(collection, document)
+                if cached_data is not None:
+                    self.cache_manager.set(collection, document, apply_field_updates(cached_data, updates))
+                else:
+                    # 未缓存或缓存为“不存在”（补丁会创建文档）
+                    self.cache_manager.invalidate(collection, document)
+            return True
+        
+        except Exception as e:
+            logger.error(f"补丁写入文档失败 {collection}/{document}: {e}")
+            return False
+    
     async def delete_document(self, collection: str, document: str,
-                             use_batch: bool = None, use_cache: bool = True) -> bool:
+                             use_batch: bool = None, use_cache: bool = True, priority: int = None) -> bool:
         """删除文档（优化版）"""
         if not self.initialized:
             logger.error("Firebase未初始化")
             return False
         
-        # 检查配额
-        if self.quota_monitor and not self.quota_monitor.can_perform_operation('delete', 1):
+        # 检查配额，决定是否使用批量存储
+        priority = self._write_priority(priority, collection, document)
+        use_batch = self._route_write('delete', priority, use_batch)
+        if use_batch is None:
             logger.warning("❌ 删除操作被配额限制阻止")
             return False
         
-        # 决定是否使用批量存储
-        if use_batch is None:
-            use_batch = self.use_batch_storage
-        
         try:
-            if use_batch and self.batch_storage:
+            if use_batch:
                 # 使用批量存储
-                success = self.batch_storage.add_operation('delete', collection, document)
+                success = self.batch_storage.add_operation('delete', collection, document, priority=priority)
                 if success:
-                    # 使缓存失效
+                    # 缓存为“不存在”
                     if use_cache and self.cache_manager:
-                        self.cache_manager.invalidate(collection, document)
+                        self.cache_manager.set_missing(collection, document)
                     logger.debug(f"文档删除已加入批量队列: {collection}/{document}")
                 return success
             else:
                 # 直接删除
                 doc_ref = self.db.collection(collection).document(document)
-                doc_ref.delete()
+                await run_firestore('document.delete', doc_ref.delete)
                 
                 # 记录配额使用
                 if self.quota_monitor:
                     self.quota_monitor.record_operation('delete', 1)
                 
-                # 使缓存失效
+                # 缓存为“不存在”
                 if use_cache and self.cache_manager:
-                    self.cache_manager.invalidate(collection, document)
+                    self.cache_manager.set_missing(collection, document)
                 
                 logger.debug(f"文档删除成功: {collection}/{document}")
                 return True
@@ -474,10 +604,20 @@ class OptimizedFirebaseManager:
         if self.cache_manager:
             stats['cache'] = self.cache_manager.get_stats()
         
+        if self.cache_listener:
+            stats['cache_listener'] = self.cache_listener.get_stats()
+        
         # 配额监控统计
         if self.quota_monitor:
             stats['quota'] = self.quota_monitor.get_usage_stats()
         
+        # 写入调度统计（含预计配额耗尽时间）
+        if self.write_scheduler:
+            stats['write_scheduler'] = self.write_scheduler.get_stats()
+        
+        # Firestore调用延迟统计
+        stats['firestore_io'] = get_firestore_io_stats()
+        
         return stats
     
     def force_flush_all(self):
@@ -0,0 +1,230 @@
+# ==================== 任务资源统计 ====================
+"""
+任务资源统计
+按任务记录实际占用：缓冲中的Message（按消息估算字节数）和滚动窗口内的API调用速率；
+任务结束时把峰值内存和平均API速率折算进按任务类型的滚动估计（EWMA），
+并发任务管理器据此做准入，而不是使用固定的猜测值。
+进程内存按实际RSS和容器内存上限（cgroup）计算，而不是整机内存。
+"""
+
+import time
+from collections import deque
+from typing import Any, Dict, Iterable, Optional
+
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# Pyrogram Message 对象图（含chat/from_user等子对象）的基础开销估计（字节）
+MESSAGE_BASE_BYTES = 4096
+
+def estimate_message_bytes(message: Any) -> int:
+    """估算一条缓冲中的Message占用的内存（基础开销 + 文本/说明长度）"""
+    if message is None:
+        return 0
+    size = MESSAGE_BASE_BYTES
+    for attr in ('text', 'caption'):
+        value = getattr(message, attr, None)
+        if value:
+            size += len(str(value))
+    if getattr(message, 'reply_markup', None) is not None:
+        size += 1024
+    return size
+
+def detect_memory_limit_mb() -> Optional[float]:
+    """读取容器内存上限（cgroup v2/v1），无上限或不可读时返回None"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == 'max':
+            return None
+        try:
+            limit = int(value)
+        except ValueError:
+            continue
+        # cgroup v1 未设置上限时为一个接近 2^63 的值
+        if limit <= 0 or limit >= 1 << 60:
+            return None
+        return limit / (1024 * 1024)
+    return None
+
+class TaskUsage:
+    """单个任务的实测资源占用"""
+    
+    def __init__(self, task_id: str, task_type: str):
+        self.task_id = task_id
+        self.task_type = task_type
+        self.started_at = time.time()
+        self.buffered_messages = 0  # 按批次整体设置的缓冲消息数
+        self.buffered_bytes = 0
+        self.queued_messages = 0  # 按增减计数的排队消息数（如发送队列）
+        self.peak_memory_bytes = 0
+        self.api_calls = 0
+        self.api_call_times: deque = deque()
+    
+    @property
+    def memory_bytes(self) -> int:
+        return self.buffered_bytes + self.queued_messages * MESSAGE_BASE_BYTES
+    
+    def update_peak(self):
+        self.peak_memory_bytes = max(self.peak_memory_bytes, self.memory_bytes)
+
+class TaskResourceTracker:
+    """任务资源统计类"""
+    
+    def __init__(self, api_window: float = 60.0, ewma_alpha: float = 0.3,
+                 default_memory_mb: float = 20.0, default_api_rate: float = 1.0):
+        """初始化资源统计
+        
+        Args:
+            api_window: API速率统计窗口（秒）
+            ewma_alpha: 按任务类型滚动估计的平滑系数
+            default_memory_mb: 没有任何样本时的单任务内存估计（MB）
+            default_api_rate: 没有任何样本时的单任务API速率估计（次/秒）
+        """
+        self.api_window = api_window
+        self.ewma_alpha = ewma_alpha
+        self.default_memory_mb = default_memory_mb
+        self.default_api_rate = default_api_rate
+        
+        self.tasks: Dict[str, TaskUsage] = {}
+        # task_type -> {'memory_mb', 'api_rate', 'samples'}
+        self.type_estimates: Dict[str, Dict[str, float]] = {}
+    
+    # ==================== 记录 ====================
+    
+    def begin_task(self, task_id: str, task_type: str) -> TaskUsage:
+        """开始统计任务（重复调用时保留已有统计）"""
+        usage = self.tasks.get(task_id)
+        if usage is None:
+            usage = self.tasks[task_id] = TaskUsage(task_id, task_type)
+        return usage
+    
+    def set_buffered(self, task_id: str, messages: Iterable[Any], pending_count: int = 0):
+        """设置任务当前缓冲的消息（pending_count为已发起、尚未返回的预取条数）"""
+        usage = self.tasks.get(task_id)
+        if usage is None:
+            return
+        count = 0
+        total_bytes = 0
+        for message in messages:
+            if message is not None:
+                count += 1
+                total_bytes += estimate_message_bytes(message)
+        usage.buffered_messages = count + pending_count
+        usage.buffered_bytes = total_bytes + pending_count * MESSAGE_BASE_BYTES
+        usage.update_peak()
+    
+    def adjust_queued(self, task_id: Optional[str], delta: int):
+        """增减任务排队中的消息数"""
+        usage = self.tasks.get(task_id) if task_id is not None else None
+        if usage is None:
+            return
+        usage.queued_messages = max(0, usage.queued_messages + delta)
+        usage.update_peak()
+    
+    def record_api_call(self, task_id: Optional[str], count: int = 1):
+        """记录任务发起的API调用"""
+        usage = self.tasks.get(task_id) if task_id is not None else None
+        if usage is None:
+            return
+        now = time.time()
+        usage.api_calls += count
+        for _ in range(count):
+            usage.api_call_times.append(now)
+        self._trim_api_window(usage, now)
+    
+    def end_task(self, task_id: str):
+        """结束统计，把任务的峰值内存和平均API速率计入按类型的滚动估计"""
+        usage = self.tasks.pop(task_id, None)
+        if usage is None:
+            return
+        duration = max(time.time() - usage.started_at, 1.0)
+        self._fold_sample(usage.task_type, usage.peak_memory_bytes / (1024 * 1024), usage.api_calls / duration)
+    
+    def _fold_sample(self, task_type: str, memory_mb: float, api_rate: float):
+        estimate = self.type_estimates.get(task_type)
+        if estimate is None:
+            self.type_estimates[task_type] = {'memory_mb': memory_mb, 'api_rate': api_rate, 'samples': 1}
+            return
+        alpha = self.ewma_alpha
+        estimate['memory_mb'] = alpha * memory_mb + (1 - alpha) * estimate['memory_mb']
+        estimate['api_rate'] = alpha * api_rate + (1 - alpha) * estimate['api_rate']
+        estimate['samples'] += 1
+    
+    def _trim_api_window(self, usage: TaskUsage, now: float):
+        while usage.api_call_times and now - usage.api_call_times[0] > self.api_window:
+            usage.api_call_times.popleft()
+    
+    # ==================== 查询 ====================
+    
+    def get_task_memory_mb(self, task_id: str) -> float:
+        """任务当前实测内存（MB）"""
+        usage = self.tasks.get(task_id)
+        return usage.memory_bytes / (1024 * 1024) if usage else 0.0
+    
+    def get_task_api_rate(self, task_id: str) -> float:
+        """任务最近窗口内的API速率（次/秒）"""
+        usage = self.tasks.get(task_id)
+        if usage is None:
+            return 0.0
+        now = time.time()
+        self._trim_api_window(usage, now)
+        window = min(max(now - usage.started_at, 1.0), self.api_window)
+        return len(usage.api_call_times) / window
+    
+    def get_type_estimate(self, task_type: str) -> Dict[str, float]:
+        """获取任务类型的资源估计：优先使用已结束任务的滚动估计，
+        其次使用同类型运行中任务的峰值（长期运行的监听任务），最后使用默认值"""
+        estimate = self.type_estimates.get(task_type)
+        running = [usage for usage in self.tasks.values() if usage.task_type == task_type]
+        running_peak_mb = max((usage.peak_memory_bytes for usage in running), default=0) / (1024 * 1024)
+        running_rate = max((self.get_task_api_rate(usage.task_id) for usage in running), default=0.0)
+        
+        if estimate:
+            return {
+                'memory_mb': max(estimate['memory_mb'], running_peak_mb),
+                'api_rate': max(estimate['api_rate'], running_rate),
+                'samples': estimate['samples']
+            }
+        if running:
+            # 运行中任务可能尚未到达峰值，不低于默认值
+            return {'memory_mb': max(running_peak_mb, self.default_memory_mb),
+                    'api_rate': max(running_rate, self.default_api_rate), 'samples': 0}
+        return {'memory_mb': self.default_memory_mb, 'api_rate': self.default_api_rate, 'samples': 0}
+    
+    def get_snapshot(self, task_ids: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """获取各任务的实测占用和按类型的估计"""
+        selected = set(task_ids) if task_ids is not None else None
+        tasks = {}
+        for task_id, usage in self.tasks.items():
+            if selected is not None and task_id not in selected:
+                continue
+            tasks[task_id] = {
+                'type': usage.task_type,
+                'buffered_messages': usage.buffered_messages + usage.queued_messages,
+                'memory_mb': round(usage.memory_bytes / (1024 * 1024), 3),
+                'peak_memory_mb': round(usage.peak_memory_bytes / (1024 * 1024), 3),
+                'api_calls': usage.api_calls,
+                'api_rate': round(self.get_task_api_rate(task_id), 3)
+            }
+        task_types = set(self.type_estimates) | {usage.task_type for usage in self.tasks.values()}
+        return {
+            'tasks': tasks,
+            'type_estimates': {
+                task_type: {key: round(value, 3) for key, value in self.get_type_estimate(task_type).items()}
+                for task_type in task_types
+            }
+        }
+
+# 全局任务资源统计
+_global_resource_trackers: Dict[str, TaskResourceTracker] = {}
+
+def get_global_resource_tracker(bot_id: str = "default_bot") -> TaskResourceTracker:
+    """获取全局任务资源统计（同一机器人的搬运引擎、监听引擎和并发任务管理器共享）"""
+    tracker = _global_resource_trackers.get(bot_id)
+    if tracker is None:
+        tracker = _global_resource_trackers[bot_id] = TaskResourceTracker()
+    return tracker
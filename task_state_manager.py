@@ -10,14 +10,18 @@ import logging
 import time
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional, Set
+from typing import Dict, List, Any, Optional, Set, Callable
 from dataclasses import dataclass, asdict
 from enum import Enum
 import threading
 from concurrent.futures import ThreadPoolExecutor
 
 from data_manager import get_data_manager
-from config import get_config
+from config import get_config, DEFAULT_USER_CONFIG
+from field_patch import DELETE_FIELD
+from firebase_write_scheduler import WriteDeferredError
+from firestore_executor import run_firestore
+from task_state_store import create_task_state_store
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +34,9 @@ class TaskStatus(Enum):
     FAILED = "failed"
     CANCELLED = "cancelled"
 
+# 已结束的任务状态（可归档）
+FINISHED_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
 @dataclass
 class TaskProgress:
     """任务进度信息"""
@@ -78,6 +85,17 @@ class TaskStateManager:
         self.config = get_config()
         self.save_interval = self.config.get('task_save_interval', 30)  # 30秒保存一次
         self.batch_save_size = self.config.get('task_batch_save_size', 10)  # 批量保存大小
+        self.cleanup_interval = DEFAULT_USER_CONFIG.get('task_cleanup_interval', 3600)
+        self.completed_max_age_hours = DEFAULT_USER_CONFIG.get('task_completed_max_age_hours', 24)
+        self.archive_retention_days = DEFAULT_USER_CONFIG.get('task_archive_retention_days', 30)
+        self._last_cleanup_time = time.time()
+        
+        # 任务状态存储（按task_id独立存储，带 user_id/status 索引）
+        self.store = create_task_state_store(
+            bot_id, self.data_manager, self.config.get('use_local_storage', False))
+        # 旧版本用户配置 active_tasks 的迁移每个进程只执行一次，完成后写入持久化标记
+        self._legacy_migrated = False
+        self._legacy_migration_lock = asyncio.Lock()
         
         # 自动保存任务
         self._auto_save_task = None
@@ -85,6 +103,9 @@ class TaskStateManager:
         self._pending_saves: Set[str] = set()
         self._pending_saves_lock = threading.RLock()
         
+        # 状态变化监听器: callback(task_id, new_status)
+        self._status_listeners: List[Callable[[str, TaskStatus], None]] = []
+        
         # 统计信息
         self.stats = {
             'total_tasks': 0,
@@ -92,11 +113,31 @@ class TaskStateManager:
             'completed_tasks': 0,
             'failed_tasks': 0,
             'saves_performed': 0,
-            'last_save_time': None
+            'last_save_time': None,
+            'tasks_archived': 0,
+            'legacy_tasks_migrated': 0
         }
         
         logger.info(f"✅ 任务状态管理器初始化完成 (Bot: {bot_id})")
     
+    def add_status_listener(self, callback: Callable[[str, TaskStatus], None]):
+        """注册任务状态变化监听器"""
+        if callback not in self._status_listeners:
+            self._status_listeners.append(callback)
+    
+    def remove_status_listener(self, callback: Callable[[str, TaskStatus], None]):
+        """移除任务状态变化监听器"""
+        if callback in self._status_listeners:
+            self._status_listeners.remove(callback)
+    
+    def _notify_status_change(self, task_id: str, status: TaskStatus):
+        """通知状态变化监听器"""
+        for callback in list(self._status_listeners):
+            try:
+                callback(task_id, status)
+            except Exception as e:
+                logger.error(f"任务状态监听器执行失败 {task_id}: {e}")
+    
     async def start_auto_save(self):
         """启动自动保存任务"""
         if self._auto_save_running:
@@ -129,6 +170,10 @@ class TaskStateManager:
             try:
                 await asyncio.sleep(self.save_interval)
                 await self._save_all_pending_tasks()
+                
+                if time.time() - self._last_cleanup_time >= self.cleanup_interval:
+                    self._last_cleanup_time = time.time()
+                    await self.cleanup_completed_tasks(max_age_hours=self.completed_max_age_hours)
             except asyncio.CancelledError:
                 break
             except Exception as e:
@@ -219,6 +264,7 @@ class TaskStateManager:
                         return False
                 
                 task = self._task_cache[task_id]
+                previous_status = task.status
                 
                 # 更新字段
                 for key, value in updates.items():
@@ -242,6 +288,9 @@ class TaskStateManager:
                 with self._pending_saves_lock:
                     self._pending_saves.add(task_id)
             
+            if task.status != previous_status:
+                self._notify_status_change(task_id, task.status)
+            
             logger.debug(f"任务进度已更新: {task_id}")
             return True
             
@@ -273,96 +322,42 @@ class TaskStateManager:
             return False
     
     async def _save_all_pending_tasks(self):
-        """保存所有待保存的任务"""
+        """保存所有待保存的任务（每次落盘一次批量写入）"""
+        with self._pending_saves_lock:
+            pending_tasks = list(self._pending_saves)
+            self._pending_saves.clear()
+        
+        if not pending_tasks:
+            return
+        
+        # 在锁内生成快照，写入期间的新更新会重新标记为待保存
+        with self._cache_lock:
+            records = [self._task_progress_to_dict(self._task_cache[task_id])
+                       for task_id in pending_tasks if task_id in self._task_cache]
+        
         try:
+            saved = await self.store.save_many(records)
+            self.stats['saves_performed'] += 1
+            self.stats['last_save_time'] = datetime.now()
+            logger.debug(f"批量保存完成: {saved} 个任务")
+        
+        except WriteDeferredError as e:
+            # 写入配额不足，保留待保存标记，下次落盘重试
             with self._pending_saves_lock:
-                pending_tasks = list(self._pending_saves)
-            
-            if not pending_tasks:
-                return
-            
-            # 批量保存
-            batch_size = self.batch_save_size
-            for i in range(0, len(pending_tasks), batch_size):
-                batch = pending_tasks[i:i + batch_size]
-                await self._save_task_batch(batch)
-            
-            logger.debug(f"批量保存完成: {len(pending_tasks)} 个任务")
+                self._pending_saves.update(pending_tasks)
+            logger.info(f"⏳ {e}")
             
         except Exception as e:
-            logger.error(f"批量保存任务失败: {e}")
-    
-    async def _save_task_batch(self, task_ids: List[str]):
-        """批量保存任务"""
-        try:
-            tasks_to_save = []
-            with self._cache_lock:
-                for task_id in task_ids:
-                    if task_id in self._task_cache:
-                        tasks_to_save.append(self._task_cache[task_id])
-            
-            if not tasks_to_save:
-                return
-            
-            # 按用户分组保存
-            user_tasks = {}
-            for task in tasks_to_save:
-                user_id = task.user_id
-                if user_id not in user_tasks:
-                    user_tasks[user_id] = []
-                user_tasks[user_id].append(task)
-            
-            # 为每个用户保存任务
-            for user_id, tasks in user_tasks.items():
-                await self._save_user_tasks(user_id, tasks)
-            
-            # 清除待保存标记
+            # 保存失败，恢复待保存标记，下次落盘重试
             with self._pending_saves_lock:
-                for task_id in task_ids:
-                    self._pending_saves.discard(task_id)
-            
-        except Exception as e:
+                self._pending_saves.update(pending_tasks)
             logger.error(f"批量保存任务失败: {e}")
     
-    async def _save_user_tasks(self, user_id: str, tasks: List[TaskProgress]):
-        """保存用户的任务"""
-        try:
-            # 获取用户现有任务
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_tasks = user_config.get('active_tasks', {})
-            
-            # 更新任务状态
-            for task in tasks:
-                user_tasks[task.task_id] = self._task_progress_to_dict(task)
-            
-            # 保存到数据库
-            user_config['active_tasks'] = user_tasks
-            user_config['updated_at'] = datetime.now().isoformat()
-            
-            success = await self.data_manager.save_user_config(user_id, user_config)
-            if success:
-                logger.debug(f"用户任务保存成功: {user_id} ({len(tasks)} 个任务)")
-            else:
-                logger.error(f"用户任务保存失败: {user_id}")
-            
-        except Exception as e:
-            logger.error(f"保存用户任务失败 {user_id}: {e}")
-    
     async def _save_task_to_db(self, task: TaskProgress) -> bool:
         """保存单个任务到数据库"""
         try:
-            user_config = await self.data_manager.get_user_config(task.user_id)
-            user_tasks = user_config.get('active_tasks', {})
-            
-            # 更新任务状态
-            user_tasks[task.task_id] = self._task_progress_to_dict(task)
-            
-            # 保存到数据库
-            user_config['active_tasks'] = user_tasks
-            user_config['updated_at'] = datetime.now().isoformat()
-            
-            success = await self.data_manager.save_user_config(task.user_id, user_config)
-            return success
+            await self.store.save_many([self._task_progress_to_dict(task)])
+            return True
             
         except Exception as e:
             logger.error(f"保存任务到数据库失败 {task.task_id}: {e}")
@@ -371,30 +366,11 @@ class TaskStateManager:
     async def _load_task_from_db(self, task_id: str) -> Optional[TaskProgress]:
         """从数据库加载任务"""
         try:
-            # 这里需要实现从数据库加载任务的逻辑
-            # 由于任务可能属于不同用户，需要搜索所有用户
-            # 这是一个简化的实现，实际可能需要更复杂的查询
-            
-            # 获取所有用户
-            all_user_ids = await self.data_manager.get_all_user_ids()
-            
-            for user_id in all_user_ids:
-                try:
-                    user_config = await self.data_manager.get_user_config(user_id)
-                    if not user_config:
-                        continue
-                        
-                    user_tasks = user_config.get('active_tasks', {})
-                    
-                    if task_id in user_tasks:
-                        task_dict = user_tasks[task_id]
-                        task_progress = self._dict_to_task_progress(task_dict)
-                        if task_progress:
-                            logger.info(f"✅ 从数据库成功加载任务 {task_id} (用户: {user_id})")
-                            return task_progress
-                except Exception as e:
-                    logger.warning(f"搜索用户 {user_id} 的任务失败: {e}")
-                    continue
+            # 旧任务迁移完成后，存储中没有的任务即不存在
+            await self._ensure_legacy_tasks_migrated()
+            task_dict = await self.store.load(task_id)
+            if task_dict:
+                return self._dict_to_task_progress(task_dict)
             
             logger.warning(f"未找到任务 {task_id} 在数据库中")
             return None
@@ -403,6 +379,60 @@ class TaskStateManager:
             logger.error(f"从数据库加载任务失败 {task_id}: {e}")
             return None
     
+    async def _ensure_legacy_tasks_migrated(self):
+        """把所有用户配置中旧的 active_tasks 迁移到任务状态存储（每个进程最多执行一次）
+        
+        全部用户迁移并清理旧字段后写入持久化标记，之后的启动不再遍历用户；
+        部分失败时本进程不再重试，下次启动重新迁移（重复迁移是幂等的）；
+        数据管理器尚未初始化时不做任何读取，之后的调用再执行。
+        """
+        if self._legacy_migrated:
+            return
+        async with self._legacy_migration_lock:
+            if self._legacy_migrated:
+                return
+            optimized_manager = getattr(self.data_manager, 'optimized_manager', None)
+            db = self.data_manager.db or getattr(optimized_manager, 'db', None)
+            if not self.data_manager.initialized or db is None:
+                return
+            
+            try:
+                if await self.store.is_legacy_migrated():
+                    self._legacy_migrated = True
+                    return
+                
+                # 读取失败时抛出异常（get_all_user_ids 会返回空列表），不会误写迁移标记
+                users_ref = db.collection('users')
+                user_docs = await run_firestore('users.stream', lambda: list(users_ref.stream()))
+                
+                complete = True
+                for user_doc in user_docs:
+                    legacy_tasks = ((user_doc.to_dict() or {}).get('config') or {}).get('active_tasks') or {}
+                    if not legacy_tasks:
+                        continue
+                    try:
+                        if not await self._migrate_legacy_tasks(user_doc.id, legacy_tasks):
+                            complete = False
+                    except Exception as e:
+                        complete = False
+                        logger.warning(f"迁移用户 {user_doc.id} 的旧任务失败: {e}")
+                
+                if complete:
+                    await self.store.mark_legacy_migrated()
+                    logger.info(f"✅ 旧任务迁移完成，共迁移 {self.stats['legacy_tasks_migrated']} 个任务")
+                else:
+                    logger.warning("⚠️ 部分用户的旧任务未能迁移，下次启动重试")
+            except Exception as e:
+                logger.error(f"旧任务迁移失败，下次启动重试: {e}")
+            self._legacy_migrated = True
+    
+    async def _migrate_legacy_tasks(self, user_id: str, legacy_tasks: Dict[str, Dict[str, Any]]) -> bool:
+        """把一个用户配置中旧的 active_tasks 迁移到任务状态存储，返回旧字段是否已清理"""
+        await self.store.save_many(list(legacy_tasks.values()))
+        self.stats['legacy_tasks_migrated'] += len(legacy_tasks)
+        logger.info(f"✅ 已迁移用户 {user_id} 的 {len(legacy_tasks)} 个任务到任务状态存储")
+        return await self.data_manager.update_user_fields(user_id, {('config', 'active_tasks'): DELETE_FIELD})
+    
     def _task_progress_to_dict(self, task: TaskProgress) -> Dict[str, Any]:
         """将任务进度转换为字典"""
         return {
@@ -446,17 +476,17 @@ class TaskStateManager:
     async def get_user_tasks(self, user_id: str) -> List[TaskProgress]:
         """获取用户的所有任务"""
         try:
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_tasks = user_config.get('active_tasks', {})
+            await self._ensure_legacy_tasks_migrated()
+            task_dicts = await self.store.query(user_id=user_id)
             
             tasks = []
-            for task_id, task_dict in user_tasks.items():
+            for task_dict in task_dicts:
                 task = self._dict_to_task_progress(task_dict)
-                tasks.append(task)
                 
-                # 更新缓存
+                # 更新缓存（缓存中的任务可能有尚未落盘的进度，以缓存为准）
                 with self._cache_lock:
-                    self._task_cache[task_id] = task
+                    task = self._task_cache.setdefault(task.task_id, task)
+                tasks.append(task)
             
             return tasks
             
@@ -464,41 +494,38 @@ class TaskStateManager:
             logger.error(f"获取用户任务失败 {user_id}: {e}")
             return []
     
-    async def cleanup_completed_tasks(self, user_id: str, max_age_hours: int = 24):
-        """清理已完成的任务"""
+    async def cleanup_completed_tasks(self, user_id: Optional[str] = None, max_age_hours: int = 24):
+        """归档已结束超过 max_age_hours 的任务，并删除超过保留期的归档
+        
+        Args:
+            user_id: 只清理该用户的任务，None时清理所有用户
+            max_age_hours: 已结束任务保留在活动集合中的时间（小时）
+        """
         try:
-            user_config = await self.data_manager.get_user_config(user_id)
-            user_tasks = user_config.get('active_tasks', {})
+            # 先落盘，避免归档的是旧状态
+            await self._save_all_pending_tasks()
             
-            current_time = datetime.now()
-            tasks_to_remove = []
+            task_dicts = await self.store.query(
+                user_id=user_id, statuses=[status.value for status in FINISHED_STATUSES])
             
-            for task_id, task_dict in user_tasks.items():
-                task = self._dict_to_task_progress(task_dict)
-                
-                # 检查任务是否已完成且超过最大年龄
-                if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]:
-                    if task.end_time:
-                        age_hours = (current_time - task.end_time).total_seconds() / 3600
-                        if age_hours > max_age_hours:
-                            tasks_to_remove.append(task_id)
+            cutoff = datetime.now() - timedelta(hours=max_age_hours)
+            expired = [task_dict for task_dict in task_dicts
+                       if task_dict.get('end_time') and datetime.fromisoformat(task_dict['end_time']) < cutoff]
             
-            # 移除过期任务
-            for task_id in tasks_to_remove:
-                del user_tasks[task_id]
+            if expired:
+                await self.store.archive(expired)
                 with self._cache_lock:
-                    self._task_cache.pop(task_id, None)
+                    for task_dict in expired:
+                        self._task_cache.pop(task_dict['task_id'], None)
+                self.stats['tasks_archived'] += len(expired)
+                logger.info(f"归档已结束的任务: {user_id or '所有用户'} ({len(expired)} 个)")
             
-            if tasks_to_remove:
-                # 保存更新后的任务列表
-                user_config['active_tasks'] = user_tasks
-                user_config['updated_at'] = datetime.now().isoformat()
-                await self.data_manager.save_user_config(user_id, user_config)
-                
-                logger.info(f"清理完成的任务: {user_id} ({len(tasks_to_remove)} 个)")
+            pruned = await self.store.prune_archive(datetime.now() - timedelta(days=self.archive_retention_days))
+            if pruned:
+                logger.info(f"删除过期的归档任务: {pruned} 个")
             
         except Exception as e:
-            logger.error(f"清理完成任务失败 {user_id}: {e}")
+            logger.error(f"清理完成任务失败 {user_id or '所有用户'}: {e}")
     
     def get_stats(self) -> Dict[str, Any]:
         """获取统计信息"""
@@ -530,8 +557,11 @@ async def start_task_state_manager(bot_id: str = "default_bot"):
 
 async def stop_task_state_manager(bot_id: str = "default_bot"):
     """停止任务状态管理器"""
+    global _global_task_state_manager
     manager = get_global_task_state_manager(bot_id)
     await manager.stop_auto_save()
+    await manager.store.close()
+    _global_task_state_manager = None
 
 __all__ = [
     "TaskStateManager",
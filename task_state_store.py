@@ -0,0 +1,288 @@
+# ==================== 任务状态存储 ====================
+"""
+任务状态存储
+任务进度按task_id单独存储，不再写入用户配置的 active_tasks：
+- Firestore：bots/{bot_id}/task_states/{task_id}，按 user_id、status 字段查询；
+  归档到 bots/{bot_id}/task_archive/{task_id}，旧任务迁移标记在 bots/{bot_id}/meta/task_states
+- SQLite（本地存储或Firebase不可用时）：data/{bot_id}/task_states.db，
+  task_states 表带 (user_id, status) 索引，归档到 task_archive 表
+每次落盘把所有待保存任务合并为一次批量写入；用户配置大小与任务数量无关。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from firebase_write_scheduler import WriteDeferredError, get_global_write_scheduler
+from firestore_executor import run_firestore
+from log_config import get_logger
+logger = get_logger(__name__)
+
+# Firestore单个批量写入的操作数上限
+FIRESTORE_BATCH_LIMIT = 500
+
+class FirestoreTaskStateStore:
+    """Firestore任务状态存储"""
+    
+    def __init__(self, db, bot_id: str):
+        self.db = db
+        self.bot_id = bot_id
+        bot_doc = db.collection('bots').document(bot_id)
+        self.collection = bot_doc.collection('task_states')
+        self.archive_collection = bot_doc.collection('task_archive')
+        self.marker_doc = bot_doc.collection('meta').document('task_states')
+        # 与批量队列共用写入调度：提交前申请配额，提交后计入配额使用
+        self.write_scheduler = get_global_write_scheduler(bot_id)
+    
+    def _admit(self, writes: List[tuple]):
+        """按写入调度检查配额，不足时抛出 WriteDeferredError（调用方保留待写入数据，下次重试）"""
+        if self.write_scheduler is None:
+            return
+        counts: Dict[tuple, int] = {}
+        for operation, doc_ref, data in writes:
+            collection, document = doc_ref.path.rsplit('/', 1)
+            priority = self.write_scheduler.classify(collection, document, data=data)
+            key = (priority, 'delete' if operation == 'delete' else 'write')
+            counts[key] = counts.get(key, 0) + 1
+        for (priority, operation_type), count in counts.items():
+            if not self.write_scheduler.admit(priority, operation_type, count):
+                raise WriteDeferredError(f"写入配额不足，{len(writes)} 个任务状态写入延后")
+    
+    def _commit_in_batches(self, writes: List[tuple]):
+        """按上限分批提交 (操作, 文档引用, 数据)（在Firestore线程池中执行）"""
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            chunk = writes[start:start + FIRESTORE_BATCH_LIMIT]
+            batch = self.db.batch()
+            for operation, doc_ref, data in chunk:
+                if operation == 'set':
+                    batch.set(doc_ref, data)
+                else:
+                    batch.delete(doc_ref)
+            batch.commit()
+            if self.write_scheduler is not None:
+                self.write_scheduler.record_commit([{'type': operation} for operation, _, _ in chunk])
+    
+    async def save_many(self, records: List[Dict[str, Any]]) -> int:
+        """批量保存任务记录，返回保存数量"""
+        if not records:
+            return 0
+        writes = [('set', self.collection.document(record['task_id']), record) for record in records]
+        self._admit(writes)
+        await run_firestore('task_states.commit', self._commit_in_batches, writes, timeout=30.0)
+        return len(records)
+    
+    async def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """加载单个任务记录"""
+        doc = await run_firestore('task_states.get', self.collection.document(task_id).get)
+        return doc.to_dict() if doc.exists else None
+    
+    async def query(self, user_id: Optional[str] = None,
+                    statuses: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """按用户和状态查询任务记录"""
+        query = self.collection
+        if user_id is not None:
+            query = query.where('user_id', '==', user_id)
+        statuses = list(statuses) if statuses else None
+        if statuses:
+            query = query.where('status', 'in', statuses)
+        docs = await run_firestore('task_states.query', lambda: list(query.stream()))
+        return [doc.to_dict() for doc in docs]
+    
+    async def archive(self, records: List[Dict[str, Any]]) -> int:
+        """把任务记录移到归档集合"""
+        if not records:
+            return 0
+        archived_at = datetime.now().isoformat()
+        writes = []
+        for record in records:
+            writes.append(('set', self.archive_collection.document(record['task_id']),
+                           {**record, 'archived_at': archived_at}))
+            writes.append(('delete', self.collection.document(record['task_id']), None))
+        self._admit(writes)
+        await run_firestore('task_states.archive', self._commit_in_batches, writes, timeout=30.0)
+        return len(records)
+    
+    async def prune_archive(self, before: datetime) -> int:
+        """删除早于指定时间归档的记录"""
+        query = self.archive_collection.where('archived_at', '<', before.isoformat())
+        docs = await run_firestore('task_archive.query', lambda: list(query.stream()))
+        if not docs:
+            return 0
+        writes = [('delete', doc.reference, None) for doc in docs]
+        self._admit(writes)
+        await run_firestore('task_archive.prune', self._commit_in_batches, writes, timeout=30.0)
+        return len(docs)
+    
+    async def is_legacy_migrated(self) -> bool:
+        """用户配置中的旧 active_tasks 是否已迁移完成"""
+        doc = await run_firestore('task_states.marker', self.marker_doc.get)
+        return bool(doc.exists and (doc.to_dict() or {}).get('legacy_migrated'))
+    
+    async def mark_legacy_migrated(self):
+        """写入旧任务迁移完成标记"""
+        await run_firestore('task_states.marker', self.marker_doc.set,
+                            {'legacy_migrated': True, 'migrated_at': datetime.now().isoformat()})
+    
+    async def close(self):
+        pass
+
+class SQLiteTaskStateStore:
+    """SQLite任务状态存储"""
+    
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS task_states (
+        task_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        updated_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_task_states_user_status ON task_states (user_id, status);
+    CREATE TABLE IF NOT EXISTS task_archive (
+        task_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        archived_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_task_archive_archived_at ON task_archive (archived_at);
+    CREATE TABLE IF NOT EXISTS task_state_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+    
+    def __init__(self, bot_id: str):
+        self.bot_id = bot_id
+        self.db_file = os.path.join(f"data/{bot_id}", "task_states.db")
+        # 单线程执行器：连接只在该线程中使用
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"task-state-db-{bot_id}")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._open).result()
+    
+    def _open(self):
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        self._conn = conn
+    
+    async def _run(self, operation, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, operation, *args)
+    
+    def _transaction(self, statements: List[tuple]):
+        """在一个事务中执行 (SQL, 参数列表)（在数据库线程中执行）"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, rows in statements:
+                conn.executemany(sql, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    async def save_many(self, records: List[Dict[str, Any]]) -> int:
+        """批量保存任务记录（一个事务），返回保存数量"""
+        if not records:
+            return 0
+        updated_at = datetime.now().isoformat()
+        rows = [(record['task_id'], str(record['user_id']), record['status'], updated_at,
+                 json.dumps(record, ensure_ascii=False)) for record in records]
+        await self._run(self._transaction, [(
+            "INSERT INTO task_states (task_id, user_id, status, updated_at, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(task_id) DO UPDATE SET user_id = excluded.user_id, status = excluded.status, "
+            "updated_at = excluded.updated_at, data = excluded.data", rows)])
+        return len(records)
+    
+    async def load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """加载单个任务记录"""
+        def operation():
+            return self._conn.execute("SELECT data FROM task_states WHERE task_id = ?", (task_id,)).fetchone()
+        row = await self._run(operation)
+        return json.loads(row[0]) if row else None
+    
+    async def query(self, user_id: Optional[str] = None,
+                    statuses: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """按用户和状态查询任务记录"""
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(str(user_id))
+        statuses = list(statuses) if statuses else None
+        if statuses:
+            conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+            params.extend(statuses)
+        sql = "SELECT data FROM task_states"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        
+        def operation():
+            return self._conn.execute(sql, params).fetchall()
+        return [json.loads(data) for (data,) in await self._run(operation)]
+    
+    async def archive(self, records: List[Dict[str, Any]]) -> int:
+        """把任务记录移到归档表"""
+        if not records:
+            return 0
+        archived_at = datetime.now().isoformat()
+        await self._run(self._transaction, [
+            ("INSERT OR REPLACE INTO task_archive (task_id, user_id, status, archived_at, data) "
+             "VALUES (?, ?, ?, ?, ?)",
+             [(record['task_id'], str(record['user_id']), record['status'], archived_at,
+               json.dumps(record, ensure_ascii=False)) for record in records]),
+            ("DELETE FROM task_states WHERE task_id = ?", [(record['task_id'],) for record in records])
+        ])
+        return len(records)
+    
+    async def prune_archive(self, before: datetime) -> int:
+        """删除早于指定时间归档的记录"""
+        def operation():
+            return self._conn.execute("DELETE FROM task_archive WHERE archived_at < ?",
+                                      (before.isoformat(),)).rowcount
+        return await self._run(operation)
+    
+    async def is_legacy_migrated(self) -> bool:
+        """用户配置中的旧 active_tasks 是否已迁移完成"""
+        def operation():
+            return self._conn.execute("SELECT value FROM task_state_meta WHERE key = 'legacy_migrated'").fetchone()
+        return await self._run(operation) is not None
+    
+    async def mark_legacy_migrated(self):
+        """写入旧任务迁移完成标记"""
+        def operation():
+            self._conn.execute("INSERT OR REPLACE INTO task_state_meta (key, value) VALUES ('legacy_migrated', ?)",
+                               (datetime.now().isoformat(),))
+        await self._run(operation)
+    
+    async def close(self):
+        """关闭数据库"""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+def create_task_state_store(bot_id: str, data_manager=None, use_local_storage: bool = False):
+    """创建任务状态存储：Firebase可用且未使用本地存储时用Firestore，否则用SQLite"""
+    if not use_local_storage and data_manager is not None:
+        db = getattr(data_manager, 'db', None)
+        optimized_manager = getattr(data_manager, 'optimized_manager', None)
+        if db is None and optimized_manager is not None:
+            db = optimized_manager.db
+        if db is not None:
+            logger.info(f"✅ 任务状态使用Firestore独立集合存储 (Bot: {bot_id})")
+            return FirestoreTaskStateStore(db, bot_id)
+    logger.info(f"✅ 任务状态使用SQLite存储 (Bot: {bot_id})")
+    return SQLiteTaskStateStore(bot_id)
+
+__all__ = [
+    "FirestoreTaskStateStore",
+    "SQLiteTaskStateStore",
+    "create_task_state_store"
+]
@@ -13,6 +13,7 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, Optional, List
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError, PhoneCodeInvalidError
+from firestore_executor import run_firestore
 
 logger = logging.getLogger(__name__)
 
@@ -49,8 +50,11 @@ class UserSessionManager:
         # 创建sessions目录
         os.makedirs(self.sessions_dir, exist_ok=True)
         
-        # 加载现有session元数据
-        self._load_session_metadata()
+        # 加载现有session元数据（Firebase元数据在首次使用时异步加载）
+        self._metadata_loaded = False
+        self._metadata_lock = asyncio.Lock()
+        if not self.use_firebase_sessions:
+            self._load_session_metadata()
         
         logger.info(f"✅ UserSessionManager初始化完成 - Bot: {bot_id}, 环境: {'Render' if is_render else '本地'}")
     
@@ -63,23 +67,28 @@ class UserSessionManager:
         return os.path.join(self.sessions_dir, "metadata.json")
     
     def _load_session_metadata(self):
-        """加载session元数据"""
+        """从本地文件加载session元数据"""
         try:
-            if self.use_firebase_sessions:
-                # Render环境：从Firebase加载元数据
-                self._load_firebase_metadata()
+            metadata_path = self._get_metadata_path()
+            if os.path.exists(metadata_path):
+                import json
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    self.session_metadata = json.load(f)
             else:
-                # 本地环境：从文件加载元数据
-                metadata_path = self._get_metadata_path()
-                if os.path.exists(metadata_path):
-                    import json
-                    with open(metadata_path, 'r', encoding='utf-8') as f:
-                        self.session_metadata = json.load(f)
-                else:
-                    self.session_metadata = {}
+                self.session_metadata = {}
         except Exception as e:
             logger.error(f"加载session元数据失败: {e}")
             self.session_metadata = {}
+        self._metadata_loaded = True
+    
+    async def _ensure_metadata_loaded(self):
+        """Render环境：首次使用前从Firebase加载session元数据"""
+        if self._metadata_loaded:
+            return
+        async with self._metadata_lock:
+            if not self._metadata_loaded:
+                await self._load_firebase_metadata()
+                self._metadata_loaded = True
     
     def _save_session_metadata(self):
         """保存session元数据"""
@@ -96,7 +105,7 @@ class UserSessionManager:
         except Exception as e:
             logger.error(f"保存session元数据失败: {e}")
     
-    def _load_firebase_metadata(self):
+    async def _load_firebase_metadata(self):
         """从Firebase加载session元数据"""
         try:
             from multi_bot_data_manager import create_multi_bot_data_manager
@@ -105,7 +114,7 @@ class UserSessionManager:
             if data_manager.initialized:
                 # 从Firebase获取session元数据
                 doc_ref = data_manager.db.collection('bots').document(self.bot_id).collection('system').document('session_metadata')
-                doc = doc_ref.get()
+                doc = await run_firestore('session_metadata.get', doc_ref.get)
                 
                 if doc.exists:
                     self.session_metadata = doc.to_dict()
@@ -188,7 +197,7 @@ class UserSessionManager:
             if data_manager.initialized:
                 # 从Firebase获取session数据
                 doc_ref = data_manager.db.collection('bots').document(self.bot_id).collection('user_sessions').document(user_id)
-                doc = doc_ref.get()
+                doc = await run_firestore('user_sessions.get', doc_ref.get)
                 
                 if doc.exists:
                     session_b64 = doc.to_dict().get('session_data')
@@ -218,6 +227,7 @@ class UserSessionManager:
             bool: 是否创建成功
         """
         try:
+            await self._ensure_metadata_loaded()
             session_path = self._get_session_path(user_id)
             
             # 检查是否已有有效session
@@ -318,6 +328,7 @@ class UserSessionManager:
             TelegramClient: 用户专属的客户端实例
         """
         try:
+            await self._ensure_metadata_loaded()
             # 如果客户端已在缓存中，直接返回
             if user_id in self.active_sessions:
                 # 更新最后使用时间
@@ -379,6 +390,7 @@ class UserSessionManager:
     async def delete_user_session(self, user_id: str) -> bool:
         """删除用户的session"""
         try:
+            await self._ensure_metadata_loaded()
             # 断开连接
             if user_id in self.active_sessions:
                 await self.active_sessions[user_id].disconnect()
@@ -408,6 +420,7 @@ class UserSessionManager:
     async def cleanup_inactive_sessions(self, days: int = 30):
         """清理不活跃的session"""
         try:
+            await self._ensure_metadata_loaded()
             cutoff_date = datetime.now() - timedelta(days=days)
             inactive_users = []
             
@@ -428,6 +441,7 @@ class UserSessionManager:
     async def get_session_stats(self) -> Dict[str, Any]:
         """获取session统计信息"""
         try:
+            await self._ensure_metadata_loaded()
             total_sessions = len(self.session_metadata)
             active_sessions = len(self.active_sessions)
             
@@ -30,6 +30,7 @@ class WebServer:
         self.app.router.add_get('/health', self.health_check)
         self.app.router.add_get('/status', self.bot_status)
         self.app.router.add_get('/ping', self.ping)
+        self.app.router.add_get('/monitoring/latency', self.monitoring_latency)
         
     async def health_check(self, request):
         """健康检查端点"""
@@ -96,6 +97,30 @@ class WebServer:
                 'timestamp': datetime.now().isoformat()
             }, status=500)
             
+    async def monitoring_latency(self, request):
+        """监听延迟直方图端点（可用 task_id / target 参数筛选）"""
+        try:
+            engine = getattr(self.bot_instance, 'realtime_monitoring_engine', None) if self.bot_instance else None
+            if not engine:
+                return web.json_response({
+                    'error': '监听引擎未运行',
+                    'timestamp': datetime.now().isoformat()
+                }, status=503)
+            
+            latency_data = engine.get_latency_stats(
+                task_id=request.query.get('task_id'),
+                target=request.query.get('target')
+            )
+            latency_data['timestamp'] = datetime.now().isoformat()
+            return web.json_response(latency_data)
+        
+        except Exception as e:
+            logger.error(f"获取监听延迟统计失败: {e}")
+            return web.json_response({
+                'error': str(e),
+                'timestamp': datetime.now().isoformat()
+            }, status=500)
+    
     async def start_server(self, host='0.0.0.0', port=None):
         """启动Web服务器"""
         if port is None: